@@ -0,0 +1,36 @@
+"""add metrics ingest seq
+
+Revision ID: b7c2e9d41f03
+Revises: 1260f63e32b1
+Create Date: 2026-10-17 20:15:42.118305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7c2e9d41f03'
+down_revision: Union[str, Sequence[str], None] = '1260f63e32b1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(sa.schema.CreateSequence(sa.Sequence('metrics_ingest_seq')))
+    # existing rows are numbered as the column is added
+    op.add_column('metrics', sa.Column(
+        'ingest_seq', sa.BigInteger(), server_default=sa.text("nextval('metrics_ingest_seq')"), nullable=False
+    ))
+    op.execute("ALTER SEQUENCE metrics_ingest_seq OWNED BY metrics.ingest_seq")
+    op.create_index('ix_metrics_id_ingest_seq', 'metrics', ['id', 'ingest_seq'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_metrics_id_ingest_seq', table_name='metrics')
+    # the sequence is owned by the column and dropped with it
+    op.drop_column('metrics', 'ingest_seq')
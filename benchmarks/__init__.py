@@ -0,0 +1,43 @@
+import os
+import statistics
+import time
+from typing import Callable, Awaitable
+
+from src.infrastructure import Settings
+
+
+def benchmark_settings(**overrides) -> Settings:
+    """
+    settings for running benchmarks against the database in DATABASE_URL
+    """
+    return Settings(
+        USER_POOL_CLIENT_ID="benchmark",
+        USER_POOL_ID="benchmark",
+        AWS_REGION="benchmark",
+        DATABASE_URL=os.environ["DATABASE_URL"],
+        **overrides
+    )
+
+
+async def measure(name: str, action: Callable[[], Awaitable], iterations: int) -> list[float]:
+    """
+    runs the action sequentially and prints latency percentiles in milliseconds
+    """
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await action()
+        timings.append((time.perf_counter() - started) * 1000)
+    report(name, timings)
+    return timings
+
+
+def report(name: str, timings: list[float]):
+    ordered = sorted(timings)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(
+        f"{name:<40} n={len(ordered):<6} "
+        f"mean={statistics.mean(ordered):8.3f}ms "
+        f"p50={statistics.median(ordered):8.3f}ms "
+        f"p99={p99:8.3f}ms"
+    )
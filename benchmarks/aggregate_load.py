@@ -0,0 +1,59 @@
+"""
+latency of loading one configuration aggregate, orm with selectinload vs the single json_agg statement,
+both bypass the cache
+
+    DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.aggregate_load
+"""
+import asyncio
+import itertools
+import logging
+
+import structlog
+from sqlalchemy import select, text
+from sqlalchemy.orm import selectinload
+
+from benchmarks import benchmark_settings, measure
+from src.core import MetricConfigurationAggregate
+from src.infrastructure import SqlAlchemyConnectionPool
+from src.infrastructure.orm import start_mappers
+from src.infrastructure.readers import SqlAlchemyMetricAggregateReader
+
+ITERATIONS = 500
+
+
+async def main():
+    start_mappers()
+    settings = benchmark_settings()
+    logger = structlog.getLogger()
+    pool = SqlAlchemyConnectionPool(settings, logger)
+    await pool.start()
+
+    async with pool.session_factory() as session:
+        ids = itertools.cycle((await session.execute(text("SELECT id FROM metric_configurations"))).scalars().all())
+
+    async def orm():
+        # the reader before, joined mappings plus selectinload and the identity map
+        async with pool.session_factory() as session:
+            result = await session.execute(
+                select(MetricConfigurationAggregate).where(MetricConfigurationAggregate.id == next(ids)).options(
+                    selectinload(MetricConfigurationAggregate.layouts),
+                    selectinload(MetricConfigurationAggregate.query),
+                )
+            )
+            result.scalar_one_or_none()
+
+    load_snapshot = SqlAlchemyMetricAggregateReader.__call__.__wrapped__
+
+    async def json_agg():
+        async with pool.session_factory() as session:
+            await load_snapshot(SqlAlchemyMetricAggregateReader(session, logger=logger), _id=next(ids))
+
+    await measure("before: orm with selectinload", orm, ITERATIONS)
+    await measure("after: single json_agg statement", json_agg, ITERATIONS)
+    await pool.stop()
+
+
+if __name__ == "__main__":
+    # the reader logs every load, keep the output to the results
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    asyncio.run(main())
@@ -0,0 +1,43 @@
+"""
+payload size and encoding time of a 100k row time series, row objects against format=columnar,
+both encoded from the same record batch
+
+    DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.columnar
+"""
+import asyncio
+import logging
+
+import structlog
+
+from benchmarks import benchmark_settings, measure
+from benchmarks.raw_records import CONFIGURATION, PARAMS, ROWS
+from src.core import Metrics
+from src.infrastructure import SqlAlchemyConnectionPool
+from src.infrastructure.readers import AsyncpgMetricRecordBatchReader
+from src.web.encoding import encode_metrics, encode_columnar_metrics
+
+ITERATIONS = 20
+
+
+async def main():
+    logger = structlog.getLogger()
+    pool = SqlAlchemyConnectionPool(benchmark_settings(DB_POOL_SIZE=1, DB_POOL_WARM_UP_CONNECTIONS=1), logger)
+    await pool.start()
+    async with pool.session_factory() as session:
+        reader = AsyncpgMetricRecordBatchReader(session, logger)
+        batch = await AsyncpgMetricRecordBatchReader.__call__.__wrapped__(reader, **PARAMS)
+    await pool.stop()
+    metrics = Metrics(configuration=CONFIGURATION, record_set=batch)
+    print(f"{ROWS} rows of {len(batch.columns)} columns")
+
+    for name, encode in (("rows", encode_metrics), ("columnar", encode_columnar_metrics)):
+        async def encoded():
+            encode(metrics)
+
+        await measure(f"{name}: encode", encoded, ITERATIONS)
+        print(f"{name}: {len(encode(metrics)) / 2 ** 20:.1f}MiB")
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    asyncio.run(main())
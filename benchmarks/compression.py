@@ -0,0 +1,50 @@
+"""
+cpu against bytes for the content codings at a few levels, compressing GET /metrics/{id} bodies
+of 1k and 100k records, with the time the result takes on a slow link, without postgres
+
+    python -m benchmarks.compression
+"""
+import asyncio
+import logging
+import statistics
+
+import structlog
+
+from benchmarks import measure
+from benchmarks.encoding import metrics_of
+from src.web.compression import CompressionSettings, compress
+from src.web.encoding import encode_row_metrics
+
+SIZES = {1_000: 50, 100_000: 5}
+# a slow client link, in bytes per second
+LINK_BYTES_PER_SECOND = 10 * 10 ** 6 / 8
+
+LEVELS = {
+    "gzip": [CompressionSettings(gzip_level=level) for level in (1, 6, 9)],
+    "br": [CompressionSettings(brotli_quality=quality) for quality in (1, 4, 6)],
+    "zstd": [CompressionSettings(zstd_level=level) for level in (1, 3, 9)],
+}
+LEVEL_OF = {"gzip": "gzip_level", "br": "brotli_quality", "zstd": "zstd_level"}
+
+
+async def main():
+    for size, iterations in SIZES.items():
+        body = encode_row_metrics(metrics_of(size))
+        link_ms = len(body) / LINK_BYTES_PER_SECOND * 1000
+        print(f"{size} records, {len(body) / 1024:.1f}KiB identity, {link_ms:.1f}ms on the link")
+        for coding, levels in LEVELS.items():
+            for settings in levels:
+                level = getattr(settings, LEVEL_OF[coding])
+
+                async def compressed():
+                    compress(body, coding, settings)
+
+                timings = await measure(f"{coding} {level}", compressed, iterations)
+                sent = len(compress(body, coding, settings))
+                total_ms = statistics.median(timings) + sent / LINK_BYTES_PER_SECOND * 1000
+                print(f"    ratio={len(body) / sent:5.1f}x sent={sent / 1024:8.1f}KiB compress+link={total_ms:8.1f}ms")
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    asyncio.run(main())
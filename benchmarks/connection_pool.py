@@ -0,0 +1,42 @@
+"""
+per request latency of a unit of work, engine per request vs the shared pool
+
+    DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.connection_pool
+"""
+import asyncio
+
+import structlog
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from benchmarks import benchmark_settings, measure
+from src.infrastructure import SqlAlchemyConnectionPool, SqlAlchemyUnitOfWork
+
+ITERATIONS = 200
+
+
+async def main():
+    settings = benchmark_settings()
+    logger = structlog.getLogger()
+
+    async def engine_per_request():
+        # what every request used to do, an engine and pool that is never disposed
+        engine = create_async_engine(settings.DATABASE_URL, echo=False, future=True)
+        session_factory = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+        async with session_factory() as session:
+            await session.execute(text("SELECT 1"))
+
+    pool = SqlAlchemyConnectionPool(settings, logger)
+    await pool.start()
+
+    async def shared_pool():
+        async with SqlAlchemyUnitOfWork(pool, logger) as uow:
+            await uow.session.execute(text("SELECT 1"))
+
+    await measure("before: engine per request", engine_per_request, ITERATIONS)
+    await measure("after: shared warmed pool", shared_pool, ITERATIONS)
+    await pool.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
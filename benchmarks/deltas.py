@@ -0,0 +1,105 @@
+"""
+a dashboard polling a 100k row window, reading and encoding the whole window on every poll against
+asking for what changed since its watermark, both when nothing was written and after a single row was,
+metric rows are inserted for a benchmark query id and deleted afterwards
+
+    DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.deltas
+"""
+import asyncio
+import logging
+from uuid import uuid4
+
+import structlog
+from sqlalchemy import text
+
+from benchmarks import benchmark_settings, measure
+from src.core import QuerySnapshot, MetricRecord, MetricConfigurationSnapshot, MetricsDelta, RecordDelta, \
+    DEFAULT_START_DATE, DEFAULT_END_DATE, DEFAULT_DAY_RANGE
+from src.infrastructure import SqlAlchemyConnectionPool
+from src.infrastructure.caching import CACHE_REGISTRY, RECORD_SNAPSHOTS_CACHE
+from src.infrastructure.orm import start_mappers
+from src.infrastructure.readers import SqlAlchemyMetricRecordsDeltaReader
+from src.infrastructure.writers import SqlAlchemyMetricRecordWriter
+from src.web.encoding import encode_metrics_delta
+
+ITERATIONS = 20
+ROWS = 100_000
+QUERY_ID = "benchmark-deltas"
+
+QUERY = QuerySnapshot(
+    id=QUERY_ID,
+    query=f"""
+        SELECT metric_id, date, parts_flagged, alert_type
+        FROM metrics
+        WHERE id = '{QUERY_ID}' AND date BETWEEN :start_date AND :end_date AND :day_range > 0
+    """
+)
+CONFIGURATION = MetricConfigurationSnapshot(
+    id="benchmark", query_id=QUERY.id, is_editable=True, query=QUERY, layouts=(), version="benchmark"
+)
+WINDOW = {"start_date": DEFAULT_START_DATE, "end_date": DEFAULT_END_DATE, "day_range": DEFAULT_DAY_RANGE}
+
+
+async def main():
+    logger = structlog.getLogger()
+    start_mappers()
+    CACHE_REGISTRY[RECORD_SNAPSHOTS_CACHE].configure(
+        ttl_seconds=3600, hard_ttl_seconds=3600, max_entries=100, max_bytes=2 ** 30
+    )
+    pool = SqlAlchemyConnectionPool(benchmark_settings(DB_POOL_SIZE=1, DB_POOL_WARM_UP_CONNECTIONS=1), logger)
+    await pool.start()
+    async with pool.session_factory() as session:
+        await session.execute(text(f"""
+            INSERT INTO metrics (metric_id, id, date, parts_flagged, alert_type)
+            SELECT '{QUERY_ID}-' || n, '{QUERY_ID}', DATE '2025-06-01' + (n % 30), n,
+                   CASE WHEN n % 3 = 0 THEN 'Critical' ELSE 'Warning' END
+            FROM generate_series(1, {ROWS}) AS n
+        """))
+        await session.commit()
+    print(f"{ROWS} rows per window")
+
+    try:
+        async def full():
+            async with pool.session_factory() as session:
+                result = await session.execute(text(QUERY.query), WINDOW)
+                records = [dict(row) for row in result.mappings().all()]
+            return encode_metrics_delta(MetricsDelta(CONFIGURATION, RecordDelta(records, [], 0)))
+
+        async def poll(since: int):
+            async with pool.session_factory() as session:
+                read = SqlAlchemyMetricRecordsDeltaReader(session, logger)
+                return await read(QUERY, **WINDOW, since=since)
+
+        async def write():
+            async with pool.session_factory() as session:
+                await SqlAlchemyMetricRecordWriter(session)(MetricRecord(
+                    metric_id=f"{QUERY_ID}-{uuid4()}", id=QUERY_ID, date=DEFAULT_START_DATE, alert_type="Warning"
+                ))
+                await session.commit()
+
+        watermark = (await poll(0)).watermark
+
+        async def unchanged():
+            return encode_metrics_delta(MetricsDelta(CONFIGURATION, await poll(watermark)))
+
+        async def one_write():
+            nonlocal watermark
+            await write()
+            changes = await poll(watermark)
+            watermark = changes.watermark
+            return encode_metrics_delta(MetricsDelta(CONFIGURATION, changes))
+
+        print(f"full body {len(await full())} bytes, after one write {len(await one_write())} bytes")
+        await measure("before: full window per poll", full, ITERATIONS)
+        await measure("after: since, nothing written", unchanged, ITERATIONS)
+        await measure("after: since, one row written", one_write, ITERATIONS)
+    finally:
+        async with pool.session_factory() as session:
+            await session.execute(text("DELETE FROM metrics WHERE id = :id"), {"id": QUERY_ID})
+            await session.commit()
+        await pool.stop()
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    asyncio.run(main())
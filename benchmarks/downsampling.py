@@ -0,0 +1,63 @@
+"""
+a 100k record time series, two series a minute apart over about 35 days each, encoded whole
+against downsampled to max_points=1000 per series and then encoded, without postgres
+
+    python -m benchmarks.downsampling
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import structlog
+
+from benchmarks import measure
+from benchmarks.raw_records import CONFIGURATION
+from src.core import Metrics, RecordSet, Downsampling
+from src.infrastructure.downsampling import NumpyRecordsDownsampler
+from src.web.encoding import encode_metrics_response
+
+ROWS = 100_000
+MAX_POINTS = 1_000
+ITERATIONS = 20
+
+
+def batch_of(size: int):
+    started = datetime(2025, 6, 1)
+    records = [
+        {
+            "at": started + timedelta(minutes=n // 2),
+            "alert_type": "Critical" if n % 2 else "Warning",
+            "parts_flagged": n % 97,
+            "avg_per_day": Decimal(n % 7) / 4,
+        }
+        for n in range(size)
+    ]
+    return RecordSet(records=records, version="benchmark").to_batch()
+
+
+async def main():
+    batch = batch_of(ROWS)
+    downsample = NumpyRecordsDownsampler()
+    body = encode_metrics_response(Metrics(configuration=CONFIGURATION, record_set=batch))
+    print(f"{ROWS} records, {len(body) / 2 ** 20:.1f}MiB encoded whole")
+
+    async def whole():
+        encode_metrics_response(Metrics(configuration=CONFIGURATION, record_set=batch))
+
+    await measure("before: every record", whole, ITERATIONS)
+    for method in Downsampling:
+        downsampled = downsample(batch, MAX_POINTS, method)
+        sent = len(encode_metrics_response(Metrics(configuration=CONFIGURATION, record_set=downsampled)))
+
+        async def sampled():
+            encode_metrics_response(
+                Metrics(configuration=CONFIGURATION, record_set=downsample(batch, MAX_POINTS, method))
+            )
+
+        await measure(f"after: {method.value} {len(downsampled)} records {sent / 2 ** 10:.0f}KiB", sampled, ITERATIONS)
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+"""
+encoding GET /metrics/{id} bodies of 10, 1k and 100k records without postgres, fastapi's
+response_model validation and json rendering against the orjson body the route now returns
+
+    python -m benchmarks.encoding
+"""
+import asyncio
+import logging
+from datetime import timedelta
+from decimal import Decimal
+from typing import Union
+
+import structlog
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from benchmarks import measure
+from benchmarks.raw_records import CONFIGURATION
+from src.application.mappers import map_metrics_to_contract
+from src.core import Metrics, RecordSet, DEFAULT_START_DATE
+from src.web.contracts import MetricsResponse, ColumnarMetricsResponse
+from src.web.encoding import encode_row_metrics
+
+SIZES = {10: 200, 1_000: 50, 100_000: 5}
+
+# the field the route declares, so the baseline validates what fastapi validated
+RESPONSE_FIELD = create_model_field(
+    "Response_get_metrics", Union[MetricsResponse, ColumnarMetricsResponse], mode="serialization"
+)
+
+
+def metrics_of(size: int) -> Metrics:
+    records = [
+        {
+            "day": DEFAULT_START_DATE + timedelta(days=n % 30),
+            "parts_flagged": n,
+            "obsolescence": n * 1.25,
+            "avg_per_day": Decimal(n % 7),
+            "alert_type": "Critical" if n % 3 == 0 else "Warning",
+        }
+        for n in range(size)
+    ]
+    return Metrics(configuration=CONFIGURATION, record_set=RecordSet(records=records, version="benchmark"))
+
+
+async def main():
+    for size, iterations in SIZES.items():
+        metrics = metrics_of(size)
+
+        async def validated():
+            content = await serialize_response(field=RESPONSE_FIELD, response_content=map_metrics_to_contract(metrics))
+            JSONResponse(content)
+
+        async def encoded():
+            encode_row_metrics(metrics)
+
+        await measure(f"before: {size} records, response_model", validated, iterations)
+        await measure(f"after: {size} records, orjson", encoded, iterations)
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    asyncio.run(main())
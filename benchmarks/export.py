@@ -0,0 +1,50 @@
+"""
+a 100k row window exported for analysis tools, streamed as ndjson records against arrow and
+parquet written from cursor batches and csv copied by postgres, timings include tracemalloc's overhead
+
+    DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.export
+"""
+import asyncio
+import logging
+
+import structlog
+
+from benchmarks import benchmark_settings
+from benchmarks.raw_records import PARAMS, ROWS
+from benchmarks.streaming import profile
+from src.core import ExportFormat
+from src.infrastructure import SqlAlchemyConnectionPool
+from src.infrastructure.exports import AsyncpgMetricRecordsExporter
+from src.infrastructure.readers import SqlAlchemyMetricRecordsStreamer
+from src.web.encoding import encode_ndjson
+
+
+async def main():
+    logger = structlog.getLogger()
+    pool = SqlAlchemyConnectionPool(benchmark_settings(DB_POOL_SIZE=1, DB_POOL_WARM_UP_CONNECTIONS=1), logger)
+    await pool.start()
+    print(f"{ROWS} rows per export")
+
+    async def streamed():
+        async with pool.session_factory() as session:
+            stream = SqlAlchemyMetricRecordsStreamer(session, logger)
+            async for chunk in encode_ndjson(stream(**PARAMS)):
+                yield chunk
+
+    def exported(format: ExportFormat):
+        async def chunks():
+            async with pool.session_factory() as session:
+                export = AsyncpgMetricRecordsExporter(session, logger)
+                async for chunk in export(**PARAMS, format=format):
+                    yield chunk
+        return chunks
+
+    await profile("before: streamed ndjson", streamed)
+    for format in ExportFormat:
+        await profile(f"after: {format.value}", exported(format))
+    await pool.stop()
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    asyncio.run(main())
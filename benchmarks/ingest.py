@@ -0,0 +1,98 @@
+"""
+rows a second written by a gateway, one request a row through the single record service against
+batches through the ingest service, with the batch's json decoded and validated as the route does,
+a benchmark configuration is created with its rows and deleted afterwards
+
+    DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.ingest
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+import orjson
+import structlog
+from punq import Container
+from sqlalchemy import text
+
+from benchmarks import benchmark_settings
+from src.application.mappers import map_metric_record_contract_to_domain, map_ingest_record_contract_to_domain
+from src.application.services import CreateMetricService, IngestMetricRecordsService
+from src.bootstrap import add_database
+from src.infrastructure import SqlAlchemyConnectionPool, SqlAlchemyUnitOfWork
+from src.infrastructure.caching import LocalMetricCacheInvalidator
+from src.infrastructure.subscriptions import InProcessMetricUpdates
+from src.web.contracts import CreateMetricRequest, IngestMetricRecordRequest
+from src.web.encoding import decode_json_rows
+
+SINGLE_ROWS = 1_000
+BATCH_ROWS = 10_000
+BATCHES = 10
+CONFIG_ID = "7d1c9e52-0000-4000-8000-00000000b1e5"
+QUERY_ID = "benchmark-ingest"
+
+
+def reading(n: int) -> dict:
+    return {
+        "metric_configuration_id": CONFIG_ID,
+        "date": f"2025-06-{n % 30 + 1:02}T08:00:00",
+        "obsolescence_val": n / 10,
+        "parts_flagged": n % 50,
+        "alert_type": "Critical" if n % 3 == 0 else "Warning",
+        "alert_category": "Need approval",
+    }
+
+
+async def main():
+    logger = structlog.getLogger()
+    add_database(Container())
+    settings = benchmark_settings(DB_POOL_SIZE=2, DB_POOL_WARM_UP_CONNECTIONS=2)
+    pool = SqlAlchemyConnectionPool(settings, logger)
+    await pool.start()
+    invalidator, updates = LocalMetricCacheInvalidator(), InProcessMetricUpdates(settings, logger, pool)
+    async with pool.session_factory() as session:
+        await session.execute(text("INSERT INTO queries (id, query) VALUES (:id, 'SELECT 1')"), {"id": QUERY_ID})
+        await session.execute(
+            text("INSERT INTO metric_configurations (id, query_id, is_editable) VALUES (:id, :query_id, true)"),
+            {"id": CONFIG_ID, "query_id": QUERY_ID}
+        )
+        await session.commit()
+
+    try:
+        create = CreateMetricService(SqlAlchemyUnitOfWork(pool, logger), invalidator, updates)
+        started = time.perf_counter()
+        for n in range(SINGLE_ROWS):
+            body = orjson.dumps(reading(n))
+            await create(CONFIG_ID, map_metric_record_contract_to_domain(CreateMetricRequest.model_validate_json(body)))
+        single = SINGLE_ROWS / (time.perf_counter() - started)
+
+        ingest = IngestMetricRecordsService(SqlAlchemyUnitOfWork(pool, logger), invalidator, updates)
+        bodies = [orjson.dumps([reading(n) for n in range(BATCH_ROWS)]) for _ in range(BATCHES)]
+        started = time.perf_counter()
+        for body in bodies:
+            received = datetime.now()
+            records = []
+            for row in decode_json_rows(body, ndjson=False):
+                ingest_request = IngestMetricRecordRequest.model_validate(row)
+                records.append((
+                    str(ingest_request.metric_configuration_id),
+                    map_ingest_record_contract_to_domain(ingest_request, received)
+                ))
+            result = await ingest(records)
+            assert result.created == BATCH_ROWS
+        batched = BATCH_ROWS * BATCHES / (time.perf_counter() - started)
+
+        print(f"{'before: one row per request':<40} {single:10.0f} rows/s")
+        print(f"{f'after: {BATCH_ROWS} rows per request':<40} {batched:10.0f} rows/s")
+    finally:
+        async with pool.session_factory() as session:
+            await session.execute(text("DELETE FROM metrics WHERE id = :id"), {"id": QUERY_ID})
+            await session.execute(text("DELETE FROM metric_configurations WHERE id = :id"), {"id": CONFIG_ID})
+            await session.execute(text("DELETE FROM queries WHERE id = :id"), {"id": QUERY_ID})
+            await session.commit()
+        await pool.stop()
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    asyncio.run(main())
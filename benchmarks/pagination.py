@@ -0,0 +1,59 @@
+"""
+latency of the first and a deep page of a 100k row window, LIMIT/OFFSET against the keyset
+pages SqlAlchemyMetricRecordsReader reads, without the records cache
+
+    DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.pagination
+"""
+import asyncio
+import logging
+
+import structlog
+from sqlalchemy import text
+
+from benchmarks import benchmark_settings, measure
+from benchmarks.raw_records import QUERY, PARAMS, ROWS
+from src.infrastructure import SqlAlchemyConnectionPool
+from src.infrastructure.readers import SqlAlchemyMetricRecordsReader
+
+ITERATIONS = 20
+LIMIT = 1000
+DEEP_PAGE = 90
+
+
+async def main():
+    logger = structlog.getLogger()
+    pool = SqlAlchemyConnectionPool(benchmark_settings(DB_POOL_SIZE=1, DB_POOL_WARM_UP_CONNECTIONS=1), logger)
+    await pool.start()
+    print(f"{ROWS} rows, pages of {LIMIT}, deep page {DEEP_PAGE}")
+
+    read_page = SqlAlchemyMetricRecordsReader.__call__.__wrapped__
+    offset_statement = text(
+        f"SELECT * FROM ({QUERY.query}) AS page ORDER BY page LIMIT :page_limit OFFSET :page_offset"
+    )
+
+    async def offset_page(number: int):
+        async with pool.session_factory() as session:
+            params = {"start_date": PARAMS["start_date"], "day_range": PARAMS["day_range"]}
+            params.update(page_limit=LIMIT, page_offset=number * LIMIT)
+            (await session.execute(offset_statement, params)).mappings().all()
+
+    async def keyset_page(after):
+        async with pool.session_factory() as session:
+            return await read_page(SqlAlchemyMetricRecordsReader(session, logger), **PARAMS, limit=LIMIT, after=after)
+
+    # the key a client would hold after reading DEEP_PAGE pages
+    async with pool.session_factory() as session:
+        deep = await read_page(
+            SqlAlchemyMetricRecordsReader(session, logger), **PARAMS, limit=DEEP_PAGE * LIMIT
+        )
+
+    await measure("offset: first page", lambda: offset_page(0), ITERATIONS)
+    await measure("offset: deep page", lambda: offset_page(DEEP_PAGE), ITERATIONS)
+    await measure("keyset: first page", lambda: keyset_page(None), ITERATIONS)
+    await measure("keyset: deep page", lambda: keyset_page(deep.next_after), ITERATIONS)
+    await pool.stop()
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    asyncio.run(main())
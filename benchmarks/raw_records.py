@@ -0,0 +1,75 @@
+"""
+reading and encoding a 100k row stored query result, sqlalchemy row mappings with per row
+dicts validated by MetricsResponse against column batches off the asyncpg connection
+
+    DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.raw_records
+"""
+import asyncio
+import logging
+
+import structlog
+
+from benchmarks import benchmark_settings, measure
+from src.application.mappers import map_metrics_to_contract
+from src.core import QuerySnapshot, Metrics, MetricConfigurationSnapshot, DEFAULT_START_DATE, DEFAULT_END_DATE, \
+    DEFAULT_DAY_RANGE
+from src.infrastructure import SqlAlchemyConnectionPool
+from src.infrastructure.readers import SqlAlchemyMetricRecordsReader, AsyncpgMetricRecordBatchReader
+from src.web.encoding import encode_metrics
+
+ITERATIONS = 20
+ROWS = 100_000
+
+QUERY = QuerySnapshot(
+    id="benchmark-raw-records",
+    query=f"""
+        SELECT
+            (CAST(:start_date AS date) + (n % :day_range)) AS day,
+            n AS parts_flagged,
+            n * 1.25 AS obsolescence,
+            (n % 7)::numeric(10, 2) AS avg_per_day,
+            CASE WHEN n % 3 = 0 THEN 'Critical' ELSE 'Warning' END AS alert_type
+        FROM generate_series(1, {ROWS}) AS n
+    """
+)
+CONFIGURATION = MetricConfigurationSnapshot(
+    id="benchmark", query_id=QUERY.id, is_editable=True, query=QUERY, layouts=(), version="benchmark"
+)
+PARAMS = {"query": QUERY, "start_date": DEFAULT_START_DATE, "end_date": DEFAULT_END_DATE, "day_range": DEFAULT_DAY_RANGE}
+
+
+async def main():
+    logger = structlog.getLogger()
+    pool = SqlAlchemyConnectionPool(benchmark_settings(DB_POOL_SIZE=1, DB_POOL_WARM_UP_CONNECTIONS=1), logger)
+    await pool.start()
+    print(f"{ROWS} rows per read")
+
+    # the undecorated readers, so every iteration goes to postgres
+    read_rows = SqlAlchemyMetricRecordsReader.__call__.__wrapped__
+    read_batch = AsyncpgMetricRecordBatchReader.__call__.__wrapped__
+
+    async def rows():
+        async with pool.session_factory() as session:
+            return await read_rows(SqlAlchemyMetricRecordsReader(session, logger), **PARAMS)
+
+    async def batch():
+        async with pool.session_factory() as session:
+            return await read_batch(AsyncpgMetricRecordBatchReader(session, logger), **PARAMS)
+
+    async def rows_encoded():
+        record_set = await rows()
+        map_metrics_to_contract(Metrics(configuration=CONFIGURATION, record_set=record_set)).model_dump_json()
+
+    async def batch_encoded():
+        encode_metrics(Metrics(configuration=CONFIGURATION, record_set=await batch()))
+
+    await measure("before: read, row dicts", rows, ITERATIONS)
+    await measure("after: read, column batch", batch, ITERATIONS)
+    await measure("before: read + MetricsResponse json", rows_encoded, ITERATIONS)
+    await measure("after: read + batch json", batch_encoded, ITERATIONS)
+    await pool.stop()
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+"""
+cost of a repeat GET /metrics/{id} once the reader caches are warm, encoding the cached metrics
+on every request against sending the body kept in the response cache, without postgres
+
+    python -m benchmarks.response_cache
+"""
+import asyncio
+import logging
+from types import SimpleNamespace
+
+import structlog
+
+from benchmarks import measure
+from benchmarks.encoding import SIZES, metrics_of
+from src.application.services import GetEncodedMetricsService
+from src.core import Metrics, DEFAULT_START_DATE, DEFAULT_END_DATE, DEFAULT_DAY_RANGE
+from src.infrastructure.caching import CACHE_REGISTRY, RESPONSES_CACHE
+from src.infrastructure.prefetch import DecayingAccessTracker
+from src.infrastructure.responses import LruEncodedResponseCache
+from src.web.encoding import encode_metrics_response
+
+WINDOW = {"start_date": DEFAULT_START_DATE, "end_date": DEFAULT_END_DATE, "day_range": DEFAULT_DAY_RANGE}
+
+
+class WarmGetMetrics:
+    """
+    GetMetricsService with every reader cache hit, the metrics are built once up front
+    """
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(self, **_) -> Metrics:
+        return self.metrics
+
+
+async def main():
+    logger = structlog.getLogger()
+    tracker = DecayingAccessTracker(SimpleNamespace(PREFETCH_HALF_LIFE_SECONDS=60, PREFETCH_MAX_TRACKED=100))
+    CACHE_REGISTRY[RESPONSES_CACHE].configure(
+        ttl_seconds=3600, hard_ttl_seconds=3600, max_entries=100, max_bytes=2 ** 30
+    )
+    for size, iterations in SIZES.items():
+        get_metrics = WarmGetMetrics(metrics_of(size))
+        service = GetEncodedMetricsService(get_metrics, LruEncodedResponseCache(logger), tracker)
+
+        async def encoded():
+            encode_metrics_response(await get_metrics(_id="benchmark", **WINDOW))
+
+        async def cached():
+            await service(
+                _id="benchmark", **WINDOW, representation=f"rows-{size}", encode=encode_metrics_response
+            )
+
+        await cached()
+        await measure(f"before: {size} records, encoded per hit", encoded, iterations)
+        await measure(f"after: {size} records, response cache", cached, iterations)
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    asyncio.run(main())
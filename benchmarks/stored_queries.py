@@ -0,0 +1,60 @@
+"""
+latency of repeated dashboard loads, running every stored query for the default window
+without the records cache
+
+    DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.stored_queries
+"""
+import asyncio
+import logging
+
+import structlog
+from sqlalchemy import text
+
+from benchmarks import benchmark_settings, measure
+from src.core import QuerySnapshot, DEFAULT_START_DATE, DEFAULT_END_DATE, DEFAULT_DAY_RANGE
+from src.infrastructure import SqlAlchemyConnectionPool
+
+ITERATIONS = 200
+PARAMS = {"start_date": DEFAULT_START_DATE, "end_date": DEFAULT_END_DATE, "day_range": DEFAULT_DAY_RANGE}
+
+
+async def dashboard_loads(name: str, pool: SqlAlchemyConnectionPool, queries: list[QuerySnapshot], statement):
+    async def load_dashboard():
+        async with pool.session_factory() as session:
+            for query in queries:
+                (await session.execute(statement(query), PARAMS)).mappings().all()
+
+    await pool.start()
+    await measure(name, load_dashboard, ITERATIONS)
+    await pool.stop()
+
+
+async def main():
+    logger = structlog.getLogger()
+    settings = benchmark_settings(DB_POOL_SIZE=1, DB_POOL_WARM_UP_CONNECTIONS=1)
+    unprepared = benchmark_settings(DB_POOL_SIZE=1, DB_POOL_WARM_UP_CONNECTIONS=1, DB_PREPARED_STATEMENT_CACHE_SIZE=0)
+
+    pool = SqlAlchemyConnectionPool(settings, logger)
+    async with pool.session_factory() as session:
+        rows = (await session.execute(text("SELECT id, query FROM queries"))).all()
+    queries = [QuerySnapshot(id=row.id, query=row.query) for row in rows]
+    print(f"{len(queries)} stored queries per dashboard load")
+
+    await dashboard_loads(
+        "prepared statement cache off",
+        SqlAlchemyConnectionPool(unprepared, logger),
+        queries,
+        lambda query: text(query.query)
+    )
+    await dashboard_loads(
+        "prepared statement cache on",
+        SqlAlchemyConnectionPool(settings, logger),
+        queries,
+        lambda query: text(query.query)
+    )
+    await pool.stop()
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+"""
+time to first byte and peak python memory for a 100k row window, buffered into one document
+against streamed from a server side cursor, timings include tracemalloc's overhead
+
+    DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.streaming
+"""
+import asyncio
+import logging
+import time
+import tracemalloc
+
+import structlog
+
+from benchmarks import benchmark_settings
+from benchmarks.raw_records import CONFIGURATION, PARAMS, ROWS
+from src.application.mappers import map_metrics_to_contract
+from src.core import Metrics
+from src.infrastructure import SqlAlchemyConnectionPool
+from src.infrastructure.readers import SqlAlchemyMetricRecordsReader, SqlAlchemyMetricRecordsStreamer
+from src.web.encoding import encode_ndjson
+
+
+async def profile(name: str, chunks):
+    tracemalloc.start()
+    started = time.perf_counter()
+    first_byte = None
+    sent = 0
+    async for chunk in chunks():
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+        sent += len(chunk)
+    total = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:<24} first byte={first_byte * 1000:8.1f}ms total={total * 1000:8.1f}ms "
+        f"peak={peak / 2 ** 20:7.1f}MiB sent={sent / 2 ** 20:6.1f}MiB"
+    )
+
+
+async def main():
+    logger = structlog.getLogger()
+    pool = SqlAlchemyConnectionPool(benchmark_settings(DB_POOL_SIZE=1, DB_POOL_WARM_UP_CONNECTIONS=1), logger)
+    await pool.start()
+    print(f"{ROWS} rows per read")
+
+    async def buffered():
+        async with pool.session_factory() as session:
+            reader = SqlAlchemyMetricRecordsReader(session, logger)
+            record_set = await SqlAlchemyMetricRecordsReader.__call__.__wrapped__(reader, **PARAMS)
+        metrics = Metrics(configuration=CONFIGURATION, record_set=record_set)
+        yield map_metrics_to_contract(metrics).model_dump_json().encode()
+
+    async def streamed():
+        async with pool.session_factory() as session:
+            stream = SqlAlchemyMetricRecordsStreamer(session, logger)
+            async for chunk in encode_ndjson(stream(**PARAMS)):
+                yield chunk
+
+    await profile("before: buffered json", buffered)
+    await profile("after: streamed ndjson", streamed)
+    await pool.stop()
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    asyncio.run(main())
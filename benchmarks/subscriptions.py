@@ -0,0 +1,110 @@
+"""
+dashboards following a window as rows are written, each polling what changed since its watermark after
+a write against subscribing to the window and having the change pushed, metric rows are inserted for
+a benchmark query id and deleted afterwards
+
+    DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.subscriptions
+"""
+import asyncio
+import logging
+from uuid import uuid4
+
+import structlog
+from sqlalchemy import text
+
+from benchmarks import benchmark_settings, measure
+from src.core import QuerySnapshot, MetricRecord, MetricConfigurationSnapshot, MetricsDelta, \
+    DEFAULT_START_DATE, DEFAULT_END_DATE, DEFAULT_DAY_RANGE
+from src.infrastructure import SqlAlchemyConnectionPool
+from src.infrastructure.caching import CACHE_REGISTRY, RECORD_SNAPSHOTS_CACHE
+from src.infrastructure.orm import start_mappers
+from src.infrastructure.readers import SqlAlchemyMetricRecordsDeltaReader
+from src.infrastructure.subscriptions import InProcessMetricUpdates
+from src.infrastructure.writers import SqlAlchemyMetricRecordWriter
+from src.web.encoding import encode_metrics_delta
+
+ITERATIONS = 20
+ROWS = 10_000
+DASHBOARDS = 50
+QUERY_ID = "benchmark-subscriptions"
+
+QUERY = QuerySnapshot(
+    id=QUERY_ID,
+    query=f"""
+        SELECT alert_type, date, COUNT(*) AS total_alerts
+        FROM metrics
+        WHERE id = '{QUERY_ID}' AND date BETWEEN :start_date AND :end_date AND :day_range > 0
+        GROUP BY alert_type, date
+    """
+)
+CONFIGURATION = MetricConfigurationSnapshot(
+    id="benchmark", query_id=QUERY.id, is_editable=True, query=QUERY, layouts=(), version="benchmark"
+)
+WINDOW = {"start_date": DEFAULT_START_DATE, "end_date": DEFAULT_END_DATE, "day_range": DEFAULT_DAY_RANGE}
+
+
+async def main():
+    logger = structlog.getLogger()
+    start_mappers()
+    CACHE_REGISTRY[RECORD_SNAPSHOTS_CACHE].configure(
+        ttl_seconds=3600, hard_ttl_seconds=3600, max_entries=100, max_bytes=2 ** 30
+    )
+    settings = benchmark_settings(DB_POOL_SIZE=4, DB_POOL_WARM_UP_CONNECTIONS=4)
+    pool = SqlAlchemyConnectionPool(settings, logger)
+    await pool.start()
+    updates = InProcessMetricUpdates(settings, logger, pool)
+    async with pool.session_factory() as session:
+        await session.execute(text(f"""
+            INSERT INTO metrics (metric_id, id, date, parts_flagged, alert_type)
+            SELECT '{QUERY_ID}-' || n, '{QUERY_ID}', DATE '2025-06-01' + (n % 30), n,
+                   CASE WHEN n % 3 = 0 THEN 'Critical' ELSE 'Warning' END
+            FROM generate_series(1, {ROWS}) AS n
+        """))
+        await session.commit()
+    print(f"{ROWS} rows per window, {DASHBOARDS} dashboards")
+
+    try:
+        async def write():
+            async with pool.session_factory() as session:
+                await SqlAlchemyMetricRecordWriter(session)(MetricRecord(
+                    metric_id=f"{QUERY_ID}-{uuid4()}", id=QUERY_ID, date=DEFAULT_START_DATE, alert_type="Warning"
+                ))
+                await session.commit()
+
+        async def poll(since: int):
+            async with pool.session_factory() as session:
+                read = SqlAlchemyMetricRecordsDeltaReader(session, logger)
+                changes = await read(QUERY, **WINDOW, since=since)
+            encode_metrics_delta(MetricsDelta(CONFIGURATION, changes))
+            return changes.watermark
+
+        watermarks = [await poll(0)] * DASHBOARDS
+
+        async def polled():
+            await write()
+            watermarks[:] = await asyncio.gather(*(poll(since) for since in watermarks))
+
+        subscriptions = [updates.subscribe(CONFIGURATION, **WINDOW, encode=encode_metrics_delta)
+                         for _ in range(DASHBOARDS)]
+        await asyncio.gather(*(anext(subscription) for subscription in subscriptions))
+
+        async def pushed():
+            await write()
+            updates.changed(QUERY_ID)
+            await asyncio.gather(*(anext(subscription) for subscription in subscriptions))
+
+        await measure("before: every dashboard polls since", polled, ITERATIONS)
+        await measure("after: one read pushed to every one", pushed, ITERATIONS)
+        for subscription in subscriptions:
+            subscription.close()
+    finally:
+        await updates.stop()
+        async with pool.session_factory() as session:
+            await session.execute(text("DELETE FROM metrics WHERE id = :id"), {"id": QUERY_ID})
+            await session.commit()
+        await pool.stop()
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    asyncio.run(main())
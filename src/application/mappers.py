@@ -1,20 +1,23 @@
 from datetime import timezone, datetime
 
-from src.core import MetricConfigurationAggregate, LayoutItem, MetricRecord
-from src.web.contracts import MetricsResponse, LayoutItemContract, CreateMetricConfigurationRequest, CreateMetricRequest
+from src.core import MetricConfigurationAggregate, LayoutItem, MetricRecord, Metrics, LayoutSnapshot, MetricRecordRow
+from src.web.encoding import encode_cursor
+from src.web.contracts import MetricsResponse, LayoutItemContract, CreateMetricConfigurationRequest, CreateMetricRequest, \
+    IngestMetricRecordRequest
 import uuid
 
 
-def map_metric_aggregate_to_contract(metric_agg: MetricConfigurationAggregate) -> MetricsResponse:
+def map_metrics_to_contract(metrics: Metrics) -> MetricsResponse:
     return MetricsResponse(
-        id=metric_agg.id,
-        is_editable=metric_agg.is_editable,
-        records=metric_agg.records,
-        layouts=[map_layout_to_contract(x) for x in metric_agg.layouts]
+        id=metrics.configuration.id,
+        is_editable=metrics.configuration.is_editable,
+        records=metrics.record_set.records,
+        layouts=[map_layout_to_contract(x) for x in metrics.configuration.layouts],
+        next_cursor=encode_cursor(metrics.record_set.next_after)
     )
 
 
-def map_layout_to_contract(layout: LayoutItem) -> LayoutItemContract:
+def map_layout_to_contract(layout: LayoutSnapshot) -> LayoutItemContract:
     return LayoutItemContract(
         breakpoint=layout.breakpoint,
         x=layout.x,
@@ -56,4 +59,22 @@ def map_metric_record_contract_to_domain(create_request: CreateMetricRequest) ->
         parts_flagged=create_request.parts_flagged,
         alert_type=create_request.alert_type,
         alert_category=create_request.alert_category
-    )
\ No newline at end of file
+    )
+
+def map_ingest_record_contract_to_domain(ingest_request: IngestMetricRecordRequest, received: datetime) -> MetricRecordRow:
+    """
+    dates are stored without a zone, in local time as records created one at a time are
+    """
+    date = ingest_request.date or received
+    if date.tzinfo is not None:
+        date = date.astimezone().replace(tzinfo=None)
+    return MetricRecordRow(
+        metric_id=str(uuid.uuid4()),
+        id=None,
+        date=date,
+        obsolescence_val=ingest_request.obsolescence_val,
+        obsolescence=ingest_request.obsolescence,
+        parts_flagged=ingest_request.parts_flagged,
+        alert_type=ingest_request.alert_type,
+        alert_category=ingest_request.alert_category
+    )
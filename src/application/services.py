@@ -1,11 +1,15 @@
 import asyncio
 import uuid
 from datetime import date
-from typing import Optional
+from typing import Optional, AsyncIterator, Callable
 
 from src.core import UnitOfWork, DbHealthReader, GenericDataSeeder, DataLoader, MetricConfigurationAggregate, \
     MetricAggregateReader, MetricRecordsReader, MetricAggregateWriter, QueryGenerator, Query, MetricRecord, \
-    MetricRecordWriter
+    MetricRecordWriter, MetricCacheInvalidator, CacheInvalidationPublisher, MetricAccessTracker, Metrics, \
+    MetricRecordBatchReader, MetricRecordsStreamer, QuerySnapshot, RecordKey, EncodedResponse, EncodedResponseCache, \
+    ExportFormat, MetricRecordsExporter, RecordsDownsampler, Downsampling, MetricRecordsDeltaReader, MetricsDelta, \
+    MetricUpdates, MetricSubscription, MetricQueryIdsReader, MetricRecordsBulkWriter, IngestResult, \
+    MetricRecordRow
 from src.crosscutting import auto_slots, Logger
 
 
@@ -29,24 +33,261 @@ class DatabaseHealthCheckService:
 @auto_slots
 class GetMetricsService:
 
-    def __init__(self, unit_of_work: UnitOfWork):
+    def __init__(self,
+        unit_of_work: UnitOfWork,
+        access_tracker: MetricAccessTracker,
+        downsample: RecordsDownsampler,
+        batched: bool = False
+    ):
+        """
+        :param batched: read records column by column straight off the driver, for encoding without row dicts
+        """
+        self.batched = batched
+        self.downsample = downsample
+        self.access_tracker = access_tracker
         self.unit_of_work = unit_of_work
 
-    async def __call__(self, _id: str, start_date: date, end_date: date, day_range: int) -> Optional[MetricConfigurationAggregate]:
+    async def __call__(
+        self,
+        _id: str,
+        start_date: date,
+        end_date: date,
+        day_range: int,
+        limit: Optional[int] = None,
+        after: Optional[RecordKey] = None,
+        batched: Optional[bool] = None,
+        max_points: Optional[int] = None,
+        downsampling: Downsampling = Downsampling.lttb
+    ) -> Optional[Metrics]:
+        """
+        :param limit: page size, pages are always read as rows
+        :param after: key of the last record on the previous page
+        :param batched: overrides the configured read path for this call
+        :param max_points: most rows kept per series, the whole window is read and then downsampled
+        """
+        paged = limit is not None
+        columnar = (self.batched if batched is None else batched) and not paged
         async with self.unit_of_work as uow:
             config_reader = uow.persistence_factory(MetricAggregateReader)
-            records_reader = uow.persistence_factory(MetricRecordsReader)
+            records_reader = uow.persistence_factory(MetricRecordBatchReader if columnar else MetricRecordsReader)
             metrics_config = await config_reader(_id=_id)
             if metrics_config is None:
                 return None
-            records = await records_reader(
-                query=metrics_config.query.query,
+            if not paged:
+                # tracked by the read path asked for, which prefetching resolves the same way
+                self.access_tracker.record(_id, start_date, end_date, day_range, batched)
+            page = dict(limit=limit, after=after) if paged else {}
+            record_set = await records_reader(
+                query=metrics_config.query,
                 start_date=start_date,
                 end_date=end_date,
-                day_range=day_range
+                day_range=day_range,
+                **page
             )
-        metrics_config.records = records
-        return metrics_config
+        if max_points is not None:
+            record_set = self.downsample(record_set, max_points, downsampling)
+        return Metrics(configuration=metrics_config, record_set=record_set)
+
+
+@auto_slots
+class GetEncodedMetricsService:
+
+    def __init__(self,
+        get_metrics: GetMetricsService,
+        response_cache: EncodedResponseCache,
+        access_tracker: MetricAccessTracker
+    ):
+        self.access_tracker = access_tracker
+        self.response_cache = response_cache
+        self.get_metrics = get_metrics
+
+    async def __call__(
+        self,
+        _id: str,
+        start_date: date,
+        end_date: date,
+        day_range: int,
+        representation: str,
+        encode: Callable[[Metrics], bytes],
+        limit: Optional[int] = None,
+        after: Optional[RecordKey] = None,
+        batched: Optional[bool] = None,
+        max_points: Optional[int] = None,
+        downsampling: Downsampling = Downsampling.lttb
+    ) -> Optional[EncodedResponse]:
+        """
+        the encoded metrics response, sent from the response cache while the metrics behind it are unchanged
+        :param representation: names what encode writes, responses are cached and versioned per representation
+        """
+        sampling = None if max_points is None else (max_points, downsampling)
+        key = (_id, start_date, end_date, day_range, limit, after, sampling, representation)
+        cached = self.response_cache.get(key)
+        if cached is not None:
+            # hits never reach GetMetricsService, so they are counted here for prefetching
+            if limit is None:
+                self.access_tracker.record(_id, start_date, end_date, day_range, batched)
+            return cached
+
+        generation = self.response_cache.generation()
+        metrics = await self.get_metrics(
+            _id=_id,
+            start_date=start_date,
+            end_date=end_date,
+            day_range=day_range,
+            limit=limit,
+            after=after,
+            batched=batched,
+            max_points=max_points,
+            downsampling=downsampling
+        )
+        if metrics is None:
+            return None
+        response = EncodedResponse(body=encode(metrics), version=f"{metrics.content_version}-{representation}")
+        self.response_cache.put(key, response, metrics.configuration.query, generation)
+        return response
+
+
+@auto_slots
+class GetMetricsDeltaService:
+
+    def __init__(self, unit_of_work: UnitOfWork):
+        self.unit_of_work = unit_of_work
+
+    async def __call__(
+        self,
+        _id: str,
+        start_date: date,
+        end_date: date,
+        day_range: int,
+        since: int
+    ) -> Optional[MetricsDelta]:
+        """
+        none when there is no such configuration, otherwise how its records changed since the watermark
+        """
+        async with self.unit_of_work as uow:
+            config_reader = uow.persistence_factory(MetricAggregateReader)
+            metrics_config = await config_reader(_id=_id)
+        if metrics_config is None:
+            return None
+
+        # a session of its own, the delta is read under a stricter isolation level than the configuration
+        async with self.unit_of_work as uow:
+            delta_reader = uow.persistence_factory(MetricRecordsDeltaReader)
+            delta = await delta_reader(
+                query=metrics_config.query,
+                start_date=start_date,
+                end_date=end_date,
+                day_range=day_range,
+                since=since
+            )
+        return MetricsDelta(configuration=metrics_config, delta=delta)
+
+
+@auto_slots
+class SubscribeMetricsService:
+
+    def __init__(self, unit_of_work: UnitOfWork, updates: MetricUpdates):
+        self.unit_of_work = unit_of_work
+        self.updates = updates
+
+    async def __call__(
+        self,
+        _id: str,
+        start_date: date,
+        end_date: date,
+        day_range: int,
+        encode: Callable[[MetricsDelta], bytes]
+    ) -> Optional[MetricSubscription]:
+        """
+        none when there is no such configuration, otherwise a subscription the caller has to close
+        """
+        async with self.unit_of_work as uow:
+            config_reader = uow.persistence_factory(MetricAggregateReader)
+            metrics_config = await config_reader(_id=_id)
+        if metrics_config is None:
+            return None
+        return self.updates.subscribe(
+            configuration=metrics_config,
+            start_date=start_date,
+            end_date=end_date,
+            day_range=day_range,
+            encode=encode
+        )
+
+
+@auto_slots
+class StreamMetricRecordsService:
+
+    def __init__(self, unit_of_work: UnitOfWork):
+        self.unit_of_work = unit_of_work
+
+    async def __call__(self, _id: str, start_date: date, end_date: date, day_range: int) -> Optional[AsyncIterator[list[dict]]]:
+        """
+        none when there is no such configuration, otherwise its records a batch at a time,
+        read on a session that stays open until the stream is exhausted or closed
+        """
+        async with self.unit_of_work as uow:
+            config_reader = uow.persistence_factory(MetricAggregateReader)
+            metrics_config = await config_reader(_id=_id)
+        if metrics_config is None:
+            return None
+        return self._stream(metrics_config.query, start_date, end_date, day_range)
+
+    async def _stream(self, query: QuerySnapshot, start_date: date, end_date: date, day_range: int) -> AsyncIterator[list[dict]]:
+        async with self.unit_of_work as uow:
+            stream_records = uow.persistence_factory(MetricRecordsStreamer)
+            async for records in stream_records(
+                query=query,
+                start_date=start_date,
+                end_date=end_date,
+                day_range=day_range
+            ):
+                yield records
+
+
+@auto_slots
+class ExportMetricRecordsService:
+
+    def __init__(self, unit_of_work: UnitOfWork):
+        self.unit_of_work = unit_of_work
+
+    async def __call__(
+        self,
+        _id: str,
+        start_date: date,
+        end_date: date,
+        day_range: int,
+        format: ExportFormat
+    ) -> Optional[AsyncIterator[bytes]]:
+        """
+        none when there is no such configuration, otherwise the export as it is written,
+        read on a session that stays open until the export is sent or abandoned
+        """
+        async with self.unit_of_work as uow:
+            config_reader = uow.persistence_factory(MetricAggregateReader)
+            metrics_config = await config_reader(_id=_id)
+        if metrics_config is None:
+            return None
+        return self._export(metrics_config.query, start_date, end_date, day_range, format)
+
+    async def _export(
+        self,
+        query: QuerySnapshot,
+        start_date: date,
+        end_date: date,
+        day_range: int,
+        format: ExportFormat
+    ) -> AsyncIterator[bytes]:
+        async with self.unit_of_work as uow:
+            export_records = uow.persistence_factory(MetricRecordsExporter)
+            async for chunk in export_records(
+                query=query,
+                start_date=start_date,
+                end_date=end_date,
+                day_range=day_range,
+                format=format
+            ):
+                yield chunk
 
 
 @auto_slots
@@ -75,8 +316,10 @@ class CreateMetricConfigurationService:
 
     def __init__(self,
         unit_of_work: UnitOfWork,
-        prompt_generator: QueryGenerator
+        prompt_generator: QueryGenerator,
+        cache_invalidator: MetricCacheInvalidator
     ):
+        self.cache_invalidator = cache_invalidator
         self.prompt_generator = prompt_generator
         self.unit_of_work = unit_of_work
 
@@ -90,15 +333,21 @@ class CreateMetricConfigurationService:
             )
             writer = uow.persistence_factory(MetricAggregateWriter)
             await writer(aggregate)
+            publish_invalidation = uow.persistence_factory(CacheInvalidationPublisher)
+            await publish_invalidation(config_id=aggregate.id, query_id=query_id)
             await uow.save()
+        # a miss for this id may already be cached
+        await self.cache_invalidator.invalidate_configuration(aggregate.id)
         return aggregate.id
 
 
 @auto_slots
 class CreateMetricService:
 
-    def __init__(self, unit_of_work: UnitOfWork):
+    def __init__(self, unit_of_work: UnitOfWork, cache_invalidator: MetricCacheInvalidator, updates: MetricUpdates):
+        self.cache_invalidator = cache_invalidator
         self.unit_of_work = unit_of_work
+        self.updates = updates
 
     async def __call__(self, config_id: str, metric_record: MetricRecord) -> Optional[str]:
         async with self.unit_of_work as uow:
@@ -111,5 +360,47 @@ class CreateMetricService:
             metric_record.id = aggregate.query_id
             writer = uow.persistence_factory(MetricRecordWriter)
             await writer(metric_record)
+            publish_invalidation = uow.persistence_factory(CacheInvalidationPublisher)
+            await publish_invalidation(query_id=aggregate.query_id)
             await uow.save()
-        return aggregate.id
\ No newline at end of file
+        await self.cache_invalidator.invalidate_records(aggregate.query_id)
+        self.updates.changed(aggregate.query_id)
+        return aggregate.id
+
+
+@auto_slots
+class IngestMetricRecordsService:
+
+    def __init__(self, unit_of_work: UnitOfWork, cache_invalidator: MetricCacheInvalidator, updates: MetricUpdates):
+        self.cache_invalidator = cache_invalidator
+        self.unit_of_work = unit_of_work
+        self.updates = updates
+
+    async def __call__(self, records: list[tuple[str, MetricRecordRow]]) -> IngestResult:
+        """
+        writes records for any number of configurations in one transaction, each configuration's query id
+        is read once for the batch, records of configurations that don't exist are left out
+        """
+        async with self.unit_of_work as uow:
+            read_query_ids = uow.persistence_factory(MetricQueryIdsReader)
+            query_ids = await read_query_ids(list({config_id for config_id, _ in records}))
+
+            missing, written = [], []
+            for position, (config_id, record) in enumerate(records):
+                if config_id not in query_ids:
+                    missing.append(position)
+                    continue
+                written.append(record._replace(id=query_ids[config_id]))
+
+            changed = {record.id for record in written}
+            if written:
+                writer = uow.persistence_factory(MetricRecordsBulkWriter)
+                await writer(written)
+                publish_invalidation = uow.persistence_factory(CacheInvalidationPublisher)
+                for query_id in changed:
+                    await publish_invalidation(query_id=query_id)
+                await uow.save()
+        for query_id in changed:
+            await self.cache_invalidator.invalidate_records(query_id)
+            self.updates.changed(query_id)
+        return IngestResult(created=len(written), missing=missing)
@@ -7,22 +7,36 @@ from fastapi import FastAPI
 from punq import Container, Scope
 
 from src.application.services import DatabaseHealthCheckService, DataSeedService, GetMetricsService, \
-    CreateMetricConfigurationService, CreateMetricService
+    CreateMetricConfigurationService, CreateMetricService, StreamMetricRecordsService, GetEncodedMetricsService, \
+    ExportMetricRecordsService, GetMetricsDeltaService, SubscribeMetricsService, IngestMetricRecordsService
 from src.core import UnitOfWork, DbHealthReader, DataLoader, GenericDataSeeder, MetricAggregateReader, \
-    MetricRecordsReader, MetricAggregateWriter, MetricRecordWriter, QueryGenerator
+    MetricRecordsReader, MetricAggregateWriter, MetricRecordWriter, QueryGenerator, HostedService, \
+    MetricCacheInvalidator, CacheInvalidationPublisher, MetricAccessTracker, MetricRecordBatchReader, \
+    MetricRecordsStreamer, EncodedResponseCache, MetricRecordsExporter, RecordsDownsampler, \
+    MetricRecordsDeltaReader, MetricUpdates, MetricQueryIdsReader, MetricRecordsBulkWriter
 from src.crosscutting import Logger, ServiceProvider
-from src.infrastructure import Settings, SqlAlchemyUnitOfWork, register
+from src.infrastructure import Settings, SqlAlchemyUnitOfWork, register, SqlAlchemyConnectionPool
 from src.infrastructure.auth import CognitoAuthenticator
+from src.infrastructure.caching import CacheSweeper, LocalMetricCacheInvalidator, PostgresCacheInvalidationListener
+from src.infrastructure.downsampling import NumpyRecordsDownsampler
+from src.infrastructure.exports import AsyncpgMetricRecordsExporter
 from src.infrastructure.llm import FakeQueryGenerator
 from src.infrastructure.loaders import JsonMetricConfigurationLoader, JsonLayoutItemLoader, CsvQueryLoader, \
     JsonMetricRecordLoader
 from src.infrastructure.orm import start_mappers
+from src.infrastructure.prefetch import DecayingAccessTracker, HotMetricPrefetcher
+from src.infrastructure.responses import LruEncodedResponseCache
+from src.infrastructure.subscriptions import InProcessMetricUpdates
+from src.infrastructure.warmup import CacheWarmer
 from src.infrastructure.readers import SqlAlchemyMetricAggregateReader, SqlAlchemyMetricRecordsReader, \
-    SqlAlchemyDbHealthReader
+    SqlAlchemyDbHealthReader, AsyncpgMetricRecordBatchReader, SqlAlchemyMetricRecordsStreamer, \
+    SqlAlchemyMetricRecordsDeltaReader, SqlAlchemyMetricQueryIdsReader
 from src.infrastructure.writers import SqlAlchemyGenericDataSeeder, SqlAlchemyMetricAggregateWriter, \
-    SqlAlchemyMetricRecordWriter
+    SqlAlchemyMetricRecordWriter, SqlAlchemyCacheInvalidationPublisher, AsyncpgMetricRecordsBulkWriter
 from src.web import Authenticator
-from src.web.middleware import add_exception_middleware
+from src.web.compression import CompressionSettings
+from src.web.encoding import EventStreamSettings
+from src.web.middleware import add_exception_middleware, add_compression_middleware
 from src.web.routes import health_router, metrics_router
 
 
@@ -41,7 +55,11 @@ def bootstrap(app: FastAPI,
         add_configuration(container=container)
     add_routing(app=app, container=container)
     add_exception_middleware(app=app)
+    add_compression(app=app, container=container)
     add_database(container=container)
+    add_caching(container=container)
+    add_subscriptions(container=container)
+    add_charts(container=container)
     add_services(container=container)
     add_loaders(container=container)
     add_llms(container=container)
@@ -53,12 +71,50 @@ def add_database(container: Container):
     start_mappers()
     register(DbHealthReader, SqlAlchemyDbHealthReader)
     register(MetricRecordsReader, SqlAlchemyMetricRecordsReader)
+    register(MetricRecordBatchReader, AsyncpgMetricRecordBatchReader)
+    register(MetricRecordsStreamer, SqlAlchemyMetricRecordsStreamer)
+    register(MetricRecordsDeltaReader, SqlAlchemyMetricRecordsDeltaReader)
+    register(MetricRecordsExporter, AsyncpgMetricRecordsExporter)
     register(MetricAggregateReader, SqlAlchemyMetricAggregateReader)
+    register(MetricQueryIdsReader, SqlAlchemyMetricQueryIdsReader)
     register(GenericDataSeeder, SqlAlchemyGenericDataSeeder)
     register(MetricAggregateWriter, SqlAlchemyMetricAggregateWriter)
     register(MetricRecordWriter, SqlAlchemyMetricRecordWriter)
+    register(MetricRecordsBulkWriter, AsyncpgMetricRecordsBulkWriter)
+    register(CacheInvalidationPublisher, SqlAlchemyCacheInvalidationPublisher)
+    container.register(SqlAlchemyConnectionPool, scope=Scope.singleton)
+    container.register(HostedService, factory=lambda: container.resolve(SqlAlchemyConnectionPool))
     container.register(UnitOfWork, SqlAlchemyUnitOfWork)
 
+def add_caching(container: Container):
+    container.register(CacheSweeper, scope=Scope.singleton)
+    container.register(HostedService, factory=lambda: container.resolve(CacheSweeper))
+    container.register(PostgresCacheInvalidationListener, factory=lambda: PostgresCacheInvalidationListener(
+        settings=container.resolve(Settings),
+        logger=container.resolve(Logger),
+        updates=container.resolve(MetricUpdates)
+    ), scope=Scope.singleton)
+    container.register(HostedService, factory=lambda: container.resolve(PostgresCacheInvalidationListener))
+    container.register(MetricCacheInvalidator, LocalMetricCacheInvalidator)
+    # registered after the sweeper, which has to configure the caches before they're filled
+    container.register(CacheWarmer, scope=Scope.singleton)
+    container.register(HostedService, factory=lambda: container.resolve(CacheWarmer))
+    container.register(MetricAccessTracker, DecayingAccessTracker, scope=Scope.singleton)
+    container.register(EncodedResponseCache, LruEncodedResponseCache, scope=Scope.singleton)
+    container.register(HotMetricPrefetcher, scope=Scope.singleton)
+    container.register(HostedService, factory=lambda: container.resolve(HotMetricPrefetcher))
+
+def add_subscriptions(container: Container):
+    container.register(InProcessMetricUpdates, scope=Scope.singleton)
+    container.register(MetricUpdates, factory=lambda: container.resolve(InProcessMetricUpdates))
+    container.register(HostedService, factory=lambda: container.resolve(InProcessMetricUpdates))
+    container.register(EventStreamSettings, factory=lambda: EventStreamSettings(
+        heartbeat_seconds=container.resolve(Settings).SUBSCRIPTION_HEARTBEAT_SECONDS
+    ), scope=Scope.singleton)
+
+def add_charts(container: Container):
+    container.register(RecordsDownsampler, NumpyRecordsDownsampler, scope=Scope.singleton)
+
 def add_llms(container: Container):
     container.register(QueryGenerator, FakeQueryGenerator)
 
@@ -74,6 +130,20 @@ def add_loaders(container: Container):
 def add_configuration(container: Container):
     container.register(Settings, instance=Settings(), scope=Scope.singleton)
 
+def add_compression(app: FastAPI, container: Container):
+    def compression_settings() -> CompressionSettings:
+        settings = container.resolve(Settings)
+        return CompressionSettings(
+            enabled=settings.COMPRESSION_ENABLED,
+            minimum_size=settings.COMPRESSION_MIN_SIZE_BYTES,
+            gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+            brotli_quality=settings.COMPRESSION_BROTLI_QUALITY,
+            zstd_level=settings.COMPRESSION_ZSTD_LEVEL
+        )
+
+    container.register(CompressionSettings, factory=compression_settings, scope=Scope.singleton)
+    add_compression_middleware(app=app)
+
 def add_routing(app: FastAPI, container: Container):
     app.state.services = ServiceProvider(container=container)
     app.include_router(router=health_router)
@@ -81,10 +151,21 @@ def add_routing(app: FastAPI, container: Container):
 
 def add_services(container: Container):
     container.register(DatabaseHealthCheckService)
-    container.register(GetMetricsService)
+    container.register(GetMetricsService, factory=lambda: GetMetricsService(
+        unit_of_work=container.resolve(UnitOfWork),
+        access_tracker=container.resolve(MetricAccessTracker),
+        downsample=container.resolve(RecordsDownsampler),
+        batched=container.resolve(Settings).RECORDS_BATCH_READER_ENABLED
+    ))
+    container.register(GetEncodedMetricsService)
+    container.register(GetMetricsDeltaService)
+    container.register(SubscribeMetricsService)
+    container.register(StreamMetricRecordsService)
+    container.register(ExportMetricRecordsService)
     container.register(DataSeedService)
     container.register(CreateMetricConfigurationService)
     container.register(CreateMetricService)
+    container.register(IngestMetricRecordsService)
 
 def add_logging(container: Container):
     container.register(Logger, factory=structlog.getLogger, scope=Scope.singleton)
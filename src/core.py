@@ -1,11 +1,50 @@
 import datetime
 from dataclasses import dataclass, field
-from typing import Protocol, TypeVar, Type, Optional, Any
+from enum import Enum
+from typing import Protocol, TypeVar, Type, Optional, Any, AsyncIterator, Hashable, Callable, NamedTuple
 
 from src.crosscutting import Logger
 
 T = TypeVar("T")
 
+# window served when a metrics request doesn't give one
+DEFAULT_START_DATE = datetime.date(2025, 6, 1)
+DEFAULT_END_DATE = datetime.date(2025, 6, 30)
+DEFAULT_DAY_RANGE = 30
+# largest page of records a metrics request can ask for
+MAX_PAGE_SIZE = 10_000
+# most records one ingest request can carry
+MAX_INGEST_ROWS = 100_000
+# largest ingest request body read, a kilobyte a record leaves room for any record the contract allows
+MAX_INGEST_BYTES = 1024 * MAX_INGEST_ROWS
+
+
+
+class RecordKey(NamedTuple):
+    """
+    where the next page of records starts, the last record on a page as its column names with their
+    values in result order, and how many records equal to it have been read, ties being indistinguishable
+    """
+    row: tuple[tuple[str, Any], ...]
+    seen: int = 1
+
+
+class ExportFormat(str, Enum):
+    arrow = "arrow"
+    parquet = "parquet"
+    csv = "csv"
+
+
+class Downsampling(str, Enum):
+    """
+    how a series is cut down to a number of points, lttb keeps the rows that shape the line,
+    the others aggregate each time bucket
+    """
+    lttb = "lttb"
+    avg = "avg"
+    min = "min"
+    max = "max"
+
 
 @dataclass(unsafe_hash=True)
 class MetricRecord:
@@ -18,6 +57,19 @@ class MetricRecord:
     alert_type: str = None
     alert_category: str = None
 
+class MetricRecordRow(NamedTuple):
+    """
+    a metric record written in bulk, fields in the order they are copied in, not tracked by the orm
+    """
+    metric_id: str
+    id: Optional[str] # query id
+    date: datetime.datetime
+    obsolescence_val: Optional[float]
+    obsolescence: Optional[float]
+    parts_flagged: Optional[int]
+    alert_type: Optional[str]
+    alert_category: Optional[str]
+
 @dataclass(unsafe_hash=True)
 class LayoutItem:
     id: str = None
@@ -51,7 +103,123 @@ class MetricConfigurationAggregate(MetricConfiguration):
     """
     layouts: list[LayoutItem] = field(default_factory=list)
     query: Query = None
-    records: list[dict] = field(default_factory=list)
+
+
+@dataclass(frozen=True, slots=True)
+class QuerySnapshot:
+    id: str
+    query: str
+
+
+@dataclass(frozen=True, slots=True)
+class LayoutSnapshot:
+    breakpoint: str
+    x: int
+    y: int
+    w: int
+    h: int
+    static: Optional[bool]
+
+
+@dataclass(frozen=True, slots=True)
+class MetricConfigurationSnapshot:
+    """
+    immutable copy of an aggregate, shared between requests through the cache
+    """
+    id: str
+    query_id: str
+    is_editable: bool
+    query: Optional[QuerySnapshot]
+    layouts: tuple[LayoutSnapshot, ...]
+    version: str # fingerprint of the fields above
+
+
+@dataclass(frozen=True, slots=True)
+class RecordSet:
+    """
+    rows returned by a stored query with a fingerprint of them
+    """
+    records: list[dict]
+    version: str
+    next_after: Optional[RecordKey] = None # set when a page was read and more records follow it
+
+    def to_batch(self) -> "RecordBatch":
+        columns = tuple(self.records[0]) if self.records else ()
+        values = tuple(zip(*(record.values() for record in self.records)))
+        return RecordBatch(columns=columns, values=values, version=self.version, next_after=self.next_after)
+
+
+@dataclass(frozen=True, slots=True)
+class RecordBatch:
+    """
+    rows returned by a stored query held column by column, one tuple of values per column,
+    rows are only assembled into dicts when something asks for records
+    """
+    columns: tuple[str, ...]
+    values: tuple[tuple, ...]
+    version: str
+    next_after: Optional[RecordKey] = None
+
+    def __len__(self) -> int:
+        return len(self.values[0]) if self.values else 0
+
+    @property
+    def records(self) -> list[dict]:
+        return [dict(zip(self.columns, row)) for row in zip(*self.values)]
+
+
+@dataclass(frozen=True, slots=True)
+class Metrics:
+    """
+    a configuration with the records for one requested window, built per request
+    """
+    configuration: MetricConfigurationSnapshot
+    record_set: RecordSet | RecordBatch
+
+    @property
+    def content_version(self) -> str:
+        """
+        changes whenever the configuration or its records do
+        """
+        return f"{self.configuration.version}-{self.record_set.version}"
+
+
+@dataclass(frozen=True, slots=True)
+class RecordDelta:
+    """
+    how a stored query's records changed since a watermark, and the watermark they bring a reader up to
+    """
+    records: list[dict] # added or changed since the watermark, every record when removed is None
+    removed: Optional[list[dict]] # none when the records at the watermark are no longer known
+    watermark: int
+
+
+@dataclass(frozen=True, slots=True)
+class MetricsDelta:
+    """
+    a configuration with the change to its records since a watermark, built per request
+    """
+    configuration: MetricConfigurationSnapshot
+    delta: RecordDelta
+
+
+@dataclass(frozen=True, slots=True)
+class IngestResult:
+    """
+    what came of writing a batch of records
+    """
+    created: int
+    missing: list[int] # positions of records whose configuration doesn't exist, none of them written
+
+
+@dataclass(frozen=True, slots=True)
+class EncodedResponse:
+    """
+    a metrics response body as sent, with the version its etag is built from
+    """
+    body: bytes
+    version: str
+    compressed: dict[str, bytes] = field(default_factory=dict, compare=False) # body by content coding, filled as asked for
 
 
 class DbHealthReader(Protocol):
@@ -62,13 +230,171 @@ class DbHealthReader(Protocol):
 
 class MetricAggregateReader(Protocol):
 
-    async def __call__(self, _id: str) -> Optional[MetricConfigurationAggregate]:
+    async def __call__(self, _id: str) -> Optional[MetricConfigurationSnapshot]:
+        ...
+
+
+class MetricQueryIdsReader(Protocol):
+    """
+    the query id of each configuration that exists, in one statement
+    """
+
+    async def __call__(self, ids: list[str]) -> dict[str, Optional[str]]:
         ...
 
 
 class MetricRecordsReader(Protocol):
 
-    async def __call__(self, query: str, start_date: datetime.date, end_date: datetime.date, day_range: int) -> list[dict]:
+    async def __call__(
+        self,
+        query: QuerySnapshot,
+        start_date: datetime.date,
+        end_date: datetime.date,
+        day_range: int,
+        limit: Optional[int] = None,
+        after: Optional[RecordKey] = None
+    ) -> RecordSet:
+        ...
+
+
+class MetricRecordsDeltaReader(Protocol):
+    """
+    the change to a stored query's records since an ingest watermark, 0 being before any record
+    """
+
+    async def __call__(
+        self,
+        query: QuerySnapshot,
+        start_date: datetime.date,
+        end_date: datetime.date,
+        day_range: int,
+        since: int
+    ) -> RecordDelta:
+        ...
+
+
+class MetricRecordsStreamer(Protocol):
+    """
+    yields a stored query's records a batch at a time instead of reading them all up front
+    """
+
+    def __call__(self, query: QuerySnapshot, start_date: datetime.date, end_date: datetime.date, day_range: int) -> AsyncIterator[list[dict]]:
+        ...
+
+
+class MetricRecordsExporter(Protocol):
+    """
+    writes a stored query's records out in an export format, a batch of rows at a time
+    """
+
+    def __call__(
+        self,
+        query: QuerySnapshot,
+        start_date: datetime.date,
+        end_date: datetime.date,
+        day_range: int,
+        format: ExportFormat
+    ) -> AsyncIterator[bytes]:
+        ...
+
+
+class MetricRecordBatchReader(Protocol):
+
+    async def __call__(self, query: QuerySnapshot, start_date: datetime.date, end_date: datetime.date, day_range: int) -> RecordBatch:
+        ...
+
+
+class MetricAccessTracker(Protocol):
+    """
+    counts how often each metric window is read, recent reads weighing more
+    """
+
+    def record(
+        self,
+        _id: str,
+        start_date: datetime.date,
+        end_date: datetime.date,
+        day_range: int,
+        batched: Optional[bool] = None
+    ) -> None:
+        ...
+
+    def hottest(self, count: int) -> list[tuple[str, datetime.date, datetime.date, int, Optional[bool]]]:
+        ...
+
+    def prune(self) -> None:
+        ...
+
+
+class EncodedResponseCache(Protocol):
+    """
+    encoded metrics responses, so a hit is sent without reading or encoding the metrics again
+    """
+
+    def generation(self) -> int:
+        ...
+
+    def get(self, key: Hashable) -> Optional[EncodedResponse]:
+        ...
+
+    def put(self, key: Hashable, response: EncodedResponse, query: QuerySnapshot, generation: int) -> None:
+        ...
+
+
+class RecordsDownsampler(Protocol):
+    """
+    cuts each series in a stored query's records down to at most max_points rows, for charts
+    that can't show more points than they have pixels
+    """
+
+    def __call__(self, record_set: RecordSet | RecordBatch, max_points: int, method: Downsampling) -> RecordBatch:
+        ...
+
+
+class MetricCacheInvalidator(Protocol):
+
+    async def invalidate_records(self, query_id: str) -> None:
+        ...
+
+    async def invalidate_configuration(self, config_id: str) -> None:
+        ...
+
+
+class MetricSubscription(Protocol):
+    """
+    one subscriber's messages, the window in full and then each change to it, until closed
+    """
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class MetricUpdates(Protocol):
+    """
+    pushes changes to a metric configuration's records to everyone subscribed to one of its windows,
+    each change is read and encoded once per window however many subscribe to it
+    """
+
+    def changed(self, query_id: str) -> None:
+        ...
+
+    def resync(self) -> None:
+        """
+        reads every subscribed window again, for when changes may have gone unreported
+        """
+        ...
+
+    def subscribe(
+        self,
+        configuration: MetricConfigurationSnapshot,
+        start_date: datetime.date,
+        end_date: datetime.date,
+        day_range: int,
+        encode: Callable[[MetricsDelta], bytes]
+    ) -> MetricSubscription:
         ...
 
 
@@ -86,6 +412,17 @@ class UnitOfWork(Protocol):
     async def save(self):
         ...
 
+class HostedService(Protocol):
+    """
+    long lived component started and stopped with the application lifespan
+    """
+
+    async def start(self) -> None:
+        ...
+
+    async def stop(self) -> None:
+        ...
+
 class DataLoader(Protocol):
     type: type
     data: list[Any]
@@ -113,4 +450,20 @@ class QueryGenerator(Protocol):
 class MetricRecordWriter(Protocol):
 
     async def __call__(self, record: MetricRecord):
+        ...
+
+class MetricRecordsBulkWriter(Protocol):
+    """
+    writes a batch of records, of any number of queries, with the unit of work's transaction
+    """
+
+    async def __call__(self, records: list[MetricRecordRow]):
+        ...
+
+class CacheInvalidationPublisher(Protocol):
+    """
+    tells every instance to evict cached entries, published with the unit of work's transaction
+    """
+
+    async def __call__(self, config_id: Optional[str] = None, query_id: Optional[str] = None):
         ...
\ No newline at end of file
@@ -1,7 +1,8 @@
 import inspect
 from contextlib import contextmanager
 from typing import Callable, TypeVar, Any, Protocol, Type
-from fastapi import Request, Depends
+from fastapi import Depends
+from fastapi.requests import HTTPConnection
 from punq import Container
 
 from structlog.contextvars import bind_contextvars, clear_contextvars
@@ -28,12 +29,12 @@ def logging_scope(**context):
         clear_contextvars()
 
 
-def get_service(service_type: Callable[..., T]) -> Callable[[Request], T]:
+def get_service(service_type: Callable[..., T]) -> Callable[[HTTPConnection], T]:
     """
-    gets a type from the service registry
+    gets a type from the service registry, for requests and websockets alike
     """
-    def _get(request: Request) -> T:
-        services = request.app.state.services
+    def _get(connection: HTTPConnection) -> T:
+        services = connection.app.state.services
         return services[service_type]
     return _get
 
@@ -60,4 +61,7 @@ class ServiceProvider:
         self.container = container
 
     def __getitem__(self, key: Type[T]) -> T:
-        return self.container.resolve(key)
\ No newline at end of file
+        return self.container.resolve(key)
+
+    def all(self, key: Type[T]) -> list[T]:
+        return self.container.resolve_all(key)
\ No newline at end of file
@@ -1,11 +1,11 @@
-import time
-from functools import wraps
-from typing import TypeVar, Type, Any, Callable, Coroutine, Optional
+import asyncio
+from typing import TypeVar, Type
 
-import sqlalchemy
 from pydantic.v1 import BaseSettings
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncEngine
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import NullPool
 
 from src.crosscutting import Logger
 
@@ -29,26 +29,133 @@ class Settings(BaseSettings):
     METRICS_SEED_JSON: str = "../data/metrics.json"
     QUERIES_SEED_CSV: str = "../data/queries.csv"
     METRIC_RECORDS_SEED_JSON: str = "../data/metric_records.json"
+    DB_POOL_ENABLED: bool = True
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    DB_POOL_TIMEOUT_SECONDS: float = 30
+    DB_CONNECT_TIMEOUT_SECONDS: float = 10
+    DB_POOL_WARM_UP_CONNECTIONS: int = 5
+    DB_PREPARED_STATEMENT_CACHE_SIZE: int = 256
+    DB_TIMEZONE: str = "UTC"
+    CACHE_MAX_ENTRIES: int = 1024
+    CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    CACHE_SWEEP_INTERVAL_SECONDS: float = 60
+    CACHE_SOFT_TTL_SECONDS: float = 300
+    CACHE_HARD_TTL_SECONDS: float = 600
+    CACHE_MAX_CONCURRENT_REFRESHES: int = 2
+    CACHE_BACKEND: str = "memory"
+    CACHE_SHARED_PATH: str = "/dev/shm/metrics-cache.sqlite3"
+    CACHE_SHARED_BUSY_TIMEOUT_SECONDS: float = 0.05
+    CACHE_INVALIDATION_LISTENER_ENABLED: bool = True
+    CACHE_INVALIDATION_RECONNECT_SECONDS: float = 5
+    CACHE_WARM_UP_ENABLED: bool = True
+    CACHE_WARM_UP_CONCURRENCY: int = 4
+    CACHE_WARM_UP_BUDGET_SECONDS: float = 30
+    PREFETCH_ENABLED: bool = True
+    PREFETCH_INTERVAL_SECONDS: float = 30
+    PREFETCH_TOP_K: int = 20
+    PREFETCH_HALF_LIFE_SECONDS: float = 600
+    PREFETCH_MAX_TRACKED: int = 10_000
+    RECORDS_BATCH_READER_ENABLED: bool = False
+    SUBSCRIPTION_QUEUE_SIZE: int = 16
+    SUBSCRIPTION_HEARTBEAT_SECONDS: float = 15
+    SUBSCRIPTION_RETRY_SECONDS: float = 5
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_MIN_SIZE_BYTES: int = 1024
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 1
+    COMPRESSION_ZSTD_LEVEL: int = 1
 
     class Config:
         env_file = "../.env.local"
 
-class SqlAlchemyUnitOfWork:
-    __slots__ = "session_factory", "logger", "session"
+
+def create_engine(settings: Settings) -> AsyncEngine:
+    """
+    builds the async engine, pool sizing and timeouts come from settings
+    """
+    if settings.DB_POOL_ENABLED:
+        pool_options = dict(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_pre_ping=settings.DB_POOL_PRE_PING,
+            pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+            pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+        )
+    else:
+        pool_options = dict(poolclass=NullPool)
+
+    return create_async_engine(
+        settings.DATABASE_URL,
+        echo=False,
+        future=True,
+        connect_args={
+            "timeout": settings.DB_CONNECT_TIMEOUT_SECONDS,
+            # per connection, asyncpg prepares each distinct sql text once and reuses its plan, so this
+            # should hold every stored query plus the app's own statements
+            "prepared_statement_cache_size": settings.DB_PREPARED_STATEMENT_CACHE_SIZE,
+            # CURRENT_DATE follows the session TimeZone, pinned so the caches know when it moves on
+            "server_settings": {"timezone": settings.DB_TIMEZONE},
+        },
+        **pool_options
+    )
+
+
+class SqlAlchemyConnectionPool:
+    """
+    one engine per process, shared by every unit of work and disposed on shutdown
+    """
+    __slots__ = "settings", "logger", "engine", "session_factory"
 
     def __init__(self, settings: Settings, logger: Logger):
+        self.settings = settings
         self.logger = logger
-        engine = sqlalchemy.ext.asyncio.create_async_engine(
-            settings.DATABASE_URL,
-            echo=False,
-            future=True,
-        )
+        self.engine = create_engine(settings)
         self.session_factory = async_sessionmaker(
-            bind=engine,
+            bind=self.engine,
             expire_on_commit=False,
             class_=AsyncSession,
         )
 
+    async def start(self):
+        """
+        opens connections up front so the first requests don't pay for the handshake
+        """
+        if not self.settings.DB_POOL_ENABLED:
+            return
+
+        connections = min(self.settings.DB_POOL_WARM_UP_CONNECTIONS, self.settings.DB_POOL_SIZE)
+
+        async def check_out():
+            async with self.engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+
+        await asyncio.gather(*(check_out() for _ in range(connections)))
+        self.logger.info("Connection pool warmed", connections=connections)
+
+    async def stop(self):
+        await self.engine.dispose()
+        self.logger.info("Connection pool disposed")
+
+
+def build_repository(repo_cls: Type[T], session: AsyncSession, logger: Logger) -> T:
+    params = repo_cls.__init__.__annotations__
+
+    if 'logger' in params:
+        return repo_cls(session, logger=logger)
+    else:
+        return repo_cls(session)
+
+
+class SqlAlchemyUnitOfWork:
+    __slots__ = "session_factory", "logger", "session"
+
+    def __init__(self, pool: SqlAlchemyConnectionPool, logger: Logger):
+        self.logger = logger
+        self.session_factory = pool.session_factory
+
     async def __aenter__(self):
         self.session = self.session_factory()
         return self
@@ -67,38 +174,8 @@ class SqlAlchemyUnitOfWork:
         - session (mandatory)
         - logger (optional)
         """
-
-        repo_cls = PERSISTENCE_REGISTRY[cls]
-        params = repo_cls.__init__.__annotations__
-
-        if 'logger' in params:
-            return repo_cls(self.session, logger=self.logger)
-        else:
-            return repo_cls(self.session)
+        return build_repository(PERSISTENCE_REGISTRY[cls], self.session, self.logger)
 
     async def save(self):
         await self.session.commit()
 
-
-def async_ttl_cache(ttl_seconds: int = 300):
-    cache = {}
-
-    def decorator(func: Callable[..., Coroutine[Any, Any, Optional[Any]]]):
-        @wraps(func)
-        async def wrapper(self, _id: str, *args, **kwargs) -> Optional[Any]:
-            now = time.time()
-            logger: Logger = self.logger
-            if _id in cache:
-                cached_time, cached_value = cache[_id]
-                if now - cached_time < ttl_seconds:
-                    logger.info("Cache hit", cache_id=_id)
-                    return cached_value
-                else:
-                    logger.info("Cache expired", cache_id=_id)
-                    del cache[_id]
-            logger.info("Cache miss", cache_id=_id)
-            result = await func(self, _id, *args, **kwargs)
-            cache[_id] = (now, result)
-            return result
-        return wrapper
-    return decorator
\ No newline at end of file
@@ -0,0 +1,1064 @@
+import asyncio
+import dataclasses
+import inspect
+import json
+import math
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone, timedelta, tzinfo
+from functools import wraps
+from itertools import islice
+from typing import Any, Callable, Coroutine, Optional, Hashable, Awaitable, Protocol
+from zoneinfo import ZoneInfo
+
+import asyncpg
+from sqlalchemy import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core import MetricUpdates
+from src.crosscutting import Logger
+from src.infrastructure import Settings, build_repository
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_BUSY_TIMEOUT_SECONDS = 0.05
+# how long the shared backend's writer thread waits for another worker's write lock
+WRITE_TIMEOUT_SECONDS = 5
+
+MISSING = object()
+
+AGGREGATES_CACHE = "metric_aggregates"
+RECORDS_CACHE = "metric_records"
+RECORD_BATCHES_CACHE = "metric_record_batches"
+RESPONSES_CACHE = "metric_responses"
+RECORD_SNAPSHOTS_CACHE = "metric_record_snapshots"
+
+INVALIDATION_CHANNEL = "metric_cache_invalidation"
+
+
+@dataclasses.dataclass(slots=True)
+class CacheEntry:
+    value: Any
+    stale_at: float
+    expires_at: float
+    size: int
+    tag: Hashable = None
+
+
+class CacheBackend(Protocol):
+    """
+    storage for one cache namespace, entries go stale after the soft ttl and are
+    dropped after the hard ttl
+    """
+    namespace: str
+    generation: int
+
+    def lookup(self, key: Hashable) -> Optional[CacheEntry]:
+        ...
+
+    def get(self, key: Hashable) -> Any:
+        ...
+
+    def is_stale(self, entry: CacheEntry) -> bool:
+        ...
+
+    def seconds_until_stale(self, key: Hashable) -> Optional[float]:
+        ...
+
+    def set(self,
+        key: Hashable,
+        value: Any,
+        max_age_seconds: float = math.inf,
+        tag: Hashable = None,
+        generation: Optional[int] = None
+    ):
+        ...
+
+    def invalidate(self, key: Hashable):
+        ...
+
+    def invalidate_tag(self, tag: Hashable):
+        ...
+
+    def clear(self):
+        ...
+
+    def configure(self, ttl_seconds: float, hard_ttl_seconds: float, max_entries: int, max_bytes: int):
+        ...
+
+    def sweep(self) -> int:
+        ...
+
+    def stats(self) -> dict[str, int]:
+        ...
+
+
+class LruTtlCache:
+    """
+    bounded in process cache, the least recently used entries are evicted once either
+    the entry count or the approximate byte budget is exceeded
+
+    entries go stale after the soft ttl and are dropped after the hard ttl,
+    stale entries are still served while they get refreshed in the background
+    """
+    __slots__ = "namespace", "ttl_seconds", "hard_ttl_seconds", "max_entries", "max_bytes", "clock", "entries", \
+        "tags", "size", "generation", "hits", "stale_hits", "misses", "evictions", "expirations"
+
+    def __init__(self,
+        namespace: str,
+        ttl_seconds: float,
+        hard_ttl_seconds: Optional[float] = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.hard_ttl_seconds = ttl_seconds if hard_ttl_seconds is None else hard_ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.entries: OrderedDict[Hashable, CacheEntry] = OrderedDict()
+        self.tags: dict[Hashable, set[Hashable]] = {}
+        self.size = 0
+        self.generation = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def lookup(self, key: Hashable) -> Optional[CacheEntry]:
+        """
+        :return: the entry, possibly stale, or None once it is missing or past its hard ttl
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        now = self.clock()
+        if entry.expires_at <= now:
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        if entry.stale_at <= now:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def get(self, key: Hashable) -> Any:
+        """
+        :return: the cached value or MISSING
+        """
+        entry = self.lookup(key)
+        return MISSING if entry is None else entry.value
+
+    def is_stale(self, entry: CacheEntry) -> bool:
+        return entry.stale_at <= self.clock()
+
+    def seconds_until_stale(self, key: Hashable) -> Optional[float]:
+        """
+        looks at an entry without counting a read or touching its recency
+        :return: None once the entry is missing or past its hard ttl
+        """
+        entry = self.entries.get(key)
+        now = self.clock()
+        if entry is None or entry.expires_at <= now:
+            return None
+        return entry.stale_at - now
+
+    def set(self,
+        key: Hashable,
+        value: Any,
+        max_age_seconds: float = math.inf,
+        tag: Hashable = None,
+        generation: Optional[int] = None
+    ):
+        """
+        :param max_age_seconds: caps both ttls for this entry
+        :param tag: groups entries so they can be invalidated together
+        :param generation: generation the value was loaded under, stale loads that
+        raced an invalidation are dropped rather than stored
+        """
+        if generation is not None and generation != self.generation:
+            return
+
+        if key in self.entries:
+            self._remove(key)
+
+        size = approximate_size(value)
+        if size > self.max_bytes:
+            return
+
+        now = self.clock()
+        self.entries[key] = CacheEntry(
+            value=value,
+            stale_at=now + min(self.ttl_seconds, max_age_seconds),
+            expires_at=now + min(max(self.hard_ttl_seconds, self.ttl_seconds), max_age_seconds),
+            size=size,
+            tag=tag
+        )
+        if tag is not None:
+            self.tags.setdefault(tag, set()).add(key)
+        self.size += size
+        self._evict()
+
+    def invalidate(self, key: Hashable):
+        self.generation += 1
+        if key in self.entries:
+            self._remove(key)
+
+    def invalidate_tag(self, tag: Hashable):
+        self.generation += 1
+        for key in list(self.tags.get(tag, ())):
+            self._remove(key)
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+        self.tags.clear()
+        self.size = 0
+
+    def configure(self, ttl_seconds: float, hard_ttl_seconds: float, max_entries: int, max_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.hard_ttl_seconds = hard_ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def sweep(self) -> int:
+        """
+        drops every entry past its hard ttl, not just the ones being read
+        """
+        now = self.clock()
+        expired = [key for key, entry in self.entries.items() if entry.expires_at <= now]
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+        return len(expired)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _evict(self):
+        while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+            key = next(iter(self.entries))
+            self._remove(key)
+            self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        entry = self.entries.pop(key)
+        self.size -= entry.size
+        if entry.tag is not None:
+            keys = self.tags[entry.tag]
+            keys.discard(key)
+            if not keys:
+                del self.tags[entry.tag]
+
+
+class SqliteSharedCacheBackend:
+    """
+    host wide cache shared by every worker process, backed by a sqlite database
+    that should sit on a tmpfs path such as /dev/shm
+
+    values are pickled, so the file must only be writable by the service user,
+    invalidating from any worker removes the entries for all of them
+
+    lookups are one primary key probe on the event loop, which in wal mode never waits on a writer
+    for more than busy_timeout_seconds, pickling and every write run in order on the backend's own
+    writer thread, an invalidation hides its entries here from the moment it is made until the
+    writer has applied it
+    """
+    __slots__ = "namespace", "path", "ttl_seconds", "hard_ttl_seconds", "max_entries", "max_bytes", "clock", \
+        "connection", "write_connection", "writer", "lock", "generation", "pending", "hits", "stale_hits", "misses", \
+        "evictions", "expirations", "busy"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cache_entries (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            tag TEXT,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            stale_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        );
+        CREATE INDEX IF NOT EXISTS cache_entries_tag ON cache_entries (namespace, tag);
+        CREATE INDEX IF NOT EXISTS cache_entries_accessed ON cache_entries (namespace, accessed_at);
+        CREATE TABLE IF NOT EXISTS cache_generations (
+            namespace TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL
+        );
+        -- entries and bytes per namespace, kept by triggers so bounds are checked without aggregating
+        CREATE TABLE IF NOT EXISTS cache_usage (
+            namespace TEXT PRIMARY KEY,
+            entries INTEGER NOT NULL,
+            size INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO cache_usage (namespace, entries, size)
+            SELECT namespace, COUNT(*), SUM(size) FROM cache_entries GROUP BY namespace;
+        CREATE TRIGGER IF NOT EXISTS cache_entries_inserted AFTER INSERT ON cache_entries BEGIN
+            INSERT INTO cache_usage (namespace, entries, size) VALUES (new.namespace, 1, new.size)
+                ON CONFLICT (namespace) DO UPDATE SET entries = entries + 1, size = size + new.size;
+        END;
+        CREATE TRIGGER IF NOT EXISTS cache_entries_resized AFTER UPDATE OF size ON cache_entries BEGIN
+            UPDATE cache_usage SET size = size - old.size + new.size WHERE namespace = new.namespace;
+        END;
+        CREATE TRIGGER IF NOT EXISTS cache_entries_deleted AFTER DELETE ON cache_entries BEGIN
+            UPDATE cache_usage SET entries = entries - 1, size = size - old.size WHERE namespace = old.namespace;
+        END;
+    """
+
+    def __init__(self,
+        namespace: str,
+        path: str,
+        ttl_seconds: float,
+        hard_ttl_seconds: Optional[float] = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        clock: Callable[[], float] = time.time,
+        busy_timeout_seconds: float = DEFAULT_BUSY_TIMEOUT_SECONDS
+    ):
+        self.namespace = namespace
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.hard_ttl_seconds = ttl_seconds if hard_ttl_seconds is None else hard_ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # wall clock rather than monotonic, expiry times are compared across processes
+        self.clock = clock
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.busy = 0
+        # invalidations not yet applied by the writer, one list of ("key", repr), ("tag", str) or ("all", None)
+        # per call, guarded by lock as the writer takes them off the front
+        self.pending: list[list[tuple[str, Optional[str]]]] = []
+        self.lock = threading.Lock()
+
+        created = not os.path.exists(path)
+        # the schema is created once at startup, where waiting on another worker is fine
+        self.connection = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        if created:
+            os.chmod(path, 0o600)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(self.SCHEMA)
+        self.connection.execute(f"PRAGMA busy_timeout = {max(int(busy_timeout_seconds * 1000), 0)}")
+        # writes wait for another worker's lock on the writer thread, off the event loop
+        self.write_connection = sqlite3.connect(
+            path, timeout=WRITE_TIMEOUT_SECONDS, isolation_level=None, check_same_thread=False
+        )
+        self.write_connection.execute("PRAGMA synchronous=OFF")
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"cache-{namespace}")
+        # as last seen by this worker, loads compare it again on the writer before they are stored
+        self.generation = self._shared_generation()
+
+    def lookup(self, key: Hashable) -> Optional[CacheEntry]:
+        try:
+            row = self.connection.execute(
+                "SELECT value, size, stale_at, expires_at, tag FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, repr(key))
+            ).fetchone()
+        except sqlite3.OperationalError:
+            self.busy += 1
+            row = None
+        if row is None or self._is_pending(repr(key), row[4]):
+            self.misses += 1
+            return None
+
+        value, size, stale_at, expires_at, tag = row
+        now = self.clock()
+        if expires_at <= now:
+            self._submit(
+                self._try_write,
+                "DELETE FROM cache_entries WHERE namespace = ? AND key = ? AND expires_at <= ?",
+                (self.namespace, repr(key), now)
+            )
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        # recency is only a hint for eviction, losing it to a busy lock is fine
+        self._submit(
+            self._try_write,
+            "UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+            (now, self.namespace, repr(key))
+        )
+        if stale_at <= now:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return CacheEntry(value=pickle.loads(value), stale_at=stale_at, expires_at=expires_at, size=size, tag=tag)
+
+    def get(self, key: Hashable) -> Any:
+        entry = self.lookup(key)
+        return MISSING if entry is None else entry.value
+
+    def is_stale(self, entry: CacheEntry) -> bool:
+        return entry.stale_at <= self.clock()
+
+    def seconds_until_stale(self, key: Hashable) -> Optional[float]:
+        try:
+            row = self.connection.execute(
+                "SELECT stale_at, expires_at, tag FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, repr(key))
+            ).fetchone()
+        except sqlite3.OperationalError:
+            self.busy += 1
+            return None
+        now = self.clock()
+        if row is None or row[1] <= now or self._is_pending(repr(key), row[2]):
+            return None
+        return row[0] - now
+
+    def set(self,
+        key: Hashable,
+        value: Any,
+        max_age_seconds: float = math.inf,
+        tag: Hashable = None,
+        generation: Optional[int] = None
+    ):
+        if generation is not None and generation != self.generation:
+            return
+        now = self.clock()
+        stale_at = now + min(self.ttl_seconds, max_age_seconds)
+        expires_at = now + min(max(self.hard_ttl_seconds, self.ttl_seconds), max_age_seconds)
+        self._submit(
+            self._store, repr(key), None if tag is None else str(tag), value, stale_at, expires_at, now, generation
+        )
+
+    def invalidate(self, key: Hashable):
+        self.invalidate_keys([key])
+
+    def invalidate_keys(self, keys: list[Hashable]):
+        self._invalidate([("key", repr(key)) for key in keys])
+
+    def invalidate_tag(self, tag: Hashable):
+        self._invalidate([("tag", str(tag))])
+
+    def clear(self):
+        self._invalidate([("all", None)])
+
+    def configure(self, ttl_seconds: float, hard_ttl_seconds: float, max_entries: int, max_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.hard_ttl_seconds = hard_ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._submit(self._try_evict)
+
+    def sweep(self) -> int:
+        """
+        waits for the writer, so CacheSweeper calls it off the event loop
+        """
+        return self.writer.submit(self._sweep).result()
+
+    def stats(self) -> dict[str, int]:
+        entries, size = self._usage()
+        return {
+            "entries": entries,
+            "bytes": size,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "busy": self.busy,
+            "pending": sum(map(len, self.pending)),
+        }
+
+    def flush(self):
+        """
+        waits until every write made so far has been applied
+        """
+        self.writer.submit(self._try_pending).result()
+
+    def close(self):
+        self.writer.shutdown(wait=True)
+        self.write_connection.close()
+        self.connection.close()
+
+    def _submit(self, write: Callable[..., Any], *args):
+        self.writer.submit(write, *args)
+
+    def _invalidate(self, invalidations: list[tuple[str, Optional[str]]]):
+        with self.lock:
+            self.pending.append(invalidations)
+            # loads started before now are not stored, the writer brings the shared generation level with it
+            self.generation += 1
+        self._submit(self._try_pending)
+
+    def _is_pending(self, key: str, tag: Optional[str]) -> bool:
+        with self.lock:
+            return any(
+                kind == "all" or (kind == "key" and value == key) or (kind == "tag" and value == tag)
+                for invalidations in self.pending for kind, value in invalidations
+            )
+
+    # everything below runs on the writer thread
+
+    def _store(
+        self,
+        key: str,
+        tag: Optional[str],
+        value: Any,
+        stale_at: float,
+        expires_at: float,
+        now: float,
+        generation: Optional[int]
+    ):
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.max_bytes:
+            return
+        try:
+            self._apply_pending()
+            if self.pending:
+                return
+            with self._transaction():
+                shared = self._shared_generation()
+                self._catch_up(shared)
+                if generation is not None and generation != shared:
+                    return
+                self.write_connection.execute(
+                    "INSERT INTO cache_entries (namespace, key, tag, value, size, stale_at, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (namespace, key) DO UPDATE SET tag = excluded.tag, value = excluded.value, "
+                    "size = excluded.size, stale_at = excluded.stale_at, expires_at = excluded.expires_at, "
+                    "accessed_at = excluded.accessed_at",
+                    (self.namespace, key, tag, payload, len(payload), stale_at, expires_at, now)
+                )
+                self._evict()
+        except sqlite3.OperationalError:
+            self.busy += 1
+
+    def _try_pending(self):
+        try:
+            self._apply_pending()
+        except sqlite3.OperationalError:
+            self.busy += 1
+
+    def _apply_pending(self):
+        with self.lock:
+            pending = list(self.pending)
+        if not pending:
+            return
+        with self._transaction():
+            # one generation per invalidation call, as _invalidate counted them here
+            shared = self.write_connection.execute(
+                "INSERT INTO cache_generations (namespace, generation) VALUES (?, ?) "
+                "ON CONFLICT (namespace) DO UPDATE SET generation = generation + excluded.generation "
+                "RETURNING generation",
+                (self.namespace, len(pending))
+            ).fetchone()[0]
+            for invalidations in pending:
+                for kind, value in invalidations:
+                    if kind == "all":
+                        self.write_connection.execute(
+                            "DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,)
+                        )
+                    else:
+                        self.write_connection.execute(
+                            f"DELETE FROM cache_entries WHERE namespace = ? AND {kind} = ?", (self.namespace, value)
+                        )
+        with self.lock:
+            del self.pending[:len(pending)]
+            self.generation = max(self.generation, shared)
+
+    def _catch_up(self, shared: int):
+        with self.lock:
+            self.generation = max(self.generation, shared)
+
+    def _try_write(self, statement: str, parameters: tuple):
+        try:
+            self.write_connection.execute(statement, parameters)
+        except sqlite3.OperationalError:
+            self.busy += 1
+
+    def _try_evict(self):
+        try:
+            with self._transaction():
+                self._evict()
+        except sqlite3.OperationalError:
+            # the next set evicts down to the new limits
+            self.busy += 1
+
+    def _sweep(self) -> int:
+        try:
+            self._apply_pending()
+            cursor = self.write_connection.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?", (self.namespace, self.clock())
+            )
+        except sqlite3.OperationalError:
+            self.busy += 1
+            return 0
+        self.expirations += cursor.rowcount
+        return cursor.rowcount
+
+    def _shared_generation(self) -> int:
+        row = self.write_connection.execute(
+            "SELECT generation FROM cache_generations WHERE namespace = ?", (self.namespace,)
+        ).fetchone()
+        return 0 if row is None else row[0]
+
+    def _usage(self, connection: Optional[sqlite3.Connection] = None) -> tuple[int, int]:
+        row = (connection or self.connection).execute(
+            "SELECT entries, size FROM cache_usage WHERE namespace = ?", (self.namespace,)
+        ).fetchone()
+        return (0, 0) if row is None else row
+
+    def _evict(self):
+        entries, size = self._usage(self.write_connection)
+        while entries > self.max_entries or size > self.max_bytes:
+            row = self.write_connection.execute(
+                "DELETE FROM cache_entries WHERE rowid = "
+                "(SELECT rowid FROM cache_entries WHERE namespace = ? ORDER BY accessed_at LIMIT 1) RETURNING size",
+                (self.namespace,)
+            ).fetchone()
+            if row is None:
+                return
+            entries -= 1
+            size -= row[0]
+            self.evictions += 1
+
+    @contextmanager
+    def _transaction(self):
+        self.write_connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.write_connection.execute("ROLLBACK")
+            raise
+        else:
+            self.write_connection.execute("COMMIT")
+
+
+CACHE_REGISTRY: dict[str, CacheBackend] = {}
+
+
+def register_cache(cache: CacheBackend) -> CacheBackend:
+    if cache.namespace in CACHE_REGISTRY:
+        raise ValueError(f"Cache namespace {cache.namespace} is already registered")
+    CACHE_REGISTRY[cache.namespace] = cache
+    return cache
+
+
+# filled by LruEncodedResponseCache rather than a decorated reader
+register_cache(LruTtlCache(namespace=RESPONSES_CACHE, ttl_seconds=300))
+# windows as they were at an ingest watermark, filled by SqlAlchemyMetricRecordsDeltaReader, never tagged
+# as a record write is exactly when a poller needs the records from before it
+register_cache(LruTtlCache(namespace=RECORD_SNAPSHOTS_CACHE, ttl_seconds=300))
+
+
+# containers with more items than this are sized from their first ones scaled up to the rest, rows
+# of a stored query are alike enough that walking 100k of them on every set buys no better budget
+SIZE_SAMPLE = 128
+
+
+def approximate_size(value: Any, _depth: int = 0) -> int:
+    """
+    rough deep size in bytes, good enough for budgeting rather than exact accounting
+    """
+    size = sys.getsizeof(value)
+    if _depth > 6:
+        return size
+
+    if isinstance(value, dict):
+        sample = islice(value.items(), SIZE_SAMPLE)
+        size += scaled(sum(approximate_size(k, _depth + 1) + approximate_size(v, _depth + 1) for k, v in sample), len(value))
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        sample = islice(value, SIZE_SAMPLE)
+        size += scaled(sum(approximate_size(item, _depth + 1) for item in sample), len(value))
+    elif dataclasses.is_dataclass(value) and not isinstance(value, type):
+        size += sum(approximate_size(getattr(value, f.name, None), _depth + 1) for f in dataclasses.fields(value))
+    return size
+
+
+def scaled(sample_size: int, count: int) -> int:
+    return sample_size if count <= SIZE_SAMPLE else sample_size * count // SIZE_SAMPLE
+
+
+class SingleFlight:
+    """
+    coalesces concurrent calls for the same key, the first caller does the work
+    and everyone else waiting on that key shares its result or exception
+    """
+    __slots__ = "calls",
+
+    def __init__(self):
+        self.calls: dict[Hashable, asyncio.Future] = {}
+
+    async def __call__(self, key: Hashable, action: Callable[[], Awaitable[Any]]) -> Any:
+        pending = self.calls.get(key)
+        if pending is not None:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # the caller doing the work went away, pick it up instead
+                return await self(key, action)
+
+        future = asyncio.get_running_loop().create_future()
+        self.calls[key] = future
+        try:
+            result = await action()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # waiters re-raise it, stop asyncio complaining when there are none
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self.calls[key]
+
+
+class BackgroundRefresher:
+    """
+    refreshes stale entries off the request path, at most max_concurrent at a time
+    so refreshes can't starve requests of pool connections, anything over the
+    limit is skipped and retried by the next read of the stale entry
+    """
+    __slots__ = "max_concurrent", "tasks", "pending"
+
+    def __init__(self, max_concurrent: int = 2):
+        self.max_concurrent = max_concurrent
+        self.tasks: set[asyncio.Task] = set()
+        self.pending: set[Hashable] = set()
+
+    def schedule(self, key: Hashable, refresh: Callable[[], Awaitable[Any]], logger: Logger) -> bool:
+        if key in self.pending or len(self.pending) >= self.max_concurrent:
+            return False
+
+        async def run():
+            try:
+                await refresh()
+            except Exception as exc:
+                logger.warning("Cache refresh failed", cache_id=key, exc_info=exc)
+            finally:
+                self.pending.discard(key)
+
+        self.pending.add(key)
+        task = asyncio.create_task(run())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return True
+
+    async def cancel(self):
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.pending.clear()
+
+
+REFRESHER = BackgroundRefresher()
+
+# set when a reader cache serves an entry past its ttl, for whatever is built from the read in the same task
+STALE_READ: ContextVar[bool] = ContextVar("stale_read", default=False)
+
+
+# the TimeZone every session of the engine is pinned to, set from settings by configure_caches
+DATABASE_TIMEZONE: tzinfo = timezone.utc
+
+
+def seconds_until_midnight(now: Optional[datetime] = None, zone: Optional[tzinfo] = None) -> float:
+    """
+    seconds until the next day boundary in the database's TimeZone, when CURRENT_DATE moves on in postgres
+    """
+    zone = zone or DATABASE_TIMEZONE
+    today = (now or datetime.now(timezone.utc)).astimezone(zone)
+    midnight = datetime.combine(today.date() + timedelta(days=1), datetime.min.time(), tzinfo=zone)
+    # both sides in utc, aware datetimes sharing a zone subtract as wall clock times across dst changes
+    return (midnight.astimezone(timezone.utc) - today.astimezone(timezone.utc)).total_seconds()
+
+
+async def call_in_own_session(reader, func: Callable[..., Awaitable[Any]], **arguments) -> Any:
+    """
+    runs a reader call on a new session from the same engine, for work that
+    outlives the request whose session the reader was built with
+    """
+    async with AsyncSession(bind=reader.session.bind, expire_on_commit=False) as session:
+        own_reader = build_repository(type(reader), session, reader.logger)
+        return await func(own_reader, **arguments)
+
+
+def async_ttl_cache(
+    namespace: str,
+    ttl_seconds: float = 300,
+    max_age: Optional[Callable[..., float]] = None,
+    key: Optional[Callable[..., Hashable]] = None,
+    tag: Optional[Callable[..., Hashable]] = None
+):
+    """
+    caches a reader's results in its own namespace, concurrent misses for the same key share a single database call,
+    stale entries are served while one background refresh runs on its own session
+    :param max_age: given the call arguments, caps how long an entry may live, stale or not
+    :param key: builds the cache key from the call arguments, defaults to all of them
+    :param tag: groups entries from the call arguments for invalidate_tag
+    """
+    register_cache(LruTtlCache(namespace=namespace, ttl_seconds=ttl_seconds))
+    flight = SingleFlight()
+
+    def decorator(func: Callable[..., Coroutine[Any, Any, Optional[Any]]]):
+        signature = inspect.signature(func)
+
+        def bind(reader, *args, **kwargs) -> dict[str, Any]:
+            return dict(list(signature.bind(reader, *args, **kwargs).arguments.items())[1:])
+
+        def key_for(arguments: dict[str, Any]) -> Hashable:
+            return key(**arguments) if key else tuple(arguments.values())
+
+        def store(cache_key: Hashable, arguments: dict[str, Any], value: Any, generation: Optional[int] = None):
+            CACHE_REGISTRY[namespace].set(
+                cache_key,
+                value,
+                max_age_seconds=max_age(**arguments) if max_age else math.inf,
+                tag=tag(**arguments) if tag else None,
+                generation=generation
+            )
+
+        async def load(cache_key: Hashable, arguments: dict[str, Any], reader_call: Callable[[], Awaitable[Any]]):
+            # a call made after an invalidation reads the new generation, so it never joins a load
+            # that started before it and would hand back what was there before the write
+            generation = CACHE_REGISTRY[namespace].generation
+
+            async def loaded():
+                result = await reader_call()
+                store(cache_key, arguments, result, generation)
+                return result
+
+            return await flight((cache_key, generation), loaded)
+
+        @wraps(func)
+        async def wrapper(self, *args, **kwargs) -> Optional[Any]:
+            arguments = bind(self, *args, **kwargs)
+            cache_key = key_for(arguments)
+            cache = CACHE_REGISTRY[namespace]
+            logger: Logger = self.logger
+
+            entry = cache.lookup(cache_key)
+            if entry is not None:
+                if cache.is_stale(entry):
+                    logger.info("Cache stale", cache=namespace, cache_id=cache_key)
+                    STALE_READ.set(True)
+                    REFRESHER.schedule(
+                        (namespace, cache_key),
+                        lambda: load(cache_key, arguments, lambda: call_in_own_session(self, func, **arguments)),
+                        logger
+                    )
+                else:
+                    logger.info("Cache hit", cache=namespace, cache_id=cache_key)
+                return entry.value
+
+            logger.info("Cache miss", cache=namespace, cache_id=cache_key)
+            return await load(cache_key, arguments, lambda: func(self, *args, **kwargs))
+
+        def prime(value: Any, **kwargs):
+            """
+            stores a value loaded elsewhere under the entry a call with these arguments would read
+            """
+            arguments = bind(None, **kwargs)
+            store(key_for(arguments), arguments, value)
+
+        async def refresh(reader, **kwargs) -> Any:
+            """
+            reloads the entry for these arguments whether or not it is still fresh
+            """
+            arguments = bind(reader, **kwargs)
+            cache_key = key_for(arguments)
+            return await load(cache_key, arguments, lambda: func(reader, **arguments))
+
+        def seconds_until_stale(**kwargs) -> Optional[float]:
+            return CACHE_REGISTRY[namespace].seconds_until_stale(key_for(bind(None, **kwargs)))
+
+        wrapper.prime = prime
+        wrapper.refresh = refresh
+        wrapper.seconds_until_stale = seconds_until_stale
+        return wrapper
+    return decorator
+
+
+def evict(config_id: Optional[str] = None, query_id: Optional[str] = None):
+    if config_id is not None:
+        CACHE_REGISTRY[AGGREGATES_CACHE].invalidate_tag(config_id)
+        # responses are tagged by query id, configurations change rarely enough to drop them all
+        CACHE_REGISTRY[RESPONSES_CACHE].clear()
+    if query_id is not None:
+        CACHE_REGISTRY[RECORDS_CACHE].invalidate_tag(query_id)
+        CACHE_REGISTRY[RECORD_BATCHES_CACHE].invalidate_tag(query_id)
+        CACHE_REGISTRY[RESPONSES_CACHE].invalidate_tag(query_id)
+
+
+class LocalMetricCacheInvalidator:
+    """
+    evicts entries from this process's caches
+    """
+
+    async def invalidate_records(self, query_id: str) -> None:
+        evict(query_id=query_id)
+
+    async def invalidate_configuration(self, config_id: str) -> None:
+        evict(config_id=config_id)
+
+
+class PostgresCacheInvalidationListener:
+    """
+    LISTENs for invalidations published by any instance and evicts them from this process's caches,
+    notifications sent while disconnected are lost so every cache is cleared after a reconnect
+
+    record invalidations are also reported to updates, so subscribers here hear of writes made elsewhere
+    """
+    __slots__ = "settings", "logger", "updates", "task", "listening"
+
+    def __init__(self, settings: Settings, logger: Logger, updates: Optional[MetricUpdates] = None):
+        self.settings = settings
+        self.logger = logger
+        self.updates = updates
+        self.task = None
+        self.listening = asyncio.Event()
+
+    async def start(self):
+        if not self.settings.CACHE_INVALIDATION_LISTENER_ENABLED:
+            return
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self):
+        dsn = make_url(self.settings.DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+        reconnecting = False
+        while True:
+            try:
+                connection = await asyncpg.connect(dsn, timeout=self.settings.DB_CONNECT_TIMEOUT_SECONDS)
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+                self.logger.warning("Cache invalidation listener failed to connect", error=str(e))
+                await asyncio.sleep(self.settings.CACHE_INVALIDATION_RECONNECT_SECONDS)
+                continue
+
+            closed = asyncio.Event()
+            connection.add_termination_listener(lambda _: closed.set())
+            try:
+                await connection.add_listener(INVALIDATION_CHANNEL, self._on_notification)
+                if reconnecting:
+                    for cache in CACHE_REGISTRY.values():
+                        cache.clear()
+                    self.logger.warning("Caches cleared after listener reconnect", channel=INVALIDATION_CHANNEL)
+                    if self.updates is not None:
+                        self.updates.resync()
+                reconnecting = True
+                self.listening.set()
+                self.logger.info("Cache invalidation listener started", channel=INVALIDATION_CHANNEL)
+                await closed.wait()
+                self.logger.warning("Cache invalidation listener disconnected", channel=INVALIDATION_CHANNEL)
+            finally:
+                self.listening.clear()
+                if not connection.is_closed():
+                    connection.terminate()
+            await asyncio.sleep(self.settings.CACHE_INVALIDATION_RECONNECT_SECONDS)
+
+    def _on_notification(self, connection, pid: int, channel: str, payload: str):
+        try:
+            message = json.loads(payload)
+            config_id, query_id = message.get("config_id"), message.get("query_id")
+        except (ValueError, AttributeError):
+            self.logger.warning("Invalid cache invalidation ignored", payload=payload)
+            return
+        evict(config_id=config_id, query_id=query_id)
+        self.logger.info("Cache invalidated", config_id=config_id, query_id=query_id, publisher_pid=pid)
+        if query_id is not None and self.updates is not None:
+            self.updates.changed(query_id)
+
+
+def configure_caches(settings: Settings):
+    """
+    applies ttls and bounds from settings, moving every namespace onto the shared backend if configured
+    """
+    global DATABASE_TIMEZONE
+    DATABASE_TIMEZONE = ZoneInfo(settings.DB_TIMEZONE)
+    for namespace, cache in list(CACHE_REGISTRY.items()):
+        if settings.CACHE_BACKEND == "shared" and not isinstance(cache, SqliteSharedCacheBackend):
+            cache = SqliteSharedCacheBackend(
+                namespace=namespace,
+                path=settings.CACHE_SHARED_PATH,
+                ttl_seconds=cache.ttl_seconds,
+                busy_timeout_seconds=settings.CACHE_SHARED_BUSY_TIMEOUT_SECONDS
+            )
+            CACHE_REGISTRY[namespace] = cache
+        cache.configure(
+            ttl_seconds=settings.CACHE_SOFT_TTL_SECONDS,
+            hard_ttl_seconds=settings.CACHE_HARD_TTL_SECONDS,
+            max_entries=settings.CACHE_MAX_ENTRIES,
+            max_bytes=settings.CACHE_MAX_BYTES
+        )
+
+
+class CacheSweeper:
+    """
+    applies cache settings and periodically drops expired entries
+    """
+    __slots__ = "settings", "logger", "task"
+
+    def __init__(self, settings: Settings, logger: Logger):
+        self.settings = settings
+        self.logger = logger
+        self.task = None
+
+    async def start(self):
+        configure_caches(self.settings)
+        REFRESHER.max_concurrent = self.settings.CACHE_MAX_CONCURRENT_REFRESHES
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        await REFRESHER.cancel()
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.settings.CACHE_SWEEP_INTERVAL_SECONDS)
+            for cache in CACHE_REGISTRY.values():
+                if isinstance(cache, SqliteSharedCacheBackend):
+                    expired = await asyncio.to_thread(cache.sweep)
+                else:
+                    expired = cache.sweep()
+                self.logger.info("Cache swept", cache=cache.namespace, expired=expired, **cache.stats())
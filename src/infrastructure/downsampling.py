@@ -0,0 +1,242 @@
+import datetime
+import operator
+from contextlib import suppress
+from decimal import Decimal
+from itertools import repeat
+from typing import Any
+
+import numpy as np
+
+from src.core import RecordSet, RecordBatch, Downsampling
+
+# fewest points a series is cut down to, lttb always keeps its first and last rows and one between
+MIN_POINTS = 3
+
+
+def is_number(value: Any) -> bool:
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+def first_value(column: tuple) -> Any:
+    return next((value for value in column if value is not None), None)
+
+
+# naive datetimes are placed by their distance from this, whatever the local timezone
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_floats(column: tuple) -> np.ndarray:
+    """
+    numbers as floats, nan where a value is missing
+    """
+    if isinstance(first_value(column), Decimal):
+        # numpy converts decimals one at a time through python, float over the column is quicker
+        with suppress(TypeError): # a missing value, left to numpy
+            return np.fromiter(map(float, column), np.float64, len(column))
+    return np.array(column, dtype=np.float64)
+
+
+def time_positions(column: tuple) -> np.ndarray:
+    """
+    a date or datetime column as positions along the x axis, nan where a value is missing
+    """
+    if None in column:
+        present = [value for value in column if value is not None]
+        positions = np.full(len(column), np.nan)
+        positions[[i for i, value in enumerate(column) if value is not None]] = time_positions(tuple(present))
+        return positions
+
+    sample = column[0]
+    if isinstance(sample, datetime.datetime) and sample.tzinfo is None:
+        # kept to builtins mapped over the column, a python function per value costs more than the rest
+        positions = map(datetime.timedelta.total_seconds, map(operator.sub, column, repeat(EPOCH)))
+    elif isinstance(sample, datetime.datetime):
+        positions = map(datetime.datetime.timestamp, column)
+    else:
+        positions = map(datetime.date.toordinal, column)
+    return np.fromiter(positions, np.float64, len(column))
+
+
+def codes(column: tuple) -> tuple[np.ndarray, int]:
+    """
+    each value of a column as the index of its first appearance among the distinct values, with how many there are
+    """
+    distinct = {value: code for code, value in enumerate(dict.fromkeys(column))}
+    return np.fromiter(map(distinct.__getitem__, column), np.int64, len(column)), len(distinct)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """
+    largest triangle three buckets, indexes of the rows that keep the shape of the line
+
+    bucket averages and each bucket's triangle areas are computed with numpy, only the walk
+    from bucket to bucket is a loop as each pick depends on the one before it
+    """
+    size = len(x)
+    if size <= points:
+        return np.arange(size)
+
+    # the rows between the first and the last split into points - 2 buckets, none of them empty
+    edges = np.linspace(1, size - 1, points - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    counts = ends - starts
+    average_x = np.add.reduceat(x[:size - 1], starts) / counts
+    average_y = np.add.reduceat(y[:size - 1], starts) / counts
+    # each bucket's triangle closes on the next bucket's average, the last one's on the last row
+    next_x = np.append(average_x[1:], x[-1])
+    next_y = np.append(average_y[1:], y[-1])
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, size - 1
+    picked = 0
+    for bucket, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        picked_x, picked_y = x[picked], y[picked]
+        areas = np.abs(
+            (x[start:end] - picked_x) * (next_y[bucket] - picked_y)
+            - (y[start:end] - picked_y) * (next_x[bucket] - picked_x)
+        )
+        picked = start + int(np.argmax(areas))
+        selected[bucket + 1] = picked
+    return selected
+
+
+def time_buckets(x: np.ndarray, points: int) -> np.ndarray:
+    """
+    where each bucket starts in x, sorted, split into points buckets of equal time, empty ones left out
+    """
+    low, high = x[0], x[-1]
+    if high == low:
+        return np.zeros(1, dtype=np.int64)
+    buckets = np.minimum(((x - low) / (high - low) * points).astype(np.int64), points - 1)
+    return np.flatnonzero(np.diff(buckets, prepend=-1))
+
+
+class NumpyRecordsDownsampler:
+    """
+    records are split into series by their columns that aren't numbers, each series is ordered
+    by the first date or datetime column, or kept in row order without one, and numbers are
+    plotted against it
+
+    lttb keeps whole rows as they were read, picked by the first number column, bucket
+    aggregates give one row per bucket of equal time with its earliest x, min and max keep the
+    value they picked as it was read, avg is a float, or a decimal for decimal columns
+
+    rows without an x are left out, series already within max_points are kept whole and
+    records where no series is over it are returned as they are
+    """
+    __slots__ = ()
+
+    def __call__(
+        self,
+        record_set: RecordSet | RecordBatch,
+        max_points: int,
+        method: Downsampling
+    ) -> RecordSet | RecordBatch:
+        batch = record_set.to_batch() if isinstance(record_set, RecordSet) else record_set
+        size = len(batch)
+        points = max(max_points, MIN_POINTS)
+        if size <= points:
+            return record_set
+
+        samples = [first_value(column) for column in batch.values]
+        time_column = next(
+            (i for i, sample in enumerate(samples) if isinstance(sample, datetime.date)), None
+        )
+        numbers = [i for i, sample in enumerate(samples) if i != time_column and is_number(sample)]
+        groups = [i for i in range(len(samples)) if i != time_column and i not in numbers]
+
+        if time_column is None:
+            x = np.arange(size, dtype=np.float64)
+        else:
+            x = time_positions(batch.values[time_column])
+        series = self.series(batch, groups, np.flatnonzero(~np.isnan(x)))
+        if all(len(rows) <= points for rows in series):
+            return record_set
+
+        if method == Downsampling.lttb:
+            y = to_floats(batch.values[numbers[0]]) if numbers else np.zeros(size)
+            return self.select(batch, series, x, y, points, max_points)
+        ys = {i: to_floats(batch.values[i]) for i in numbers}
+        return self.aggregate(batch, series, x, ys, points, max_points, method)
+
+    @staticmethod
+    def series(batch: RecordBatch, groups: list[int], rows: np.ndarray) -> list[np.ndarray]:
+        """
+        row indexes of each series, grouped by the values of the columns that aren't numbers
+        """
+        if not groups:
+            return [rows]
+        keys = np.zeros(len(batch), dtype=np.int64)
+        for i in groups:
+            column_codes, distinct = codes(batch.values[i])
+            keys = keys * distinct + column_codes
+        keys = keys[rows]
+        order = np.argsort(keys, kind="stable")
+        starts = np.flatnonzero(np.diff(keys[order], prepend=-1))
+        return np.split(rows[order], starts[1:])
+
+    @staticmethod
+    def select(
+        batch: RecordBatch,
+        series: list[np.ndarray],
+        x: np.ndarray,
+        y: np.ndarray,
+        points: int,
+        max_points: int
+    ) -> RecordBatch:
+        kept = []
+        for rows in series:
+            ordered = rows[np.argsort(x[rows], kind="stable")]
+            kept.append(ordered[lttb(x[ordered], np.nan_to_num(y[ordered]), points)])
+        # picked rows stay in the order the stored query returned them
+        keep = np.sort(np.concatenate(kept)).tolist()
+        return RecordBatch(
+            columns=batch.columns,
+            values=tuple(tuple(column[row] for row in keep) for column in batch.values),
+            version=f"{batch.version}-{Downsampling.lttb.value}{max_points}"
+        )
+
+    @staticmethod
+    def aggregate(
+        batch: RecordBatch,
+        series: list[np.ndarray],
+        x: np.ndarray,
+        ys: dict[int, np.ndarray],
+        points: int,
+        max_points: int,
+        method: Downsampling
+    ) -> RecordBatch:
+        firsts, values = [], [[] for _ in batch.columns]
+        for rows in series:
+            ordered = rows[np.argsort(x[rows], kind="stable")]
+            starts = time_buckets(x[ordered], points)
+            first_rows = ordered[starts].tolist()
+            firsts.extend(first_rows)
+            for i, column in enumerate(batch.values):
+                if i not in ys:
+                    values[i].extend(column[row] for row in first_rows)
+                    continue
+                y = ys[i][ordered]
+                if method == Downsampling.avg:
+                    present = ~np.isnan(y)
+                    sums = np.add.reduceat(np.where(present, y, 0.0), starts)
+                    counts = np.add.reduceat(present, starts)
+                    means = np.divide(sums, counts, out=np.full(len(starts), np.nan), where=counts > 0).tolist()
+                    exact = isinstance(first_value(column), Decimal)
+                    values[i].extend(
+                        None if mean != mean else Decimal(str(mean)) if exact else mean for mean in means
+                    )
+                else:
+                    # sorted by bucket then value, missing values last, the first row of each bucket is its pick
+                    ranked = np.where(np.isnan(y), np.inf, y if method == Downsampling.min else -y)
+                    buckets = np.repeat(np.arange(len(starts)), np.diff(starts, append=len(ordered)))
+                    picked = ordered[np.lexsort((ranked, buckets))[starts]].tolist()
+                    values[i].extend(column[row] for row in picked)
+
+        # buckets in the order their first rows were returned in
+        order = np.argsort(np.array(firsts, dtype=np.int64), kind="stable").tolist()
+        return RecordBatch(
+            columns=batch.columns,
+            values=tuple(tuple(column[j] for j in order) for column in values),
+            version=f"{batch.version}-{method.value}{max_points}"
+        )
@@ -0,0 +1,156 @@
+import asyncio
+import io
+from contextlib import suppress
+from datetime import date
+from decimal import Decimal
+from typing import AsyncIterator, Callable, Optional, Any
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core import QuerySnapshot, ExportFormat
+from src.crosscutting import auto_slots, Logger
+from src.infrastructure.readers import positional_statement
+
+# rows fetched from the cursor and written per arrow record batch or parquet row group
+EXPORT_BATCH_SIZE = 10_000
+# csv chunks from COPY held while the client catches up
+EXPORT_CSV_BUFFERED_CHUNKS = 64
+
+
+def to_float(value: Optional[Decimal]) -> Optional[float]:
+    return None if value is None else float(value)
+
+
+def to_str(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+# postgres type name to the arrow type its column is written as, with the conversion its values need first,
+# numeric goes to float64 like it would in a dataframe, csv keeps it exact
+ARROW_TYPES: dict[str, tuple[pa.DataType, Optional[Callable[[Any], Any]]]] = {
+    "bool": (pa.bool_(), None),
+    "int2": (pa.int16(), None),
+    "int4": (pa.int32(), None),
+    "int8": (pa.int64(), None),
+    "float4": (pa.float32(), None),
+    "float8": (pa.float64(), None),
+    "numeric": (pa.float64(), to_float),
+    "text": (pa.string(), None),
+    "varchar": (pa.string(), None),
+    "bpchar": (pa.string(), None),
+    "name": (pa.string(), None),
+    "date": (pa.date32(), None),
+    "timestamp": (pa.timestamp("us"), None),
+    "timestamptz": (pa.timestamp("us", tz="UTC"), None),
+}
+OTHER_ARROW_TYPE = (pa.string(), to_str)
+
+
+class ChunkSink(io.RawIOBase):
+    """
+    collects what a writer wrote since it was last drained, so a file format can be sent as it is written
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+@auto_slots
+class AsyncpgMetricRecordsExporter:
+    """
+    exports a stored query on the session's asyncpg connection, arrow and parquet from a server side
+    cursor turned into arrow columns a batch at a time, csv straight from postgres with COPY,
+    no per row dicts are built and at most one batch is held, results are not cached
+    """
+
+    def __init__(self, session: AsyncSession, logger: Logger):
+        self.logger = logger
+        self.session = session
+
+    async def __call__(
+        self,
+        query: QuerySnapshot,
+        start_date: date,
+        end_date: date,
+        day_range: int,
+        format: ExportFormat,
+        batch_size: int = EXPORT_BATCH_SIZE
+    ) -> AsyncIterator[bytes]:
+        params = {
+            "start_date": start_date,
+            "end_date": end_date,
+            "day_range": day_range,
+        }
+        compiled = positional_statement(query.query)
+        args = [params[name] for name in compiled.parameters]
+        connection = (await (await self.session.connection()).get_raw_connection()).driver_connection
+        if format == ExportFormat.csv:
+            chunks = self._copy_csv(connection, compiled.sql, args)
+        else:
+            chunks = self._write_arrow(connection, compiled.sql, args, format, batch_size)
+        async for chunk in chunks:
+            yield chunk
+
+    async def _write_arrow(self, connection, sql: str, args: list, format: ExportFormat, batch_size: int):
+        statement = await connection.prepare(sql)
+        columns = [(attribute.name, ARROW_TYPES.get(attribute.type.name, OTHER_ARROW_TYPE))
+                   for attribute in statement.get_attributes()]
+        schema = pa.schema([(name, arrow_type) for name, (arrow_type, _) in columns])
+        sink = ChunkSink()
+        writer = pq.ParquetWriter(sink, schema) if format == ExportFormat.parquet else pa.ipc.new_stream(sink, schema)
+
+        async with connection.transaction():
+            cursor = await statement.cursor(*args)
+            while rows := await cursor.fetch(batch_size):
+                values = zip(*rows)
+                arrays = [
+                    pa.array(column if convert is None else map(convert, column), type=arrow_type, size=len(rows))
+                    for column, (_, (arrow_type, convert)) in zip(values, columns)
+                ]
+                writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+                yield sink.drain()
+        writer.close()
+        yield sink.drain()
+
+    async def _copy_csv(self, connection, sql: str, args: list):
+        chunks: asyncio.Queue[Optional[bytes]] = asyncio.Queue(maxsize=EXPORT_CSV_BUFFERED_CHUNKS)
+
+        async def output(chunk: bytearray):
+            await chunks.put(bytes(chunk))
+
+        async def copy():
+            # the stored query is wrapped in COPY (...) as it is for paging, a trailing ; would break out of it
+            try:
+                await connection.copy_from_query(
+                    f"\n{sql.strip().rstrip(';')}\n", *args, output=output, format="csv", header=True
+                )
+            except Exception:
+                await chunks.put(None)
+                raise
+            await chunks.put(None)
+
+        task = asyncio.create_task(copy())
+        try:
+            while (chunk := await chunks.get()) is not None:
+                yield chunk
+            await task
+        finally:
+            if not task.done():
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
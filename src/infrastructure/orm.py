@@ -1,7 +1,7 @@
 from typing import Optional, Any
 
 from sqlalchemy import (
-    Table, MetaData, Column, String, Float, DateTime, Integer, Boolean, ForeignKey
+    Table, MetaData, Column, String, Float, DateTime, Integer, Boolean, ForeignKey, BigInteger, Sequence, Index
 )
 from sqlalchemy.orm import registry, relationship, foreign
 
@@ -12,6 +12,9 @@ _mappers_started = False
 mapper_registry = registry()
 metadata = MetaData()
 
+# numbers metric rows in the order they were committed, per query, see SqlAlchemyMetricRecordWriter
+metrics_ingest_seq = Sequence("metrics_ingest_seq", metadata=metadata)
+
 metrics = Table(
     "metrics",
     metadata,
@@ -23,6 +26,8 @@ metrics = Table(
     Column("parts_flagged", Integer, nullable=True),
     Column("alert_type", String, nullable=True),
     Column("alert_category", String, nullable=True),
+    Column("ingest_seq", BigInteger, server_default=metrics_ingest_seq.next_value(), nullable=False),
+    Index("ix_metrics_id_ingest_seq", "id", "ingest_seq"),
 )
 
 queries = Table(
@@ -0,0 +1,161 @@
+import asyncio
+import dataclasses
+import heapq
+import time
+from datetime import date
+from typing import Optional
+
+from src.core import MetricAccessTracker
+from src.crosscutting import Logger
+from src.infrastructure import Settings, SqlAlchemyConnectionPool, build_repository
+from src.infrastructure.readers import SqlAlchemyMetricAggregateReader, records_reader_type
+
+# decayed scores below this are forgotten, a window read once is dropped after a little over three half lives
+MIN_SCORE = 0.1
+
+# share of PREFETCH_MAX_TRACKED kept when a new window goes over it, so the windows that follow
+# are tracked without another pass over every count
+PRUNE_LOW_WATER = 0.9
+
+# a window with the read path it was asked for, none for the configured one, as each path has its own cache
+MetricWindow = tuple[str, date, date, int, Optional[bool]]
+
+
+@dataclasses.dataclass(slots=True)
+class DecayingCount:
+    score: float
+    updated_at: float
+
+
+class DecayingAccessTracker:
+    """
+    access counts that halve every PREFETCH_HALF_LIFE_SECONDS, decayed lazily when a
+    window is read or ranked, so metrics nobody opens any more age out on their own
+    """
+    __slots__ = "half_life_seconds", "max_tracked", "clock", "counts"
+
+    def __init__(self, settings: Settings):
+        self.half_life_seconds = settings.PREFETCH_HALF_LIFE_SECONDS
+        self.max_tracked = settings.PREFETCH_MAX_TRACKED
+        self.clock = time.monotonic
+        self.counts: dict[MetricWindow, DecayingCount] = {}
+
+    def record(self, _id: str, start_date: date, end_date: date, day_range: int, batched: Optional[bool] = None) -> None:
+        window = (_id, start_date, end_date, day_range, batched)
+        now = self.clock()
+        count = self.counts.get(window)
+        if count is None:
+            self.counts[window] = DecayingCount(score=1.0, updated_at=now)
+            if len(self.counts) > self.max_tracked:
+                self.prune(int(self.max_tracked * PRUNE_LOW_WATER))
+            return
+        count.score = self._decayed(count, now) + 1
+        count.updated_at = now
+
+    def hottest(self, count: int) -> list[MetricWindow]:
+        now = self.clock()
+        return heapq.nlargest(count, self.counts, key=lambda window: self._decayed(self.counts[window], now))
+
+    def score(self, window: MetricWindow) -> float:
+        count = self.counts.get(window)
+        return 0.0 if count is None else self._decayed(count, self.clock())
+
+    def prune(self, max_tracked: Optional[int] = None) -> None:
+        """
+        forgets cold windows, then the coldest ones while over max_tracked
+        :param max_tracked: defaults to PREFETCH_MAX_TRACKED
+        """
+        max_tracked = self.max_tracked if max_tracked is None else max_tracked
+        now = self.clock()
+        scores = {window: self._decayed(count, now) for window, count in self.counts.items()}
+        keep = [window for window, score in scores.items() if score >= MIN_SCORE]
+        if len(keep) > max_tracked:
+            keep = heapq.nlargest(max_tracked, keep, key=scores.__getitem__)
+        self.counts = {window: self.counts[window] for window in keep}
+
+    def _decayed(self, count: DecayingCount, now: float) -> float:
+        return count.score * 0.5 ** ((now - count.updated_at) / self.half_life_seconds)
+
+
+class HotMetricPrefetcher:
+    """
+    every PREFETCH_INTERVAL_SECONDS refreshes the PREFETCH_TOP_K most read windows whose
+    cache entries would go stale before the next run, so busy dashboards never see a miss
+    """
+    __slots__ = "settings", "logger", "pool", "tracker", "task"
+
+    def __init__(self,
+        settings: Settings,
+        logger: Logger,
+        pool: SqlAlchemyConnectionPool,
+        tracker: MetricAccessTracker
+    ):
+        self.settings = settings
+        self.logger = logger
+        self.pool = pool
+        self.tracker = tracker
+        self.task = None
+
+    async def start(self):
+        if not self.settings.PREFETCH_ENABLED:
+            return
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def prefetch(self) -> int:
+        """
+        :return: how many record windows were refreshed
+        """
+        self.tracker.prune()
+        semaphore = asyncio.Semaphore(self.settings.CACHE_MAX_CONCURRENT_REFRESHES)
+        results = await asyncio.gather(*(
+            self._refresh(window, semaphore) for window in self.tracker.hottest(self.settings.PREFETCH_TOP_K)
+        ))
+        return sum(results)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.settings.PREFETCH_INTERVAL_SECONDS)
+            refreshed = await self.prefetch()
+            self.logger.info("Hot metrics prefetched", refreshed=refreshed)
+
+    def _due(self, seconds_until_stale: Optional[float]) -> bool:
+        return seconds_until_stale is None or seconds_until_stale <= self.settings.PREFETCH_INTERVAL_SECONDS
+
+    async def _refresh(self, window: MetricWindow, semaphore: asyncio.Semaphore) -> bool:
+        _id, start_date, end_date, day_range, batched = window
+        read_aggregate = SqlAlchemyMetricAggregateReader.__call__
+        reader_type = records_reader_type(self.settings, batched)
+        read_records = reader_type.__call__
+        try:
+            async with semaphore, self.pool.session_factory() as session:
+                aggregate_reader = build_repository(SqlAlchemyMetricAggregateReader, session, self.logger)
+                if self._due(read_aggregate.seconds_until_stale(_id=_id)):
+                    aggregate = await read_aggregate.refresh(aggregate_reader, _id=_id)
+                else:
+                    aggregate = await aggregate_reader(_id=_id)
+                if aggregate is None:
+                    return False
+
+                window_arguments = dict(
+                    query=aggregate.query,
+                    start_date=start_date,
+                    end_date=end_date,
+                    day_range=day_range
+                )
+                if not self._due(read_records.seconds_until_stale(**window_arguments)):
+                    return False
+                records_reader = build_repository(reader_type, session, self.logger)
+                await read_records.refresh(records_reader, **window_arguments)
+                return True
+        except Exception as e:
+            self.logger.warning("Prefetch failed", metric_configuration_id=_id, error=str(e))
+            return False
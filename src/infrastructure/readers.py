@@ -1,13 +1,22 @@
+import functools
+import hashlib
+import json
+import math
+import re
+from collections import Counter
 from datetime import date
-from typing import Optional
+from typing import Optional, Mapping, Any, NamedTuple, AsyncIterator
 
-from sqlalchemy import text, select
+from sqlalchemy import text, TextClause
+from sqlalchemy.dialects.postgresql.asyncpg import dialect as AsyncpgDialect
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
-from src.core import MetricConfigurationAggregate, MetricRecord
+from src.core import RecordSet, MetricConfigurationSnapshot, QuerySnapshot, LayoutSnapshot, RecordBatch, RecordKey, \
+    RecordDelta
 from src.crosscutting import auto_slots, Logger
-from src.infrastructure import async_ttl_cache
+from src.infrastructure import Settings
+from src.infrastructure.caching import async_ttl_cache, seconds_until_midnight, AGGREGATES_CACHE, RECORDS_CACHE, \
+    RECORD_BATCHES_CACHE, CACHE_REGISTRY, RECORD_SNAPSHOTS_CACHE, MISSING
 
 
 @auto_slots
@@ -22,6 +31,107 @@ class SqlAlchemyDbHealthReader:
         return row
 
 
+ASYNCPG_DIALECT = AsyncpgDialect()
+
+
+class PositionalStatement(NamedTuple):
+    sql: str # $n placeholders, for running on the asyncpg connection itself
+    parameters: tuple[str, ...] # bind names in $n order
+
+
+@functools.lru_cache(maxsize=1024)
+def positional_statement(source: str) -> PositionalStatement:
+    """
+    a stored query with its binds numbered as asyncpg takes them, for readers that skip sqlalchemy,
+    keyed by the query text so an edited query compiles again
+    """
+    compiled = text(source).compile(dialect=ASYNCPG_DIALECT)
+    return PositionalStatement(compiled.string, tuple(compiled.positiontup))
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+@functools.lru_cache(maxsize=1024)
+def page_statement(
+    source: str,
+    columns: Optional[tuple[str, ...]],
+    nulls: Optional[tuple[bool, ...]] = None
+) -> TextClause:
+    """
+    wraps a stored query to read one page ordered by the whole row, nulls last, a page after the first
+    starts at the row bound to :page_after_n by comparing rows rather than offsetting, skipping the
+    :page_skip rows equal to it already read, so reading deep into a window costs the same as its first page
+
+    a row comparison is null when either side holds a null, so each column is compared on its own,
+    with the columns that are null in the bound row given as nulls
+    """
+    inner = source.strip().rstrip(";")
+    if columns is None:
+        return text(f"SELECT * FROM (\n{inner}\n) AS page ORDER BY page LIMIT :page_limit")
+    keys = [f"page.{quote_identifier(column)}" for column in columns]
+    from_bound = "true"
+    for i, key in reversed(list(enumerate(keys))):
+        if nulls is not None and nulls[i]:
+            # nothing sorts past a null
+            from_bound = f"{key} IS NULL AND {from_bound}"
+        else:
+            from_bound = (
+                f"({key} > :page_after_{i} OR {key} IS NULL OR ({key} = :page_after_{i} AND {from_bound}))"
+            )
+    return text(
+        f"SELECT * FROM (\n{inner}\n) AS page WHERE {from_bound} "
+        f"ORDER BY {', '.join(keys)} LIMIT :page_limit OFFSET :page_skip"
+    )
+
+
+def same_value(value: Any, other: Any) -> bool:
+    """
+    whether a record's value is the one a cursor carried, cursors handed out before a type had a tag carry it as a string
+    """
+    return value == other or (value is not None and other is not None and str(value) == str(other))
+
+
+def next_record_key(records: list[dict], after: Optional[RecordKey]) -> RecordKey:
+    """
+    the key past a full page, counting the records equal to its last one, with those on earlier
+    pages when every record on the page is equal to the last record of the page before
+    """
+    row = tuple(records[-1].items())
+    seen = 1
+    while seen < len(records) and records[-1 - seen] == records[-1]:
+        seen += 1
+    if seen == len(records) and after is not None and len(after.row) == len(row) and all(
+        column == other_column and same_value(value, other_value)
+        for (column, value), (other_column, other_value) in zip(row, after.row)
+    ):
+        seen += after.seen
+    return RecordKey(row=row, seen=seen)
+
+
+# the whole aggregate in one statement, layouts folded into a json array per configuration ordered by
+# breakpoint and position, so the version doesn't depend on how postgres happens to return them
+AGGREGATE_SNAPSHOT_SQL = """
+    SELECT
+        c.id,
+        c.query_id,
+        c.is_editable,
+        q.id AS stored_query_id,
+        q.query AS stored_query,
+        COALESCE(l.layouts, '[]') AS layouts
+    FROM metric_configurations c
+    LEFT JOIN queries q ON q.id = c.query_id
+    LEFT JOIN LATERAL (
+        SELECT json_agg(json_build_array(li.breakpoint, li.x, li.y, li.w, li.h, li.static) ORDER BY li.breakpoint, li.y, li.x, li.id) AS layouts
+        FROM layout_items li
+        WHERE li.item_id = c.id
+    ) l ON true
+"""
+AGGREGATE_SNAPSHOT = text(AGGREGATE_SNAPSHOT_SQL + " WHERE c.id = :id")
+ALL_AGGREGATE_SNAPSHOTS = text(AGGREGATE_SNAPSHOT_SQL)
+
+
 @auto_slots
 class SqlAlchemyMetricAggregateReader:
 
@@ -29,29 +139,351 @@ class SqlAlchemyMetricAggregateReader:
         self.logger = logger
         self.session = session
 
-    @async_ttl_cache(ttl_seconds=300)
-    async def __call__(self, _id: str) -> Optional[MetricConfigurationAggregate]:
-        result = await self.session.execute(
-            select(MetricConfigurationAggregate).where(MetricConfigurationAggregate.id == _id).options(
-                selectinload(MetricConfigurationAggregate.layouts),
-                selectinload(MetricConfigurationAggregate.query),
-            )
-        )
+    @async_ttl_cache(namespace=AGGREGATES_CACHE, ttl_seconds=300, tag=lambda _id: _id)
+    async def __call__(self, _id: str) -> Optional[MetricConfigurationSnapshot]:
+        result = await self.session.execute(AGGREGATE_SNAPSHOT, {"id": _id})
         self.logger.info(f"Retrieving metric configurations for from db", metric_configuration_id=_id)
-        return result.scalar_one_or_none()
+        row = result.mappings().one_or_none()
+        return None if row is None else to_snapshot(row)
+
+
+@auto_slots
+class SqlAlchemyMetricAggregatesReader:
+
+    def __init__(self, session: AsyncSession, logger: Logger):
+        self.logger = logger
+        self.session = session
+
+    async def __call__(self) -> list[MetricConfigurationSnapshot]:
+        """
+        every configuration with its query and layouts, in a single statement
+        """
+        result = await self.session.execute(ALL_AGGREGATE_SNAPSHOTS)
+        rows = result.mappings().all()
+        self.logger.info("Retrieving all metric configurations from db", count=len(rows))
+        return [to_snapshot(row) for row in rows]
+
+
+QUERY_IDS = text("SELECT id, query_id FROM metric_configurations WHERE id = ANY(:ids)")
+
+
+@auto_slots
+class SqlAlchemyMetricQueryIdsReader:
+
+    def __init__(self, session: AsyncSession, logger: Logger):
+        self.logger = logger
+        self.session = session
+
+    async def __call__(self, ids: list[str]) -> dict[str, Optional[str]]:
+        """
+        not cached, a batch names each configuration once however many records it holds
+        """
+        result = await self.session.execute(QUERY_IDS, {"ids": ids})
+        query_ids = dict(result.tuples().all())
+        self.logger.info("Retrieving query ids from db", requested=len(ids), found=len(query_ids))
+        return query_ids
+
+
+def fingerprint(value) -> str:
+    """
+    short digest of a value's repr, computed once when it is loaded rather than per request
+    """
+    return hashlib.blake2b(repr(value).encode(), digest_size=8).hexdigest()
+
+
+def to_snapshot(row: Mapping[str, Any]) -> MetricConfigurationSnapshot:
+    """
+    decodes an AGGREGATE_SNAPSHOT_SQL row straight into plain values, no orm instances involved
+    """
+    query = None if row["stored_query_id"] is None else QuerySnapshot(id=row["stored_query_id"], query=row["stored_query"])
+    layouts = row["layouts"]
+    if isinstance(layouts, str):
+        layouts = json.loads(layouts)
+    layouts = tuple(LayoutSnapshot(*layout) for layout in layouts)
+    return MetricConfigurationSnapshot(
+        id=row["id"],
+        query_id=row["query_id"],
+        is_editable=row["is_editable"],
+        query=query,
+        layouts=layouts,
+        version=fingerprint((row["id"], row["is_editable"], query, layouts))
+    )
+
+
+def records_key(
+    query: QuerySnapshot,
+    start_date: date,
+    end_date: date,
+    day_range: int,
+    limit: Optional[int] = None,
+    after: Optional[RecordKey] = None
+) -> tuple:
+    """
+    a whole window and each page of it are cached as entries of their own
+    """
+    if limit is None:
+        return query.id, start_date, end_date, day_range
+    return query.id, start_date, end_date, day_range, limit, after
+
+
+# postgres' current date and time functions and the special date inputs that read the clock
+CLOCK_FUNCTIONS = re.compile(
+    r"\b(current_date|current_time|current_timestamp|localtime|localtimestamp|now|transaction_timestamp|"
+    r"statement_timestamp|clock_timestamp|timeofday)\b|'(today|tomorrow|yesterday|now)'",
+    re.IGNORECASE
+)
+
+
+def is_relative_to_today(query: QuerySnapshot) -> bool:
+    return CLOCK_FUNCTIONS.search(query.query) is not None
+
+
+def records_max_age(query: QuerySnapshot, **_) -> float:
+    """
+    windows relative to the current date move at midnight, so entries for them can't outlive the day,
+    ttls still bound how long a window over the time of day is served
+    """
+    if is_relative_to_today(query):
+        return seconds_until_midnight()
+    return math.inf
+
+
+# the newest row ingested for a query, an index only scan on ix_metrics_id_ingest_seq
+INGEST_WATERMARK = text("SELECT COALESCE(MAX(ingest_seq), 0) FROM metrics WHERE id = :query_id")
+RECORDS_WATERMARK = text("SELECT COALESCE(MAX(ingest_seq), 0), CURRENT_DATE FROM metrics WHERE id = :query_id")
+
+
+async def records_watermark(session: AsyncSession, query: QuerySnapshot) -> tuple:
+    """
+    read ahead of the records, metrics rows are only ever inserted so a window can't change without the
+    newest ingest_seq of its query or, for a window relative to the current date, the date moving past it
+    """
+    watermark, today = (await session.execute(RECORDS_WATERMARK, {"query_id": query.id})).one()
+    return (watermark, today) if is_relative_to_today(query) else (watermark,)
+
+
+def records_version(watermark: tuple, count: int) -> str:
+    """
+    versions records by the watermark they were read at and how many there are rather than by their values
+    """
+    return "-".join(map(str, (*watermark, count)))
+
 
 @auto_slots
 class SqlAlchemyMetricRecordsReader:
 
-    def __init__(self, session: AsyncSession):
+    def __init__(self, session: AsyncSession, logger: Logger):
+        self.logger = logger
         self.session = session
 
-    async def __call__(self, query: str, start_date: date, end_date: date, day_range: int) -> list[dict]:
+    @async_ttl_cache(
+        namespace=RECORDS_CACHE,
+        ttl_seconds=300,
+        max_age=records_max_age,
+        key=records_key,
+        tag=lambda query, **_: query.id
+    )
+    async def __call__(
+        self,
+        query: QuerySnapshot,
+        start_date: date,
+        end_date: date,
+        day_range: int,
+        limit: Optional[int] = None,
+        after: Optional[RecordKey] = None
+    ) -> RecordSet:
+        """
+        :param limit: read a page of at most this many records instead of the whole window
+        :param after: the key of the last record on the previous page
+        """
         params = {
             "start_date": start_date,
             "end_date": end_date,
             "day_range": day_range,
         }
-        result = await self.session.execute(text(query), params)
+        if limit is None:
+            statement = text(query.query)
+        else:
+            if after is None:
+                statement = page_statement(query.query, None)
+            else:
+                statement = page_statement(
+                    query.query,
+                    tuple(column for column, _ in after.row),
+                    tuple(value is None for _, value in after.row)
+                )
+                params.update({f"page_after_{i}": value for i, (_, value) in enumerate(after.row) if value is not None})
+                params["page_skip"] = after.seen
+            params["page_limit"] = limit + 1 # one more than asked for tells whether another page follows
+        watermark = await records_watermark(self.session, query)
+        result = await self.session.execute(statement, params)
         rows = result.mappings().all()
-        return [dict(row) for row in rows]
\ No newline at end of file
+        records = [dict(row) for row in rows]
+        next_after = None
+        if limit is not None and len(records) > limit:
+            records = records[:limit]
+            next_after = next_record_key(records, after)
+        return RecordSet(records=records, version=records_version(watermark, len(records)), next_after=next_after)
+
+
+class RecordSnapshot(NamedTuple):
+    """
+    a window as it was at a watermark, each distinct row with how many times it was returned,
+    so two snapshots diff by subtracting and a row is one entry whatever its width
+    """
+    columns: tuple[str, ...]
+    rows: Counter
+
+    def records(self, rows: Counter) -> list[dict]:
+        return [dict(zip(self.columns, row)) for row in rows.elements()]
+
+
+EMPTY_SNAPSHOT = RecordSnapshot(columns=(), rows=Counter())
+
+
+@auto_slots
+class SqlAlchemyMetricRecordsDeltaReader:
+    """
+    compares ingest_seq on metrics rows, which SqlAlchemyMetricRecordWriter has commit in order, so a
+    poll with nothing new is one index probe and the stored query is not run
+
+    otherwise the window is read along with the watermark under one snapshot and diffed with the window
+    as it was at since, kept in its own cache namespace and shared by every poller at that watermark,
+    0 is the empty window, a watermark no longer cached sends every record with removed as none, as
+    does a window with values that can't be hashed, which isn't cached
+
+    snapshots of a window relative to the current date expire at midnight in the session TimeZone, a poll
+    past it whose snapshot at since is gone reads the window again even though nothing was written
+
+    assumes a stored query reads the metrics rows whose id is its own, as cache invalidation does
+    """
+
+    def __init__(self, session: AsyncSession, logger: Logger):
+        self.logger = logger
+        self.session = session
+
+    async def __call__(self, query: QuerySnapshot, start_date: date, end_date: date, day_range: int, since: int) -> RecordDelta:
+        # the watermark and the window it describes have to come from the same snapshot
+        await self.session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        watermark = (await self.session.execute(INGEST_WATERMARK, {"query_id": query.id})).scalar_one()
+        max_age = records_max_age(query)
+        snapshots = CACHE_REGISTRY[RECORD_SNAPSHOTS_CACHE]
+        window = (query, start_date, end_date, day_range)
+        previous = EMPTY_SNAPSHOT if since == 0 else None
+        if watermark <= since:
+            # a window relative to the current date moves at midnight with no write, as its snapshot at since expires
+            if math.isinf(max_age) or (previous := snapshots.get((*window, since))) is not MISSING:
+                return RecordDelta(records=[], removed=[], watermark=since)
+
+        current = snapshots.get((*window, watermark))
+        if current is MISSING:
+            params = {
+                "start_date": start_date,
+                "end_date": end_date,
+                "day_range": day_range,
+            }
+            result = await self.session.execute(text(query.query), params)
+            columns, rows = tuple(result.keys()), [tuple(row) for row in result]
+            try:
+                current = RecordSnapshot(columns=columns, rows=Counter(rows))
+            except TypeError:
+                self.logger.info("Records can't be compared", cache=RECORD_SNAPSHOTS_CACHE, watermark=watermark)
+                return RecordDelta(records=[dict(zip(columns, row)) for row in rows], removed=None, watermark=watermark)
+            snapshots.set((*window, watermark), current, max_age_seconds=max_age)
+
+        if previous is None:
+            previous = snapshots.get((*window, since))
+        if previous is MISSING:
+            self.logger.info("Records at watermark unknown", cache=RECORD_SNAPSHOTS_CACHE, watermark=since)
+            return RecordDelta(records=current.records(current.rows), removed=None, watermark=watermark)
+        # a changed record is one removed and one added
+        return RecordDelta(
+            records=current.records(current.rows - previous.rows),
+            removed=current.records(previous.rows - current.rows),
+            watermark=watermark
+        )
+
+
+# rows fetched per round trip when streaming, which bounds what a stream holds in memory
+STREAM_BATCH_SIZE = 1000
+
+
+@auto_slots
+class SqlAlchemyMetricRecordsStreamer:
+    """
+    runs a stored query on a server side cursor and yields its records a batch at a time,
+    so a wide window never sits in memory whole, results are not cached
+    """
+
+    def __init__(self, session: AsyncSession, logger: Logger):
+        self.logger = logger
+        self.session = session
+
+    async def __call__(
+        self,
+        query: QuerySnapshot,
+        start_date: date,
+        end_date: date,
+        day_range: int,
+        batch_size: int = STREAM_BATCH_SIZE
+    ) -> AsyncIterator[list[dict]]:
+        params = {
+            "start_date": start_date,
+            "end_date": end_date,
+            "day_range": day_range,
+        }
+        result = await self.session.stream(
+            text(query.query),
+            params,
+            execution_options={"yield_per": batch_size}
+        )
+        try:
+            async for rows in result.mappings().partitions(batch_size):
+                yield [dict(row) for row in rows]
+        finally:
+            await result.close()
+
+
+@auto_slots
+class AsyncpgMetricRecordBatchReader:
+    """
+    runs stored queries on the session's asyncpg connection and keeps the rows column by column,
+    skipping sqlalchemy result rows, row mappings and per row dicts
+    """
+
+    def __init__(self, session: AsyncSession, logger: Logger):
+        self.logger = logger
+        self.session = session
+
+    @async_ttl_cache(
+        namespace=RECORD_BATCHES_CACHE,
+        ttl_seconds=300,
+        max_age=records_max_age,
+        key=lambda query, start_date, end_date, day_range: (query.id, start_date, end_date, day_range),
+        tag=lambda query, **_: query.id
+    )
+    async def __call__(self, query: QuerySnapshot, start_date: date, end_date: date, day_range: int) -> RecordBatch:
+        params = {
+            "start_date": start_date,
+            "end_date": end_date,
+            "day_range": day_range,
+        }
+        compiled = positional_statement(query.query)
+        watermark = await records_watermark(self.session, query)
+        connection = await (await self.session.connection()).get_raw_connection()
+        rows = await connection.driver_connection.fetch(compiled.sql, *(params[name] for name in compiled.parameters))
+        columns = tuple(rows[0].keys()) if rows else ()
+        values = tuple(zip(*rows))
+        return RecordBatch(columns=columns, values=values, version=records_version(watermark, len(rows)))
+
+
+def records_reader_type(
+    settings: Settings,
+    batched: Optional[bool] = None
+) -> type[SqlAlchemyMetricRecordsReader | AsyncpgMetricRecordBatchReader]:
+    """
+    the reader whose cache serves metrics requests, for warming and prefetching the right one
+    :param batched: the read path a request asked for, none for the configured one
+    """
+    batched = settings.RECORDS_BATCH_READER_ENABLED if batched is None else batched
+    return AsyncpgMetricRecordBatchReader if batched else SqlAlchemyMetricRecordsReader
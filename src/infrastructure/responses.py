@@ -0,0 +1,52 @@
+from typing import Optional, Hashable
+
+from src.core import EncodedResponse, QuerySnapshot
+from src.crosscutting import Logger
+from src.infrastructure.caching import CACHE_REGISTRY, RESPONSES_CACHE, STALE_READ
+from src.infrastructure.readers import records_max_age
+
+
+class LruEncodedResponseCache:
+    """
+    encoded response bodies in their own cache namespace, tagged with the query id so a record
+    write drops them with the records they were encoded from
+
+    stale entries are not served, the next request encodes the response again from the
+    reader caches, which refresh in the background as usual
+
+    a body encoded from a stale reader entry isn't stored, it would be served fresh for a whole
+    ttl while the records behind it are only good until their hard ttl
+    """
+    __slots__ = "logger",
+
+    def __init__(self, logger: Logger):
+        self.logger = logger
+
+    def generation(self) -> int:
+        # read before the metrics, so it also starts watching the reads for stale entries
+        STALE_READ.set(False)
+        return CACHE_REGISTRY[RESPONSES_CACHE].generation
+
+    def get(self, key: Hashable) -> Optional[EncodedResponse]:
+        cache = CACHE_REGISTRY[RESPONSES_CACHE]
+        entry = cache.lookup(key)
+        if entry is None or cache.is_stale(entry):
+            self.logger.info("Cache miss", cache=RESPONSES_CACHE, cache_id=key)
+            return None
+        self.logger.info("Cache hit", cache=RESPONSES_CACHE, cache_id=key)
+        return entry.value
+
+    def put(self, key: Hashable, response: EncodedResponse, query: QuerySnapshot, generation: int) -> None:
+        """
+        :param generation: generation read before the metrics were, a body that raced an invalidation is dropped
+        """
+        if STALE_READ.get():
+            self.logger.info("Response not cached, read was stale", cache=RESPONSES_CACHE, cache_id=key)
+            return
+        CACHE_REGISTRY[RESPONSES_CACHE].set(
+            key,
+            response,
+            max_age_seconds=records_max_age(query),
+            tag=query.id,
+            generation=generation
+        )
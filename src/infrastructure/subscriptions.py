@@ -0,0 +1,217 @@
+import asyncio
+import math
+from collections import Counter
+from datetime import date
+from typing import Callable, Optional
+
+from src.core import MetricConfigurationSnapshot, MetricsDelta, RecordDelta
+from src.crosscutting import Logger
+from src.infrastructure import Settings, SqlAlchemyConnectionPool, build_repository
+from src.infrastructure.readers import SqlAlchemyMetricRecordsDeltaReader, records_max_age
+
+TopicKey = tuple[str, date, date, int, Callable[[MetricsDelta], bytes]]
+
+
+def applied(records: list[dict], delta: RecordDelta) -> list[dict]:
+    """
+    the records a subscriber holds once it has applied the delta
+    """
+    if delta.removed is None:
+        return delta.records
+    if not delta.records and not delta.removed:
+        return records
+    # a delta only lists removed rows when the reader could count them, so rows here can be hashed
+    rows = Counter(tuple(record.items()) for record in records)
+    rows.subtract(tuple(record.items()) for record in delta.removed)
+    rows.update(tuple(record.items()) for record in delta.records)
+    return [dict(row) for row in (+rows).elements()]
+
+
+class Subscription:
+    """
+    a subscriber's messages, bounded by SUBSCRIPTION_QUEUE_SIZE, one that falls that far behind has its
+    queue replaced by the window in full, so it catches up with a single message and the hub never waits on it
+    """
+    __slots__ = "topic", "queue", "needs_window"
+
+    def __init__(self, topic: "Topic", size: int):
+        self.topic = topic
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=size)
+        self.needs_window = True
+
+    def __aiter__(self) -> "Subscription":
+        return self
+
+    async def __anext__(self) -> bytes:
+        return await self.queue.get()
+
+    def offer(self, message: bytes, window: Callable[[], bytes]):
+        if self.needs_window or self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            message = window()
+            self.needs_window = False
+        self.queue.put_nowait(message)
+
+    def close(self):
+        self.topic.leave(self)
+
+
+class Topic:
+    """
+    one window of a configuration with everyone subscribed to it, a pump task reads each change once
+    and offers the same encoded message to every subscription, changes that arrive while it reads are
+    picked up together by the next read
+
+    the records subscribers hold are kept here, so a new or lagging subscriber is sent the window as it
+    was at the watermark every other subscriber is at, without reading it again
+
+    a window relative to the current date is also read at midnight, when it moves without a write
+    """
+    __slots__ = "hub", "key", "configuration", "encode", "subscriptions", "records", "watermark", "loop", \
+        "wake", "task"
+
+    def __init__(self, hub: "InProcessMetricUpdates", key: TopicKey, configuration: MetricConfigurationSnapshot):
+        self.hub = hub
+        self.key = key
+        self.configuration = configuration
+        self.encode = key[-1]
+        self.subscriptions: set[Subscription] = set()
+        self.records: list[dict] = []
+        self.watermark = 0
+        # changes can be reported from another loop or thread, they wake the pump on its own
+        self.loop = asyncio.get_running_loop()
+        self.wake = asyncio.Event()
+        self.task = self.loop.create_task(self.pump())
+
+    def changed(self):
+        self.loop.call_soon_threadsafe(self.wake.set)
+
+    def join(self, size: int) -> Subscription:
+        subscription = Subscription(self, size)
+        self.subscriptions.add(subscription)
+        self.wake.set()
+        return subscription
+
+    def leave(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+        if not self.subscriptions:
+            self.task.cancel()
+            self.hub.remove(self)
+
+    async def pump(self):
+        while True:
+            await self.next_change()
+            self.wake.clear()
+            try:
+                delta = await self.hub.read(self.configuration, *self.key[1:4], since=self.watermark)
+            except Exception as e:
+                self.hub.logger.warning("Subscription read failed", metric_configuration_id=self.key[0], error=str(e))
+                await asyncio.sleep(self.hub.settings.SUBSCRIPTION_RETRY_SECONDS)
+                self.wake.set()
+                continue
+            self.publish(delta)
+
+    async def next_change(self):
+        max_age = records_max_age(self.configuration.query)
+        if math.isinf(max_age):
+            await self.wake.wait()
+            return
+        try:
+            await asyncio.wait_for(self.wake.wait(), timeout=max_age)
+        except asyncio.TimeoutError:
+            pass
+
+    def publish(self, delta: RecordDelta):
+        changed = delta.removed is None or delta.records or delta.removed
+        self.records = applied(self.records, delta)
+        self.watermark = delta.watermark
+        message = self.encode(MetricsDelta(self.configuration, delta)) if changed else None
+        window: Optional[bytes] = None
+
+        def whole_window() -> bytes:
+            nonlocal window
+            if window is None:
+                full = RecordDelta(records=self.records, removed=None, watermark=self.watermark)
+                window = self.encode(MetricsDelta(self.configuration, full))
+            return window
+
+        for subscription in self.subscriptions:
+            if message is not None or subscription.needs_window:
+                subscription.offer(message, whole_window)
+
+
+class InProcessMetricUpdates:
+    """
+    fans record changes out to subscribers in this process, one topic per subscribed window
+
+    record writes here report their query id once committed, writes on other instances arrive through
+    the cache invalidation listener, subscribers on other instances are theirs to serve
+    """
+    __slots__ = "settings", "logger", "pool", "topics", "by_query"
+
+    def __init__(self, settings: Settings, logger: Logger, pool: SqlAlchemyConnectionPool):
+        self.settings = settings
+        self.logger = logger
+        self.pool = pool
+        self.topics: dict[TopicKey, Topic] = {}
+        self.by_query: dict[str, set[Topic]] = {}
+
+    async def start(self):
+        ...
+
+    async def stop(self):
+        topics = list(self.topics.values())
+        for topic in topics:
+            topic.task.cancel()
+        await asyncio.gather(*(topic.task for topic in topics), return_exceptions=True)
+
+    def changed(self, query_id: str) -> None:
+        for topic in tuple(self.by_query.get(query_id, ())):
+            topic.changed()
+
+    def resync(self) -> None:
+        for topic in tuple(self.topics.values()):
+            topic.changed()
+
+    def subscribe(
+        self,
+        configuration: MetricConfigurationSnapshot,
+        start_date: date,
+        end_date: date,
+        day_range: int,
+        encode: Callable[[MetricsDelta], bytes]
+    ) -> Subscription:
+        key = (configuration.id, start_date, end_date, day_range, encode)
+        topic = self.topics.get(key)
+        if topic is None:
+            topic = self.topics[key] = Topic(self, key, configuration)
+            self.by_query.setdefault(configuration.query_id, set()).add(topic)
+        return topic.join(self.settings.SUBSCRIPTION_QUEUE_SIZE)
+
+    def remove(self, topic: Topic):
+        if self.topics.get(topic.key) is topic:
+            del self.topics[topic.key]
+        topics = self.by_query.get(topic.configuration.query_id)
+        if topics is not None:
+            topics.discard(topic)
+            if not topics:
+                del self.by_query[topic.configuration.query_id]
+
+    async def read(
+        self,
+        configuration: MetricConfigurationSnapshot,
+        start_date: date,
+        end_date: date,
+        day_range: int,
+        since: int
+    ) -> RecordDelta:
+        async with self.pool.session_factory() as session:
+            reader = build_repository(SqlAlchemyMetricRecordsDeltaReader, session, self.logger)
+            return await reader(
+                query=configuration.query,
+                start_date=start_date,
+                end_date=end_date,
+                day_range=day_range,
+                since=since
+            )
@@ -0,0 +1,70 @@
+import asyncio
+
+from src.core import MetricConfigurationAggregate, DEFAULT_START_DATE, DEFAULT_END_DATE, DEFAULT_DAY_RANGE
+from src.crosscutting import Logger
+from src.infrastructure import Settings, SqlAlchemyConnectionPool, build_repository
+from src.infrastructure.readers import SqlAlchemyMetricAggregatesReader, SqlAlchemyMetricAggregateReader, \
+    records_reader_type
+
+
+class CacheWarmer:
+    """
+    fills the caches before the app starts taking requests, so a fresh instance doesn't
+    send its first wave of requests straight to postgres
+
+    every configuration is loaded in one query, then each stored query is run for the
+    default window, at most CACHE_WARM_UP_CONCURRENCY at a time and within the time budget
+    """
+    __slots__ = "settings", "logger", "pool"
+
+    def __init__(self, settings: Settings, logger: Logger, pool: SqlAlchemyConnectionPool):
+        self.settings = settings
+        self.logger = logger
+        self.pool = pool
+
+    async def start(self):
+        if not self.settings.CACHE_WARM_UP_ENABLED:
+            return
+
+        warmed = []
+        try:
+            async with asyncio.timeout(self.settings.CACHE_WARM_UP_BUDGET_SECONDS):
+                await self._warm(warmed)
+        except TimeoutError:
+            self.logger.warning(
+                "Cache warm up ran out of time",
+                budget_seconds=self.settings.CACHE_WARM_UP_BUDGET_SECONDS,
+                queries_warmed=len(warmed)
+            )
+            return
+        self.logger.info("Cache warmed", queries_warmed=len(warmed))
+
+    async def stop(self):
+        pass
+
+    async def _warm(self, warmed: list[str]):
+        async with self.pool.session_factory() as session:
+            aggregates = await build_repository(SqlAlchemyMetricAggregatesReader, session, self.logger)()
+
+        for aggregate in aggregates:
+            SqlAlchemyMetricAggregateReader.__call__.prime(aggregate, _id=aggregate.id)
+
+        semaphore = asyncio.Semaphore(self.settings.CACHE_WARM_UP_CONCURRENCY)
+        reader_type = records_reader_type(self.settings)
+
+        async def run_query(aggregate: MetricConfigurationAggregate):
+            async with semaphore, self.pool.session_factory() as session:
+                reader = build_repository(reader_type, session, self.logger)
+                try:
+                    await reader(
+                        query=aggregate.query,
+                        start_date=DEFAULT_START_DATE,
+                        end_date=DEFAULT_END_DATE,
+                        day_range=DEFAULT_DAY_RANGE
+                    )
+                except Exception as e:
+                    self.logger.warning("Cache warm up query failed", query_id=aggregate.query_id, error=str(e))
+                    return
+            warmed.append(aggregate.query_id)
+
+        await asyncio.gather(*(run_query(aggregate) for aggregate in aggregates if aggregate.query is not None))
@@ -1,8 +1,20 @@
-from sqlalchemy import exists, select, func
+import json
+from typing import Optional
+
+from sqlalchemy import exists, select, func, text
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.core import MetricConfiguration, MetricConfigurationAggregate, MetricRecord
+from src.core import MetricConfiguration, MetricConfigurationAggregate, MetricRecord, MetricRecordRow
 from src.crosscutting import auto_slots, Logger, logging_scope
+from src.infrastructure.caching import INVALIDATION_CHANNEL
+
+# held until commit, keyed by query id
+INGEST_LOCK = text("SELECT pg_advisory_xact_lock(hashtext(:query_id))")
+# the same locks for every query of a batch, taken in one order so two batches can't deadlock
+INGEST_LOCKS = text("""
+    SELECT pg_advisory_xact_lock(key)
+    FROM (SELECT DISTINCT hashtext(query_id) AS key FROM unnest(CAST(:query_ids AS text[])) AS query_id ORDER BY key) AS keys
+""")
 
 
 @auto_slots
@@ -46,4 +58,42 @@ class SqlAlchemyMetricRecordWriter:
         self.session = session
 
     async def __call__(self, record: MetricRecord):
-        self.session.add(record)
\ No newline at end of file
+        """
+        records of one query are written one transaction at a time, so their ingest_seq, drawn on insert,
+        commits in order and a delta read never sees a number after one still to commit
+        """
+        await self.session.execute(INGEST_LOCK, {"query_id": record.id})
+        self.session.add(record)
+
+
+@auto_slots
+class AsyncpgMetricRecordsBulkWriter:
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def __call__(self, records: list[MetricRecordRow]):
+        """
+        the batch is sent with COPY on the session's asyncpg connection, after taking the ingest lock of each
+        of its queries as a single record write would, ingest_seq is left to its default
+        """
+        await self.session.execute(INGEST_LOCKS, {"query_ids": list({record.id for record in records})})
+        connection = (await (await self.session.connection()).get_raw_connection()).driver_connection
+        await connection.copy_records_to_table("metrics", columns=MetricRecordRow._fields, records=records)
+
+
+@auto_slots
+class SqlAlchemyCacheInvalidationPublisher:
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def __call__(self, config_id: Optional[str] = None, query_id: Optional[str] = None):
+        """
+        postgres holds the notification until the transaction commits and drops it on rollback
+        """
+        payload = json.dumps({"config_id": config_id, "query_id": query_id})
+        await self.session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": INVALIDATION_CHANNEL, "payload": payload}
+        )
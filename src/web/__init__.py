@@ -1,12 +1,14 @@
 from contextlib import asynccontextmanager
 from typing import Protocol, Any, Coroutine, Callable
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketException
 from fastapi.params import Depends
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from starlette.requests import Request
+from starlette.requests import HTTPConnection
+from starlette.status import WS_1008_POLICY_VIOLATION
 
 from src.application.services import DataSeedService
+from src.core import HostedService
 from src.crosscutting import Logger, ServiceProvider
 
 
@@ -19,10 +21,15 @@ async def lifespan(app: FastAPI):
     provider[Logger].info("Starting service")
     seed_service = provider[DataSeedService]
     await seed_service()
+    hosted_services = provider.all(HostedService)
+    for hosted_service in hosted_services:
+        await hosted_service.start()
 
     yield
 
     provider[Logger].info("Shutting down service")
+    for hosted_service in reversed(hosted_services):
+        await hosted_service.stop()
 
 
 class Authenticator(Protocol):
@@ -30,8 +37,8 @@ class Authenticator(Protocol):
     async def __call__(self, credentials: HTTPAuthorizationCredentials) -> dict:
         ...
 
-def get_authenticator_from_services(request: Request) -> Authenticator:
-    authenticator = request.app.state.services[Authenticator]
+def get_authenticator_from_services(connection: HTTPConnection) -> Authenticator:
+    authenticator = connection.app.state.services[Authenticator]
     return authenticator
 
 async def auth_provider(
@@ -39,4 +46,20 @@ async def auth_provider(
     credentials: HTTPAuthorizationCredentials = Depends(security),
 ) -> dict:
     auth_call = authenticator(credentials)
-    return await auth_call
\ No newline at end of file
+    return await auth_call
+
+async def websocket_auth_provider(
+    websocket: WebSocket,
+    authenticator: Authenticator = Depends(get_authenticator_from_services),
+) -> dict:
+    """
+    HTTPBearer only reads requests, the handshake carries the same Authorization header
+    and is refused with a policy violation instead of a 401 or 403
+    """
+    scheme, _, token = websocket.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise WebSocketException(code=WS_1008_POLICY_VIOLATION, reason="Not authenticated")
+    try:
+        return await authenticator(HTTPAuthorizationCredentials(scheme=scheme, credentials=token))
+    except HTTPException as e:
+        raise WebSocketException(code=WS_1008_POLICY_VIOLATION, reason=e.detail)
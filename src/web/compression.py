@@ -0,0 +1,225 @@
+import zlib
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import brotli
+import zstandard
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+# preferred first when a client weighs several codings the same
+CONTENT_CODINGS = ("zstd", "br", "gzip")
+
+# parquet compresses its own pages, arrow ipc streams are left as plain columns
+COMPRESSIBLE_MEDIA_TYPES = ("application/json", "application/x-ndjson", "application/vnd.apache.arrow.stream", "text/")
+
+
+@dataclass(frozen=True, slots=True)
+class CompressionSettings:
+    """
+    :param minimum_size: bodies smaller than this are sent as they are, compressing them saves nothing
+    """
+    enabled: bool = True
+    minimum_size: int = 1024
+    gzip_level: int = 6
+    brotli_quality: int = 1
+    zstd_level: int = 1
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    the content coding to send from an Accept-Encoding header, none for identity
+    """
+    if not accept_encoding:
+        return None
+
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, parameters = part.partition(";")
+        weight = 1.0
+        name, _, value = parameters.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                weight = float(value)
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+
+    wildcard = weights.get("*", 0.0)
+    best, best_weight = None, 0.0
+    for coding in CONTENT_CODINGS:
+        weight = weights.get(coding, wildcard)
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def is_compressible(media_type: Optional[str]) -> bool:
+    return media_type is not None and media_type.startswith(COMPRESSIBLE_MEDIA_TYPES)
+
+
+class Compressor:
+    """
+    one response body compressed a chunk at a time, every chunk is flushed so a stream
+    is still sent as its batches are read
+    """
+    __slots__ = "compress", "flush", "finish"
+
+    def __init__(self, coding: str, settings: CompressionSettings):
+        if coding == "gzip":
+            compressor = zlib.compressobj(settings.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self.compress = compressor.compress
+            self.flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.finish = compressor.flush
+        elif coding == "br":
+            compressor = brotli.Compressor(quality=settings.brotli_quality)
+            self.compress = compressor.process
+            self.flush = compressor.flush
+            self.finish = compressor.finish
+        elif coding == "zstd":
+            compressor = zstandard.ZstdCompressor(level=settings.zstd_level).compressobj()
+            self.compress = compressor.compress
+            self.flush = lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+            self.finish = compressor.flush
+        else:
+            raise ValueError(f"Unsupported content coding {coding}")
+
+    def chunk(self, data: bytes) -> bytes:
+        return self.compress(data) + self.flush()
+
+    def last(self, data: bytes = b"") -> bytes:
+        return self.compress(data) + self.finish()
+
+
+def compress(body: bytes, coding: str, settings: CompressionSettings) -> bytes:
+    return Compressor(coding, settings).last(body)
+
+
+def content_coding(size: int, accept_encoding: Optional[str], settings: CompressionSettings) -> Optional[str]:
+    """
+    the coding to send a body of this size in, none when it is sent as it is
+    """
+    if not settings.enabled or size < settings.minimum_size:
+        return None
+    return negotiate(accept_encoding)
+
+
+def compressed_body(
+    body: bytes,
+    variants: dict[str, bytes],
+    coding: Optional[str],
+    settings: CompressionSettings
+) -> bytes:
+    """
+    the body in the given coding, compressed once per coding and kept in variants
+    """
+    if coding is None:
+        return body
+    compressed = variants.get(coding)
+    if compressed is None:
+        compressed = variants[coding] = compress(body, coding, settings)
+    return compressed
+
+
+def encoded_headers(headers: dict[str, str], coding: Optional[str]) -> dict[str, str]:
+    """
+    headers for a body in the given coding, its etag is weak as the bytes are no longer those it was made for
+    """
+    headers = dict(headers, Vary="Accept-Encoding")
+    if coding is None:
+        return headers
+    headers["Content-Encoding"] = coding
+    etag = headers.get("ETag")
+    if etag is not None and not etag.startswith("W/"):
+        headers["ETag"] = f"W/{etag}"
+    return headers
+
+
+class CompressionMiddleware:
+    """
+    compresses responses in the coding negotiated from Accept-Encoding, whole bodies once they reach
+    the minimum size and streamed bodies chunk by chunk, responses that already carry a
+    Content-Encoding are left alone
+    """
+    __slots__ = "app", "settings_factory", "settings"
+
+    def __init__(self, app: ASGIApp, settings_factory: Callable[[], CompressionSettings]):
+        """
+        :param settings_factory: resolved on the first request, once settings are registered
+        """
+        self.app = app
+        self.settings_factory = settings_factory
+        self.settings: Optional[CompressionSettings] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if self.settings is None:
+            self.settings = self.settings_factory()
+        coding = negotiate(Headers(scope=scope).get("accept-encoding")) if self.settings.enabled else None
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        await self.app(scope, receive, CompressingSender(send, coding, self.settings))
+
+
+class CompressingSender:
+    """
+    rewrites one response's messages, holding back its start until the first body shows
+    whether it is worth compressing
+    """
+    __slots__ = "send", "coding", "settings", "start", "compressor", "passthrough"
+
+    def __init__(self, send: Send, coding: str, settings: CompressionSettings):
+        self.send = send
+        self.coding = coding
+        self.settings = settings
+        self.start: Optional[Message] = None
+        self.compressor: Optional[Compressor] = None
+        self.passthrough = False
+
+    async def __call__(self, message: Message):
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            self.passthrough = "content-encoding" in headers or not is_compressible(headers.get("content-type"))
+            if self.passthrough:
+                await self.send(message)
+            else:
+                self.start = message
+            return
+
+        if self.passthrough or message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressor is None:
+            headers = MutableHeaders(raw=self.start["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            if not more_body and len(body) < self.settings.minimum_size:
+                self.passthrough = True
+                await self.send(self.start)
+                await self.send(message)
+                return
+
+            self.compressor = Compressor(self.coding, self.settings)
+            headers["Content-Encoding"] = self.coding
+            etag = headers.get("etag")
+            if etag is not None and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                body = self.compressor.last(body)
+                headers["Content-Length"] = str(len(body))
+                await self.send(self.start)
+                await self.send({"type": "http.response.body", "body": body})
+                return
+            await self.send(self.start)
+
+        body = self.compressor.chunk(body) if more_body else self.compressor.last(body)
+        await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
@@ -1,4 +1,5 @@
 from datetime import datetime
+from enum import Enum
 from typing import Optional, Union, Any
 from uuid import UUID
 
@@ -23,6 +24,30 @@ class MetricsResponse(BaseModel):
     is_editable: bool
     records: list[dict[str, Any]]
     layouts: list[LayoutItemContract]
+    next_cursor: Optional[str] = Field(None, description="cursor for the next page, when a limit was given and more records follow")
+
+class RecordsFormat(str, Enum):
+    rows = "rows"
+    columnar = "columnar"
+
+class ColumnarRecords(BaseModel):
+    columns: list[str]
+    data: dict[str, list[Any]]
+
+class ColumnarMetricsResponse(BaseModel):
+    id: str
+    is_editable: bool
+    records: ColumnarRecords
+    layouts: list[LayoutItemContract]
+    next_cursor: Optional[str] = Field(None, description="cursor for the next page, when a limit was given and more records follow")
+
+class MetricsDeltaResponse(BaseModel):
+    id: str
+    is_editable: bool
+    records: list[dict[str, Any]] = Field(description="records added or changed since the watermark, every record when removed is null")
+    removed: Optional[list[dict[str, Any]]] = Field(description="records gone since the watermark, null when the records should be replaced")
+    layouts: list[LayoutItemContract]
+    watermark: int = Field(description="since for the next poll")
 
 class CreateMetricConfigurationRequest(BaseModel):
     is_editable: bool
@@ -36,5 +61,17 @@ class CreateMetricRequest(BaseModel):
     alert_type: str = None
     alert_category: str = None
 
+class IngestMetricRecordRequest(CreateMetricRequest):
+    metric_configuration_id: UUID = Field(description="id of the metric configuration the record sits under")
+    date: Optional[datetime] = Field(None, description="when the reading was taken, when the request arrived if not given")
+
+class IngestErrorContract(BaseModel):
+    index: int = Field(description="position of the record among those sent, from 0, blank ndjson lines are not counted")
+    detail: Any
+
+class IngestedResponse(BaseModel):
+    created: int = Field(description="records written, all in one transaction")
+    errors: list[IngestErrorContract] = Field(description="records left out and why, the others are written regardless")
+
 class CreatedResponse(BaseModel):
     id: str
\ No newline at end of file
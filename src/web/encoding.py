@@ -0,0 +1,305 @@
+import asyncio
+import base64
+import binascii
+import datetime
+import json
+import uuid
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, Callable, AsyncIterator, Optional
+
+import orjson
+from pydantic_core import to_jsonable_python
+
+from src.core import RecordBatch, Metrics, RecordKey, MetricsDelta
+
+
+def encode_default(value: Any) -> Any:
+    """
+    what orjson can't encode itself, turned into what pydantic would have written
+    """
+    if isinstance(value, Decimal):
+        return str(value)
+    return to_jsonable_python(value)
+
+
+def dumps(value: Any) -> bytes:
+    """
+    trusted internal data as json, byte for byte what the response models would serialise
+    """
+    return orjson.dumps(value, default=encode_default, option=orjson.OPT_UTC_Z)
+
+
+def encode_json(value: Any) -> str:
+    return dumps(value).decode()
+
+
+def encode_float(value: float) -> str:
+    """
+    written as orjson writes it, 0.00001 and 1e16 rather than repr's 1e-05 and 1e+16, non finite values as null
+    """
+    return orjson.dumps(value).decode()
+
+
+def encode_bool(value: bool) -> str:
+    return "true" if value else "false"
+
+
+def encode_quoted(value: Any) -> str:
+    return f'"{value}"'
+
+
+def encode_date(value: datetime.date) -> str:
+    return f'"{value.isoformat()}"'
+
+
+# per type encoders for the common column types, matching pydantic's output, anything else goes through encode_json
+VALUE_ENCODERS: dict[type, Callable[[Any], str]] = {
+    int: str,
+    float: encode_float,
+    bool: encode_bool,
+    str: encode_json,
+    Decimal: encode_quoted,
+    datetime.date: encode_date,
+}
+
+
+def encode_column(values: tuple) -> list[str]:
+    """
+    json for every value in a column, one encoder picked for the whole column when its values share a type
+    """
+    types = set(map(type, values))
+    types.discard(type(None))
+    encoder = VALUE_ENCODERS.get(types.pop(), encode_json) if len(types) == 1 else encode_json
+    return ["null" if value is None else encoder(value) for value in values]
+
+
+def row_template(columns: tuple[str, ...]) -> str:
+    """
+    a %-format template for one row object, column names are encoded once per batch
+    """
+    return "{" + ",".join(encode_json(column).replace("%", "%%") + ":%s" for column in columns) + "}"
+
+
+def encode_records(batch: RecordBatch) -> str:
+    """
+    a json array of row objects built from the columns, no per row dicts along the way
+    """
+    if not len(batch):
+        return "[]"
+    row = row_template(batch.columns)
+    encoded = [encode_column(values) for values in batch.values]
+    return "[" + ",".join(row % values for values in zip(*encoded)) + "]"
+
+
+def encode_columnar_records(batch: RecordBatch) -> str:
+    """
+    column names once, then every column's values as one array
+    """
+    data = ",".join(f"{encode_json(column)}:{encode_json(values)}" for column, values in zip(batch.columns, batch.values))
+    return f'{{"columns":{encode_json(list(batch.columns))},"data":{{{data}}}}}'
+
+
+def encode_metrics_with(metrics: Metrics, records: str) -> bytes:
+    configuration = metrics.configuration
+    return (
+        f'{{"id":{encode_json(configuration.id)},"is_editable":{encode_json(configuration.is_editable)},'
+        f'"records":{records},'
+        f'"layouts":{encode_json(configuration.layouts)},'
+        f'"next_cursor":{encode_json(encode_cursor(metrics.record_set.next_after))}}}'
+    ).encode()
+
+
+def encode_row_metrics(metrics: Metrics) -> bytes:
+    """
+    the MetricsResponse body for metrics read as rows, straight from the snapshot and record dicts,
+    layout snapshots go through orjson's own dataclass serialiser, fields as in LayoutItemContract
+    """
+    configuration = metrics.configuration
+    return dumps({
+        "id": configuration.id,
+        "is_editable": configuration.is_editable,
+        "records": metrics.record_set.records,
+        "layouts": configuration.layouts,
+        "next_cursor": encode_cursor(metrics.record_set.next_after),
+    })
+
+
+def encode_metrics(metrics: Metrics) -> bytes:
+    """
+    the MetricsResponse body for metrics read as a record batch
+    """
+    return encode_metrics_with(metrics, encode_records(metrics.record_set))
+
+
+def encode_metrics_response(metrics: Metrics) -> bytes:
+    """
+    the MetricsResponse body whichever way the records were read
+    """
+    if isinstance(metrics.record_set, RecordBatch):
+        return encode_metrics(metrics)
+    return encode_row_metrics(metrics)
+
+
+def encode_metrics_delta(metrics: MetricsDelta) -> bytes:
+    """
+    the MetricsDeltaResponse body
+    """
+    configuration, delta = metrics.configuration, metrics.delta
+    return dumps({
+        "id": configuration.id,
+        "is_editable": configuration.is_editable,
+        "records": delta.records,
+        "removed": delta.removed,
+        "layouts": configuration.layouts,
+        "watermark": delta.watermark,
+    })
+
+
+def encode_columnar_metrics(metrics: Metrics) -> bytes:
+    """
+    the ColumnarMetricsResponse body, pages read as rows are turned into columns first
+    """
+    record_set = metrics.record_set
+    batch = record_set if isinstance(record_set, RecordBatch) else record_set.to_batch()
+    return encode_metrics_with(metrics, encode_columnar_records(batch))
+
+
+async def encode_ndjson(batches: AsyncIterator[list[dict]]) -> AsyncIterator[bytes]:
+    """
+    one json record per line, sent a batch at a time
+    """
+    async for records in batches:
+        yield b"".join(dumps(record) + b"\n" for record in records)
+
+
+async def encode_json_array(batches: AsyncIterator[list[dict]]) -> AsyncIterator[bytes]:
+    """
+    one json array of records, sent a batch at a time
+    """
+    separator = b"["
+    async for records in batches:
+        if records:
+            yield separator + dumps(records)[1:-1]
+            separator = b","
+    yield b"]" if separator == b"," else b"[]"
+
+
+def decode_json_rows(body: bytes, ndjson: bool) -> list[Any]:
+    """
+    the items of a json array, or each non empty line of ndjson, a line that isn't json is kept as
+    the error it raised so the lines around it can still be read, a body that isn't an array raises
+    """
+    if not ndjson:
+        rows = orjson.loads(body)
+        if not isinstance(rows, list):
+            raise ValueError("Expected a json array")
+        return rows
+    rows = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            rows.append(orjson.loads(line))
+        except orjson.JSONDecodeError as e:
+            rows.append(e)
+    return rows
+
+
+@dataclass(frozen=True, slots=True)
+class EventStreamSettings:
+    """
+    :param heartbeat_seconds: longest a server sent event stream goes without sending anything
+    """
+    heartbeat_seconds: float = 15
+
+
+async def encode_events(messages: AsyncIterator[bytes], heartbeat_seconds: float) -> AsyncIterator[bytes]:
+    """
+    server sent events, one per json message, with a comment whenever nothing was sent for
+    heartbeat_seconds so proxies keep an idle stream open
+    """
+    messages = aiter(messages)
+    # the pending read outlives a heartbeat, cancelling it would end a generator
+    pending = None
+    try:
+        while True:
+            pending = pending or asyncio.ensure_future(anext(messages))
+            done, _ = await asyncio.wait((pending,), timeout=heartbeat_seconds)
+            if not done:
+                yield b": heartbeat\n\n"
+                continue
+            pending = None
+            try:
+                message = done.pop().result()
+            except StopAsyncIteration:
+                return
+            yield b"data: " + message + b"\n\n"
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+# cursor values keep their type, so a page after the first binds them as the column's own type
+CURSOR_TYPES: dict[str, tuple[type, Callable[[Any], Any], Callable[[Any], Any]]] = {
+    "b": (bool, lambda value: value, bool),
+    "i": (int, lambda value: value, int),
+    "f": (float, lambda value: value, float),
+    "s": (str, lambda value: value, str),
+    "n": (Decimal, str, Decimal),
+    "t": (datetime.datetime, datetime.datetime.isoformat, datetime.datetime.fromisoformat),
+    "d": (datetime.date, datetime.date.isoformat, datetime.date.fromisoformat),
+    "h": (datetime.time, datetime.time.isoformat, datetime.time.fromisoformat),
+    "v": (
+        datetime.timedelta,
+        lambda value: [value.days, value.seconds, value.microseconds],
+        lambda value: datetime.timedelta(*value)
+    ),
+    "u": (uuid.UUID, str, uuid.UUID),
+    "x": (bytes, lambda value: base64.b64encode(value).decode(), lambda value: base64.b64decode(value, validate=True)),
+}
+
+
+class UnpageableRecords(TypeError):
+    """
+    the last record of a page holds a value with no cursor type, so the next page can't be bound
+    """
+
+
+def encode_cursor(after: Optional[RecordKey]) -> Optional[str]:
+    """
+    an opaque, url safe token for the key of the last record on a page
+    """
+    if after is None:
+        return None
+    key = []
+    for column, value in after.row:
+        if value is None:
+            key.append([column, None, None])
+            continue
+        # in order, so bool is not taken for int nor datetime for date, asyncpg's UUID subclasses uuid.UUID
+        tag = next((tag for tag, (cls, _, _) in CURSOR_TYPES.items() if isinstance(value, cls)), None)
+        if tag is None:
+            raise UnpageableRecords(f"{type(value).__name__} values can't be paged")
+        key.append([column, tag, CURSOR_TYPES[tag][1](value)])
+    return base64.urlsafe_b64encode(json.dumps({"k": key, "n": after.seen}, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[RecordKey]:
+    """
+    the record key from encode_cursor, ValueError if the token wasn't made by it
+    """
+    if cursor is None:
+        return None
+    try:
+        token = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        # cursors handed out before the count of equal records was kept are a bare key
+        key, seen = (token, 1) if isinstance(token, list) else (token["k"], token["n"])
+        if type(seen) is not int or seen < 1:
+            raise ValueError("Invalid cursor")
+        return RecordKey(
+            row=tuple((str(column), None if tag is None else CURSOR_TYPES[tag][2](value)) for column, tag, value in key),
+            seen=seen
+        )
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError, ArithmeticError) as e:
+        raise ValueError("Invalid cursor") from e
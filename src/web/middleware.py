@@ -8,6 +8,7 @@ from starlette.responses import JSONResponse
 from starlette.types import HTTPExceptionHandler
 
 from src.crosscutting import Logger
+from src.web.compression import CompressionMiddleware, CompressionSettings
 
 
 def add_exception_middleware(app: FastAPI):
@@ -28,6 +29,10 @@ def add_exception_middleware(app: FastAPI):
     )
 
 
+def add_compression_middleware(app: FastAPI):
+    app.add_middleware(CompressionMiddleware, settings_factory=lambda: app.state.services[CompressionSettings])
+
+
 def log_and_handle(
     status_code: int,
     message: str,
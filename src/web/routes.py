@@ -1,19 +1,29 @@
-from datetime import date
-from typing import Optional
+import asyncio
+from datetime import date, datetime
+from typing import Optional, Union
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, Query, Body, Path
-from starlette.responses import JSONResponse, Response
-from starlette.status import HTTP_201_CREATED, HTTP_404_NOT_FOUND, HTTP_401_UNAUTHORIZED, HTTP_403_FORBIDDEN
+from fastapi import APIRouter, Depends, Query, Body, Path, Header, WebSocket, Request
+from pydantic import ValidationError
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.status import HTTP_201_CREATED, HTTP_404_NOT_FOUND, HTTP_401_UNAUTHORIZED, HTTP_403_FORBIDDEN, \
+    HTTP_304_NOT_MODIFIED, HTTP_400_BAD_REQUEST, HTTP_413_REQUEST_ENTITY_TOO_LARGE
 
-from src.application.mappers import map_metric_aggregate_to_contract, map_metric_configuration_contract_to_domain, \
-    map_metric_record_contract_to_domain
-from src.application.services import DatabaseHealthCheckService, GetMetricsService, CreateMetricConfigurationService, \
-    CreateMetricService
+from src.application.mappers import map_metric_configuration_contract_to_domain, \
+    map_metric_record_contract_to_domain, map_ingest_record_contract_to_domain
+from src.application.services import DatabaseHealthCheckService, GetEncodedMetricsService, \
+    CreateMetricConfigurationService, CreateMetricService, StreamMetricRecordsService, ExportMetricRecordsService, \
+    GetMetricsDeltaService, SubscribeMetricsService, IngestMetricRecordsService
+from src.core import DEFAULT_START_DATE, DEFAULT_END_DATE, DEFAULT_DAY_RANGE, MAX_PAGE_SIZE, ExportFormat, \
+    Downsampling, MAX_INGEST_ROWS, MAX_INGEST_BYTES, IngestResult
 from src.crosscutting import get_service, logging_scope, Logger
-from src.web import auth_provider, Authenticator
+from src.web import auth_provider, Authenticator, websocket_auth_provider
+from src.web.encoding import encode_metrics_response, encode_ndjson, encode_json_array, decode_cursor, \
+    encode_columnar_metrics, encode_metrics_delta, encode_events, EventStreamSettings, decode_json_rows, UnpageableRecords
+from src.web.compression import CompressionSettings, content_coding, compressed_body, encoded_headers
 from src.web.contracts import MetricsResponse, HealthCheckResponse, CreatedResponse, CreateMetricConfigurationRequest, \
-    CreateMetricRequest
+    CreateMetricRequest, ColumnarMetricsResponse, RecordsFormat, MetricsDeltaResponse, IngestMetricRecordRequest, \
+    IngestErrorContract, IngestedResponse
 
 health_router = APIRouter(
     prefix="/health",
@@ -35,6 +45,16 @@ async def get_health(
         database_result = await health_check_service()
         return {"application": True, "database": database_result}
 
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    weak comparison, as If-None-Match requires
+    """
+    if if_none_match is None:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in (candidate.removeprefix("W/") for candidate in candidates)
+
+
 metrics_router = APIRouter(
     prefix="/metrics",
     tags=["Metrics"]
@@ -42,21 +62,37 @@ metrics_router = APIRouter(
 
 @metrics_router.get(
     "/{metric_id}",
-    response_model=MetricsResponse,
+    response_model=Union[MetricsResponse, ColumnarMetricsResponse, MetricsDeltaResponse],
     responses={
+        HTTP_304_NOT_MODIFIED: {"description": "Metrics unchanged since the etag in If-None-Match"},
+        HTTP_400_BAD_REQUEST: {
+            "description": "Cursor not issued by this endpoint, max_points asked for with a page, "
+                           "or since with a page, max_points or columns"
+        },
         HTTP_404_NOT_FOUND: {"description": "Metric not found"},
         HTTP_401_UNAUTHORIZED: {"description": "Unauthenticated"},
         HTTP_403_FORBIDDEN: {"description": "Token invalid"}
     },
     summary="Get metrics",
-    description="Get metrics configuration, data and layouts"
+    description="Get metrics configuration, data and layouts, records as rows or, with format=columnar, as one array per column, "
+                "downsampled for charts with max_points, or with since only the records changed since a previous response"
 )
 async def get_metrics(
     metric_id: UUID = Path(description="metric configuration id to search under"),
-    start_date: Optional[date] = Query('2025-06-01', description="Start date for filtering"),
-    end_date: Optional[date] = Query('2025-06-30', description="End date for filtering"),
-    day_range: Optional[int] = Query(30, description="Number of days before today"),
-    get_metrics_service: GetMetricsService = Depends(get_service(GetMetricsService)),
+    start_date: Optional[date] = Query(DEFAULT_START_DATE, description="Start date for filtering"),
+    end_date: Optional[date] = Query(DEFAULT_END_DATE, description="End date for filtering"),
+    day_range: Optional[int] = Query(DEFAULT_DAY_RANGE, description="Number of days before today"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size, all records in the window when not given"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    format: RecordsFormat = Query(RecordsFormat.rows, description="Records as row objects or as columns"),
+    max_points: Optional[int] = Query(None, ge=3, le=MAX_PAGE_SIZE, description="Most records per series, every record when not given"),
+    downsampling: Downsampling = Query(Downsampling.lttb, description="lttb keeps the records that shape each series, avg, min and max aggregate time buckets"),
+    since: Optional[int] = Query(None, ge=0, description="watermark from the previous delta response, 0 for every record"),
+    if_none_match: Optional[str] = Header(None, description="ETag from a previous response"),
+    accept_encoding: Optional[str] = Header(None, description="zstd, br or gzip for a compressed body"),
+    get_metrics_service: GetEncodedMetricsService = Depends(get_service(GetEncodedMetricsService)),
+    get_metrics_delta_service: GetMetricsDeltaService = Depends(get_service(GetMetricsDeltaService)),
+    compression: CompressionSettings = Depends(get_service(CompressionSettings)),
     _ = Depends(auth_provider),
     logger: Logger = Depends(get_service(Logger))
 ):
@@ -70,19 +106,247 @@ async def get_metrics(
     ):
         logger.info("Endpoint called")
 
-        metrics = await get_metrics_service(
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            logger.warning("Invalid cursor")
+            return JSONResponse(status_code=HTTP_400_BAD_REQUEST, content={"detail": "Invalid cursor"})
+
+        if max_points is not None and limit is not None:
+            logger.warning("Downsampled page")
+            return JSONResponse(
+                status_code=HTTP_400_BAD_REQUEST,
+                content={"detail": "max_points downsamples the whole window and can't be paged"}
+            )
+
+        if since is not None:
+            if limit is not None or max_points is not None or format != RecordsFormat.rows:
+                logger.warning("Delta with other options")
+                return JSONResponse(
+                    status_code=HTTP_400_BAD_REQUEST,
+                    content={"detail": "since can't be combined with limit, max_points or format=columnar"}
+                )
+            metrics_delta = await get_metrics_delta_service(
+                _id=id_str,
+                start_date=start_date,
+                end_date=end_date,
+                day_range=day_range,
+                since=since
+            )
+            if metrics_delta is None:
+                return JSONResponse(status_code=404, content={"detail": "Metrics not found"})
+
+            body = encode_metrics_delta(metrics_delta)
+            coding = content_coding(len(body), accept_encoding, compression)
+            headers = encoded_headers({"Cache-Control": "private, no-store"}, coding)
+            return Response(content=compressed_body(body, {}, coding, compression), media_type="application/json", headers=headers)
+
+        # trusted internal data, encoded once here rather than validated again against response_model
+        columnar = format == RecordsFormat.columnar
+        try:
+            response = await get_metrics_service(
+                _id=id_str,
+                start_date=start_date,
+                end_date=end_date,
+                day_range=day_range,
+                representation=format.value,
+                encode=encode_columnar_metrics if columnar else encode_metrics_response,
+                limit=limit,
+                after=after,
+                # downsampling works column by column too
+                batched=True if columnar or max_points is not None else None,
+                max_points=max_points,
+                downsampling=downsampling
+            )
+        except UnpageableRecords as e:
+            logger.warning("Unpageable records", reason=str(e))
+            return JSONResponse(status_code=HTTP_400_BAD_REQUEST, content={"detail": str(e)})
+
+        if response is None:
+            return JSONResponse(status_code=404, content={"detail": "Metrics not found"})
+
+        # each format is its own representation of the same records
+        etag = f'"{response.version}"'
+        coding = content_coding(len(response.body), accept_encoding, compression)
+        headers = encoded_headers({"ETag": etag, "Cache-Control": "private, no-cache"}, coding)
+        if etag_matches(if_none_match, etag):
+            logger.info("Metrics not modified")
+            return Response(status_code=HTTP_304_NOT_MODIFIED, headers=headers)
+
+        # compressed once per coding alongside the cached body, the middleware leaves encoded bodies alone
+        body = compressed_body(response.body, response.compressed, coding, compression)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# close code for a websocket to a configuration that doesn't exist, from the range left to applications
+WS_NOT_FOUND = 4404
+
+@metrics_router.get(
+    "/{metric_id}/records",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "description": f"Records as a json array, or one per line when Accept is {NDJSON_MEDIA_TYPE}",
+            "content": {"application/json": {}, NDJSON_MEDIA_TYPE: {}}
+        },
+        HTTP_404_NOT_FOUND: {"description": "Metric not found"},
+        HTTP_401_UNAUTHORIZED: {"description": "Unauthenticated"},
+        HTTP_403_FORBIDDEN: {"description": "Token invalid"}
+    },
+    summary="Stream metric records",
+    description="Stream metric data from a server side cursor, for windows too large to send in one document"
+)
+async def stream_metric_records(
+    metric_id: UUID = Path(description="metric configuration id to search under"),
+    start_date: Optional[date] = Query(DEFAULT_START_DATE, description="Start date for filtering"),
+    end_date: Optional[date] = Query(DEFAULT_END_DATE, description="End date for filtering"),
+    day_range: Optional[int] = Query(DEFAULT_DAY_RANGE, description="Number of days before today"),
+    accept: Optional[str] = Header(None, description=f"{NDJSON_MEDIA_TYPE} for one record per line"),
+    stream_metric_records_service: StreamMetricRecordsService = Depends(get_service(StreamMetricRecordsService)),
+    _ = Depends(auth_provider),
+    logger: Logger = Depends(get_service(Logger))
+):
+    id_str = str(metric_id)
+    with logging_scope(
+        operation=stream_metric_records.__name__,
+        id=id_str,
+        start_date=start_date,
+        end_date=end_date,
+        day_range=day_range,
+    ):
+        logger.info("Endpoint called")
+
+        batches = await stream_metric_records_service(
             _id=id_str,
             start_date=start_date,
             end_date=end_date,
             day_range=day_range
         )
 
-        if metrics is None:
+        if batches is None:
             return JSONResponse(status_code=404, content={"detail": "Metrics not found"})
 
-        response = map_metric_aggregate_to_contract(metrics)
-        return response
-    
+        if accept is not None and NDJSON_MEDIA_TYPE in accept:
+            return StreamingResponse(encode_ndjson(batches), media_type=NDJSON_MEDIA_TYPE)
+        return StreamingResponse(encode_json_array(batches), media_type="application/json")
+
+
+EVENT_STREAM_MEDIA_TYPE = "text/event-stream"
+
+
+@metrics_router.get(
+    "/{metric_id}/updates",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "description": "Server sent events, each a delta response body, the first holding every record",
+            "content": {EVENT_STREAM_MEDIA_TYPE: {}}
+        },
+        HTTP_404_NOT_FOUND: {"description": "Metric not found"},
+        HTTP_401_UNAUTHORIZED: {"description": "Unauthenticated"},
+        HTTP_403_FORBIDDEN: {"description": "Token invalid"}
+    },
+    summary="Subscribe to metrics",
+    description="Push the records of a window and then each change to them as metric records are written, "
+                "in place of polling, also served as a websocket on the same path"
+)
+async def subscribe_to_metrics(
+    metric_id: UUID = Path(description="metric configuration id to search under"),
+    start_date: Optional[date] = Query(DEFAULT_START_DATE, description="Start date for filtering"),
+    end_date: Optional[date] = Query(DEFAULT_END_DATE, description="End date for filtering"),
+    day_range: Optional[int] = Query(DEFAULT_DAY_RANGE, description="Number of days before today"),
+    subscribe_metrics_service: SubscribeMetricsService = Depends(get_service(SubscribeMetricsService)),
+    event_stream: EventStreamSettings = Depends(get_service(EventStreamSettings)),
+    _ = Depends(auth_provider),
+    logger: Logger = Depends(get_service(Logger))
+):
+    id_str = str(metric_id)
+    with logging_scope(
+        operation=subscribe_to_metrics.__name__,
+        id=id_str,
+        start_date=start_date,
+        end_date=end_date,
+        day_range=day_range,
+    ):
+        logger.info("Endpoint called")
+
+        subscription = await subscribe_metrics_service(
+            _id=id_str,
+            start_date=start_date,
+            end_date=end_date,
+            day_range=day_range,
+            encode=encode_metrics_delta
+        )
+
+        if subscription is None:
+            return JSONResponse(status_code=404, content={"detail": "Metrics not found"})
+
+        async def events():
+            try:
+                async for event in encode_events(subscription, event_stream.heartbeat_seconds):
+                    yield event
+            finally:
+                subscription.close()
+
+        return StreamingResponse(
+            events(),
+            media_type=EVENT_STREAM_MEDIA_TYPE,
+            headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"}
+        )
+
+
+@metrics_router.websocket("/{metric_id}/updates")
+async def subscribe_to_metrics_websocket(
+    websocket: WebSocket,
+    metric_id: UUID = Path(description="metric configuration id to search under"),
+    start_date: Optional[date] = Query(DEFAULT_START_DATE, description="Start date for filtering"),
+    end_date: Optional[date] = Query(DEFAULT_END_DATE, description="End date for filtering"),
+    day_range: Optional[int] = Query(DEFAULT_DAY_RANGE, description="Number of days before today"),
+    subscribe_metrics_service: SubscribeMetricsService = Depends(get_service(SubscribeMetricsService)),
+    _ = Depends(websocket_auth_provider),
+    logger: Logger = Depends(get_service(Logger))
+):
+    id_str = str(metric_id)
+    with logging_scope(
+        operation=subscribe_to_metrics_websocket.__name__,
+        id=id_str,
+        start_date=start_date,
+        end_date=end_date,
+        day_range=day_range,
+    ):
+        logger.info("Endpoint called")
+
+        subscription = await subscribe_metrics_service(
+            _id=id_str,
+            start_date=start_date,
+            end_date=end_date,
+            day_range=day_range,
+            encode=encode_metrics_delta
+        )
+
+        if subscription is None:
+            await websocket.close(code=WS_NOT_FOUND, reason="Metrics not found")
+            return
+
+        async def send():
+            async for message in subscription:
+                await websocket.send_text(message.decode())
+
+        await websocket.accept()
+        sending = asyncio.create_task(send())
+        try:
+            # clients have nothing to send, whatever they do is read only to notice them leave
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+        finally:
+            # closed before anything is awaited, a cancelled handler would not get back to it
+            subscription.close()
+            sending.cancel()
+            await asyncio.gather(sending, return_exceptions=True)
+
+
 @metrics_router.post(
     "/",
     response_model=CreatedResponse,
@@ -151,4 +415,146 @@ async def create_metric_record(
         if _id is None:
             return JSONResponse(status_code=404, content={"detail": "Metric not found"})
 
-        return Response(status_code=201)
\ No newline at end of file
+        return Response(status_code=201)
+
+
+INGEST_RECORD_SCHEMA = IngestMetricRecordRequest.model_json_schema()
+INGEST_TOO_LARGE = f"More than {MAX_INGEST_ROWS} records or {MAX_INGEST_BYTES} bytes"
+
+
+async def read_body(request: Request, max_bytes: int) -> Optional[bytes]:
+    """
+    the request body, none as soon as it is past max_bytes, before reading any of it when Content-Length says so
+    """
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > max_bytes:
+        return None
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_bytes:
+            return None
+    return bytes(body)
+
+
+@metrics_router.post(
+    "/metric-records",
+    response_model=IngestedResponse,
+    responses={
+        HTTP_400_BAD_REQUEST: {"description": "Body is not a json array"},
+        HTTP_413_REQUEST_ENTITY_TOO_LARGE: {"description": INGEST_TOO_LARGE},
+        HTTP_401_UNAUTHORIZED: {"description": "Unauthenticated"},
+        HTTP_403_FORBIDDEN: {"description": "Token invalid"}
+    },
+    summary="Ingest metric records",
+    description="Create metric data for any number of metric configurations in one transaction, as a json array "
+                f"or one record per line when Content-Type is {NDJSON_MEDIA_TYPE}, records that can't be "
+                "written are reported by position and the rest are written",
+    openapi_extra={"requestBody": {"required": True, "content": {
+        "application/json": {"schema": {"type": "array", "items": INGEST_RECORD_SCHEMA}},
+        NDJSON_MEDIA_TYPE: {"schema": INGEST_RECORD_SCHEMA},
+    }}}
+)
+async def ingest_metric_records(
+    request: Request,
+    content_type: Optional[str] = Header(None, description=f"{NDJSON_MEDIA_TYPE} for one record per line"),
+    ingest_metric_records_service: IngestMetricRecordsService = Depends(get_service(IngestMetricRecordsService)),
+    _ = Depends(auth_provider),
+    logger: Logger = Depends(get_service(Logger))
+):
+    ndjson = content_type is not None and NDJSON_MEDIA_TYPE in content_type
+    with logging_scope(operation=ingest_metric_records.__name__, ndjson=ndjson):
+        logger.info("Endpoint called")
+
+        body = await read_body(request, MAX_INGEST_BYTES)
+        if body is None:
+            return JSONResponse(status_code=413, content={"detail": INGEST_TOO_LARGE})
+        try:
+            rows = decode_json_rows(body, ndjson)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"detail": str(e)})
+        if len(rows) > MAX_INGEST_ROWS:
+            return JSONResponse(status_code=413, content={"detail": INGEST_TOO_LARGE})
+
+        received = datetime.now()
+        errors, positions, records = [], [], []
+        for index, row in enumerate(rows):
+            if isinstance(row, ValueError):
+                errors.append(IngestErrorContract(index=index, detail=str(row)))
+                continue
+            try:
+                ingest_request = IngestMetricRecordRequest.model_validate(row)
+            except ValidationError as e:
+                errors.append(IngestErrorContract(index=index, detail=e.errors(include_url=False, include_context=False)))
+                continue
+            positions.append(index)
+            records.append((
+                str(ingest_request.metric_configuration_id),
+                map_ingest_record_contract_to_domain(ingest_request, received)
+            ))
+
+        result = await ingest_metric_records_service(records) if records else IngestResult(created=0, missing=[])
+        errors.extend(IngestErrorContract(index=positions[missing], detail="Metric not found") for missing in result.missing)
+        errors.sort(key=lambda error: error.index)
+        logger.info("Metric records ingested", created=result.created, rejected=len(errors))
+        return IngestedResponse(created=result.created, errors=errors)
+
+
+EXPORT_MEDIA_TYPES = {
+    ExportFormat.arrow: "application/vnd.apache.arrow.stream",
+    ExportFormat.parquet: "application/vnd.apache.parquet",
+    ExportFormat.csv: "text/csv",
+}
+
+
+@metrics_router.get(
+    "/{metric_id}/records.{format}",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "description": "Records as an arrow ipc stream, a parquet file or csv with a header row",
+            "content": {media_type: {} for media_type in EXPORT_MEDIA_TYPES.values()}
+        },
+        HTTP_404_NOT_FOUND: {"description": "Metric not found"},
+        HTTP_401_UNAUTHORIZED: {"description": "Unauthenticated"},
+        HTTP_403_FORBIDDEN: {"description": "Token invalid"}
+    },
+    summary="Export metric records",
+    description="Export metric data for analysis tools, written a batch at a time as the stored query is read"
+)
+async def export_metric_records(
+    metric_id: UUID = Path(description="metric configuration id to search under"),
+    format: ExportFormat = Path(description="arrow, parquet or csv"),
+    start_date: Optional[date] = Query(DEFAULT_START_DATE, description="Start date for filtering"),
+    end_date: Optional[date] = Query(DEFAULT_END_DATE, description="End date for filtering"),
+    day_range: Optional[int] = Query(DEFAULT_DAY_RANGE, description="Number of days before today"),
+    export_metric_records_service: ExportMetricRecordsService = Depends(get_service(ExportMetricRecordsService)),
+    _ = Depends(auth_provider),
+    logger: Logger = Depends(get_service(Logger))
+):
+    id_str = str(metric_id)
+    with logging_scope(
+        operation=export_metric_records.__name__,
+        id=id_str,
+        start_date=start_date,
+        end_date=end_date,
+        day_range=day_range,
+    ):
+        logger.info("Endpoint called")
+
+        chunks = await export_metric_records_service(
+            _id=id_str,
+            start_date=start_date,
+            end_date=end_date,
+            day_range=day_range,
+            format=format
+        )
+
+        if chunks is None:
+            return JSONResponse(status_code=404, content={"detail": "Metrics not found"})
+
+        return StreamingResponse(
+            chunks,
+            media_type=EXPORT_MEDIA_TYPES[format],
+            headers={"Content-Disposition": f'attachment; filename="{id_str}.{format.value}"'}
+        )
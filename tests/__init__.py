@@ -81,7 +81,9 @@ def do_global_setup():
             AWS_REGION="eu-test",
             QUERIES_SEED_CSV="./data/queries.csv",
             METRICS_SEED_JSON="./data/metrics.json",
-            METRIC_RECORDS_SEED_JSON="./data/metric_records.json"
+            METRIC_RECORDS_SEED_JSON="./data/metric_records.json",
+            # the test client runs each request on its own event loop, pooled connections can't cross loops
+            DB_POOL_ENABLED=False
         )
 
         def override_deps(populated_container: Container):
@@ -1,8 +1,14 @@
+import csv
 import datetime
+import io
+import json
 import logging
 import uuid
+from urllib.parse import urlencode
 
+import pyarrow as pa
 from autofixture import AutoFixture
+from starlette.websockets import WebSocketDisconnect
 
 from src.web.contracts import MetricsResponse, LayoutItemContract, CreateMetricConfigurationRequest, CreateMetricRequest
 from tests import step, ScenarioContext
@@ -71,9 +77,73 @@ class GetMetricsScenario:
         for key, value in kwargs.items():
             setattr(self, key, value)
         self.metric_id = metric_id
+        self.params = kwargs
         self.response = self.ctx.client.get(f"/metrics/{self.metric_id}", params=kwargs, headers=DEFAULT_REQUEST_HEADERS)
         return self
 
+    @step
+    def when_the_get_metrics_endpoint_is_called_again_with_the_etag(self):
+        self.etag = self.response.headers["ETag"]
+        self.response = self.ctx.client.get(
+            f"/metrics/{self.metric_id}",
+            params=self.params,
+            headers={**DEFAULT_REQUEST_HEADERS, "If-None-Match": self.etag}
+        )
+        return self
+
+    @step
+    def when_the_next_page_is_requested(self):
+        self.pages = getattr(self, "pages", []) + [self.response.json()]
+        self.response = self.ctx.client.get(
+            f"/metrics/{self.metric_id}",
+            params={**self.params, "cursor": self.response.json()["next_cursor"]},
+            headers=DEFAULT_REQUEST_HEADERS
+        )
+        return self
+
+    @step
+    def then_the_pages_should_hold_every_record_once(self, expected_records: list[dict]):
+        pages = self.pages + [self.response.json()]
+        self.ctx.test_case.assertEqual([record for page in pages for record in page["records"]], expected_records)
+        self.ctx.test_case.assertTrue(all(page["next_cursor"] for page in pages[:-1]))
+        self.ctx.test_case.assertIsNone(pages[-1]["next_cursor"])
+        return self
+
+    @step
+    def then_the_records_should_be_columns(self, expected_records: list[dict]):
+        body = self.response.json()
+        columns, data = body["records"]["columns"], body["records"]["data"]
+        rows = [dict(zip(columns, values)) for values in zip(*(data[column] for column in columns))]
+        self.ctx.test_case.assertEqual(columns, list(expected_records[0]))
+        self.ctx.test_case.assertCountEqual(rows, expected_records)
+        return self
+
+    @step
+    def when_the_metrics_are_polled_since_the_watermark(self):
+        self.watermark = self.response.json()["watermark"]
+        self.response = self.ctx.client.get(
+            f"/metrics/{self.metric_id}",
+            params={**self.params, "since": self.watermark},
+            headers=DEFAULT_REQUEST_HEADERS
+        )
+        return self
+
+    @step
+    def then_the_delta_should_hold(self, expected_records: list[dict], expected_removed: list[dict]):
+        body = self.response.json()
+        self.ctx.test_case.assertCountEqual(body["records"], expected_records)
+        self.ctx.test_case.assertCountEqual(body["removed"], expected_removed)
+        self.ctx.test_case.assertGreater(body["watermark"], 0)
+        self.ctx.test_case.assertEqual(self.response.headers["Cache-Control"], "private, no-store")
+        return self
+
+    @step
+    def then_the_response_should_not_be_modified(self):
+        self.ctx.test_case.assertEqual(self.response.status_code, 304)
+        self.ctx.test_case.assertEqual(self.response.content, b"")
+        self.ctx.test_case.assertEqual(self.response.headers["ETag"], self.etag)
+        return self
+
     @step
     def then_the_status_code_should_be(self, status_code: int):
         self.ctx.test_case.assertEqual(self.response.status_code,  status_code)
@@ -204,6 +274,202 @@ class GetMetricsScenario:
         return self
 
 
+class StreamMetricRecordsScenario:
+
+    def __init__(self, ctx: ScenarioContext) -> None:
+        self.day_range = 30
+        self.start_date = datetime.date(2025, 6, 1)
+        self.end_date = datetime.date(2025, 6, 30)
+        self.ctx = ctx
+
+    @step
+    def given_i_have_an_app_running(self):
+        return self
+
+    @step
+    def when_the_stream_records_endpoint_is_called(self, metric_id: str, accept: str = "application/json", **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+        self.metric_id = metric_id
+        self.response = self.ctx.client.get(
+            f"/metrics/{self.metric_id}/records",
+            params=kwargs,
+            headers={**DEFAULT_REQUEST_HEADERS, "Accept": accept}
+        )
+        return self
+
+    @step
+    def then_the_status_code_should_be(self, status_code: int):
+        self.ctx.test_case.assertEqual(self.response.status_code, status_code)
+        return self
+
+    @step
+    def then_the_content_type_should_be(self, content_type: str):
+        self.ctx.test_case.assertEqual(self.response.headers["Content-Type"], content_type)
+        return self
+
+    @step
+    def then_each_line_should_be_a_record(self, expected_records: list[dict]):
+        lines = self.response.text.splitlines()
+        self.ctx.test_case.assertCountEqual([json.loads(line) for line in lines], expected_records)
+        return self
+
+    @step
+    def then_the_body_should_be_the_records(self, expected_records: list[dict]):
+        self.ctx.test_case.assertCountEqual(self.response.json(), expected_records)
+        return self
+
+    @step
+    def then_an_info_log_indicates_endpoint_called(self):
+        self.ctx.test_case.assert_there_is_log_with(self.ctx.logger,
+            log_level=logging.INFO,
+            message="Endpoint called",
+            operation="stream_metric_records",
+            id=self.metric_id,
+            start_date=self.start_date,
+            end_date=self.end_date,
+            day_range=self.day_range)
+        return self
+
+
+class ExportMetricRecordsScenario:
+
+    def __init__(self, ctx: ScenarioContext) -> None:
+        self.day_range = 30
+        self.start_date = datetime.date(2025, 6, 1)
+        self.end_date = datetime.date(2025, 6, 30)
+        self.ctx = ctx
+
+    @step
+    def given_i_have_an_app_running(self):
+        return self
+
+    @step
+    def when_the_export_records_endpoint_is_called(self, metric_id: str, format: str, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+        self.metric_id = metric_id
+        self.response = self.ctx.client.get(
+            f"/metrics/{self.metric_id}/records.{format}",
+            params=kwargs,
+            headers=DEFAULT_REQUEST_HEADERS
+        )
+        return self
+
+    @step
+    def then_the_status_code_should_be(self, status_code: int):
+        self.ctx.test_case.assertEqual(self.response.status_code, status_code)
+        return self
+
+    @step
+    def then_the_content_type_should_be(self, content_type: str):
+        self.ctx.test_case.assertEqual(self.response.headers["Content-Type"], content_type)
+        return self
+
+    @step
+    def then_the_csv_rows_should_be_the_records(self, expected_records: list[dict]):
+        rows = list(csv.DictReader(io.StringIO(self.response.text)))
+        self.ctx.test_case.assertCountEqual(rows, expected_records)
+        return self
+
+    @step
+    def then_the_arrow_stream_should_hold_the_records(self, expected_records: list[dict]):
+        table = pa.ipc.open_stream(self.response.content).read_all()
+        self.ctx.test_case.assertCountEqual(table.to_pylist(), expected_records)
+        return self
+
+    @step
+    def then_an_info_log_indicates_endpoint_called(self):
+        self.ctx.test_case.assert_there_is_log_with(self.ctx.logger,
+            log_level=logging.INFO,
+            message="Endpoint called",
+            operation="export_metric_records",
+            id=self.metric_id,
+            start_date=self.start_date,
+            end_date=self.end_date,
+            day_range=self.day_range)
+        return self
+
+
+class SubscribeToMetricsScenario:
+
+    def __init__(self, ctx: ScenarioContext) -> None:
+        # records created here are dated today, the window is kept around it
+        self.day_range = 30
+        self.start_date = datetime.date.today() - datetime.timedelta(days=1)
+        self.end_date = datetime.date.today() + datetime.timedelta(days=1)
+        self.ctx = ctx
+
+    @step
+    def given_i_have_an_app_running(self):
+        return self
+
+    @step
+    def when_the_updates_websocket_is_opened(self, metric_id: str):
+        self.metric_id = metric_id
+        params = urlencode({"start_date": self.start_date, "end_date": self.end_date, "day_range": self.day_range})
+        self.session = self.ctx.client.websocket_connect(
+            f"/metrics/{self.metric_id}/updates?{params}",
+            headers=DEFAULT_REQUEST_HEADERS
+        )
+        try:
+            self.websocket = self.session.__enter__()
+        except WebSocketDisconnect as e:
+            self.disconnect = e
+        return self
+
+    @step
+    def then_the_websocket_should_be_closed_with(self, code: int):
+        self.ctx.test_case.assertEqual(self.disconnect.code, code)
+        return self
+
+    @step
+    def then_the_first_message_should_hold_the_whole_window(self):
+        self.window = self.websocket.receive_json()
+        self.ctx.test_case.assertEqual(self.window["id"], self.metric_id)
+        self.ctx.test_case.assertIsNone(self.window["removed"])
+        self.ctx.test_case.assertGreater(self.window["watermark"], 0)
+        return self
+
+    @step
+    def when_a_metric_record_is_created(self, alert_type: str):
+        self.alert_type = alert_type
+        response = self.ctx.client.post(
+            f"/metrics/{self.metric_id}/metric-records",
+            json=AutoFixture().create(CreateMetricRequest).model_copy(update={"alert_type": alert_type}).model_dump(),
+            headers=DEFAULT_REQUEST_HEADERS
+        )
+        self.ctx.test_case.assertEqual(response.status_code, 201)
+        return self
+
+    @step
+    def then_the_next_message_should_count_the_record(self):
+        message = self.websocket.receive_json()
+        previous = [record for record in self.window["records"] if record["alert_type"] == self.alert_type]
+        total = previous[0]["total_alerts"] if previous else 0
+        self.ctx.test_case.assertGreater(message["watermark"], self.window["watermark"])
+        self.ctx.test_case.assertEqual(message["removed"], previous)
+        self.ctx.test_case.assertEqual(message["records"], [{"alert_type": self.alert_type, "total_alerts": total + 1}])
+        return self
+
+    @step
+    def and_the_websocket_is_closed(self):
+        self.session.__exit__(None, None, None)
+        return self
+
+    @step
+    def then_an_info_log_indicates_endpoint_called(self):
+        self.ctx.test_case.assert_there_is_log_with(self.ctx.logger,
+            log_level=logging.INFO,
+            message="Endpoint called",
+            operation="subscribe_to_metrics_websocket",
+            id=self.metric_id,
+            start_date=self.start_date,
+            end_date=self.end_date,
+            day_range=self.day_range)
+        return self
+
+
 class CreateMetricConfigurationScenario:
 
     def __init__(self, ctx: ScenarioContext):
@@ -247,6 +513,14 @@ class CreateMetricConfigurationScenario:
         self.metric_config_id = self.create_response.json()["id"]
         return self
 
+    @step
+    def and_the_metrics_are_read(self):
+        read_response = self.ctx.client.get(f"/metrics/{self.metric_config_id}", headers=DEFAULT_REQUEST_HEADERS)
+        self.ctx.test_case.assertEqual(read_response.status_code, 200)
+        self.ctx.test_case.assertEqual(read_response.json()["records"], [])
+        self.etag = read_response.headers["ETag"]
+        return self
+
     @step
     def and_data_is_created_for_the_metric(self):
         create_data_response = self.ctx.client.post(
@@ -257,6 +531,16 @@ class CreateMetricConfigurationScenario:
         self.ctx.test_case.assertEqual(create_data_response.status_code, 201)
         return self
 
+    @step
+    def then_the_previous_etag_should_no_longer_match(self):
+        read_response = self.ctx.client.get(
+            f"/metrics/{self.metric_config_id}",
+            headers={**DEFAULT_REQUEST_HEADERS, "If-None-Match": self.etag}
+        )
+        self.ctx.test_case.assertEqual(read_response.status_code, 200)
+        self.ctx.test_case.assertNotEqual(read_response.headers["ETag"], self.etag)
+        return self
+
     @step
     def then_an_info_log_indicates_endpoint_called(self):
         self.ctx.test_case.assert_there_is_log_with(self.ctx.logger,
@@ -281,14 +565,6 @@ class CreateMetricConfigurationScenario:
             id=self.metric_config_id,
             is_editable=True,
             layouts=[
-                LayoutItemContract(
-                    static=True,
-                    x=1,
-                    y=1,
-                    h=1,
-                    w=1,
-                    breakpoint="md"
-                ),
                 LayoutItemContract(
                     static=False,
                     x=2,
@@ -296,6 +572,14 @@ class CreateMetricConfigurationScenario:
                     h=1,
                     w=5,
                     breakpoint="lg"
+                ),
+                LayoutItemContract(
+                    static=True,
+                    x=1,
+                    y=1,
+                    h=1,
+                    w=1,
+                    breakpoint="md"
                 )
             ],
             records=[self.metric_record.model_dump()]
@@ -344,4 +628,66 @@ class CreateMetricRecordScenario:
     @step
     def then_the_status_code_should_be(self, status_code: int):
         self.ctx.test_case.assertEqual(self.response.status_code, status_code)
-        return self
\ No newline at end of file
+        return self
+
+
+class IngestMetricRecordsScenario:
+
+    def __init__(self, ctx: ScenarioContext):
+        self.ctx = ctx
+
+    @step
+    def given_i_have_an_app_running(self):
+        return self
+
+    @step
+    def when_the_ingest_endpoint_is_called_with(self, rows: list | str, ndjson: bool = False, chunked: bool = False):
+        self.ndjson = ndjson
+        if isinstance(rows, str):
+            content = rows
+        else:
+            lines = [row if isinstance(row, str) else json.dumps(row) for row in rows]
+            content = "\n".join(lines) if ndjson else f"[{','.join(lines)}]"
+        self.response = self.ctx.client.post(
+            "/metrics/metric-records",
+            # an iterator is sent chunked, without a Content-Length
+            content=iter([content.encode()]) if chunked else content,
+            headers={
+                **DEFAULT_REQUEST_HEADERS,
+                "Content-Type": "application/x-ndjson" if ndjson else "application/json"
+            }
+        )
+        return self
+
+    @step
+    def then_the_status_code_should_be(self, status_code: int):
+        self.ctx.test_case.assertEqual(self.response.status_code, status_code)
+        return self
+
+    @step
+    def then_the_response_should_report(self, created: int, errors: list[tuple[int, str]]):
+        body = self.response.json()
+        self.ctx.test_case.assertEqual(body["created"], created)
+        self.ctx.test_case.assertEqual([error["index"] for error in body["errors"]], [index for index, _ in errors])
+        for error, (_, expected) in zip(body["errors"], errors):
+            self.ctx.test_case.assertIn(expected, json.dumps(error["detail"]))
+        return self
+
+    @step
+    def then_the_metrics_on_the_day_should_be(self, metric_id: str, day: datetime.date, expected_records: list[dict]):
+        response = self.ctx.client.get(
+            f"/metrics/{metric_id}",
+            params={"start_date": day, "end_date": day},
+            headers=DEFAULT_REQUEST_HEADERS
+        )
+        self.ctx.test_case.assertCountEqual(response.json()["records"], expected_records)
+        return self
+
+    @step
+    def then_an_info_log_indicates_endpoint_called(self):
+        self.ctx.test_case.assert_there_is_log_with(self.ctx.logger,
+            log_level=logging.INFO,
+            message="Endpoint called",
+            operation="ingest_metric_records",
+            ndjson=self.ndjson)
+        return self
@@ -0,0 +1,1367 @@
+import asyncio
+import dataclasses
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from datetime import date, datetime, timezone
+from unittest import TestCase, IsolatedAsyncioTestCase
+from unittest.mock import MagicMock
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import text, event
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.pool import NullPool
+
+from src.application.services import GetEncodedMetricsService
+from src.core import QuerySnapshot, MetricConfigurationSnapshot, LayoutSnapshot, \
+    DEFAULT_START_DATE, DEFAULT_END_DATE, DEFAULT_DAY_RANGE, Metrics, RecordSet, EncodedResponse
+from src.crosscutting import Logger
+from src.infrastructure.caching import LruTtlCache, MISSING, async_ttl_cache, CACHE_REGISTRY, SingleFlight, \
+    seconds_until_midnight, AGGREGATES_CACHE, RECORDS_CACHE, LocalMetricCacheInvalidator, BackgroundRefresher, \
+    REFRESHER, SqliteSharedCacheBackend, configure_caches, PostgresCacheInvalidationListener, RECORD_BATCHES_CACHE, \
+    evict, RESPONSES_CACHE, approximate_size, SIZE_SAMPLE
+from src.infrastructure import Settings, SqlAlchemyConnectionPool
+from src.infrastructure.orm import start_mappers
+from src.infrastructure.readers import SqlAlchemyMetricAggregateReader, SqlAlchemyMetricRecordsReader, \
+    RECORDS_WATERMARK
+from src.infrastructure.prefetch import DecayingAccessTracker, HotMetricPrefetcher
+from src.infrastructure.responses import LruEncodedResponseCache
+from src.infrastructure.warmup import CacheWarmer
+from src.infrastructure.writers import SqlAlchemyCacheInvalidationPublisher
+from tests import FastApiTestCase
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class SilentLogger:
+
+    def info(self, msg, *args, **kwargs): ...
+    def warning(self, msg, *args, **kwargs): ...
+    def error(self, msg, *args, **kwargs): ...
+
+
+class RecordingLogger(SilentLogger):
+
+    def __init__(self):
+        self.messages = []
+
+    def info(self, msg, *args, **kwargs):
+        self.messages.append(msg)
+
+    def warning(self, msg, *args, **kwargs):
+        self.messages.append(msg)
+
+
+class CountingSession:
+    """
+    stands in for a request's session, every instance shares the query log,
+    the watermark records readers read ahead of the records is answered without being logged
+    """
+
+    def __init__(self, executed: list, result):
+        self.executed = executed
+        self.result = result
+
+    async def execute(self, statement, params=None):
+        if statement is RECORDS_WATERMARK:
+            watermark = MagicMock()
+            watermark.one.return_value = (0, date(2025, 6, 30))
+            return watermark
+        self.executed.append((str(statement), params))
+        await asyncio.sleep(0.01)
+        return self.result
+
+
+class TestLruTtlCache(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_get_returns_value_within_ttl(self):
+        # arrange
+        cache = LruTtlCache("test", ttl_seconds=10, clock=self.clock)
+        cache.set("a", 1)
+        self.clock.now = 9
+
+        # act
+        value = cache.get("a")
+
+        # assert
+        self.assertEqual(value, 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_stale_entry_is_served_until_the_hard_ttl(self):
+        # arrange
+        cache = LruTtlCache("test", ttl_seconds=10, hard_ttl_seconds=30, clock=self.clock)
+        cache.set("a", 1)
+        self.clock.now = 20
+
+        # act
+        entry = cache.lookup("a")
+
+        # assert
+        self.assertEqual(entry.value, 1)
+        self.assertTrue(cache.is_stale(entry))
+        self.assertEqual(cache.stats()["stale_hits"], 1)
+
+    def test_stale_entry_is_dropped_after_the_hard_ttl(self):
+        # arrange
+        cache = LruTtlCache("test", ttl_seconds=10, hard_ttl_seconds=30, clock=self.clock)
+        cache.set("a", 1)
+        self.clock.now = 30
+
+        # act
+        entry = cache.lookup("a")
+
+        # assert
+        self.assertIsNone(entry)
+
+    def test_get_misses_once_expired(self):
+        # arrange
+        cache = LruTtlCache("test", ttl_seconds=10, clock=self.clock)
+        cache.set("a", 1)
+        self.clock.now = 10
+
+        # act
+        value = cache.get("a")
+
+        # assert
+        self.assertIs(value, MISSING)
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_cached_none_is_a_hit(self):
+        # arrange
+        cache = LruTtlCache("test", ttl_seconds=10, clock=self.clock)
+        cache.set("a", None)
+
+        # act
+        value = cache.get("a")
+
+        # assert
+        self.assertIsNone(value)
+
+    def test_least_recently_used_is_evicted_over_max_entries(self):
+        # arrange
+        cache = LruTtlCache("test", ttl_seconds=10, max_entries=2, clock=self.clock)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+
+        # act
+        cache.set("c", 3)
+
+        # assert
+        self.assertIs(cache.get("b"), MISSING)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_entries_are_evicted_over_byte_budget(self):
+        # arrange
+        cache = LruTtlCache("test", ttl_seconds=10, max_bytes=3000, clock=self.clock)
+
+        # act
+        for i in range(10):
+            cache.set(i, "x" * 1000)
+
+        # assert
+        self.assertLessEqual(cache.stats()["bytes"], 3000)
+        self.assertEqual(cache.get(9), "x" * 1000)
+        self.assertIs(cache.get(0), MISSING)
+
+    def test_value_larger_than_budget_is_not_stored(self):
+        # arrange
+        cache = LruTtlCache("test", ttl_seconds=10, max_bytes=100, clock=self.clock)
+
+        # act
+        cache.set("a", "x" * 1000)
+
+        # assert
+        self.assertIs(cache.get("a"), MISSING)
+
+    def test_large_values_are_sized_from_a_sample(self):
+        # arrange
+        rows = [{"alert_type": "Warning", "total": n} for n in range(SIZE_SAMPLE * 10)]
+
+        # act
+        size = approximate_size(rows)
+
+        # assert
+        walked = sys.getsizeof(rows) + sum(approximate_size(row, 1) for row in rows)
+        self.assertAlmostEqual(size, walked, delta=walked * 0.05)
+
+    def test_sweep_drops_expired_entries_without_reads(self):
+        # arrange
+        cache = LruTtlCache("test", ttl_seconds=10, clock=self.clock)
+        cache.set("a", 1)
+        self.clock.now = 5
+        cache.set("b", 2)
+        self.clock.now = 12
+
+        # act
+        expired = cache.sweep()
+
+        # assert
+        self.assertEqual(expired, 1)
+        self.assertEqual(cache.stats()["entries"], 1)
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_invalidate_tag_drops_every_entry_in_the_group(self):
+        # arrange
+        cache = LruTtlCache("test", ttl_seconds=10, clock=self.clock)
+        cache.set(("q1", 1), "a", tag="q1")
+        cache.set(("q1", 2), "b", tag="q1")
+        cache.set(("q2", 1), "c", tag="q2")
+
+        # act
+        cache.invalidate_tag("q1")
+
+        # assert
+        self.assertIs(cache.get(("q1", 1)), MISSING)
+        self.assertIs(cache.get(("q1", 2)), MISSING)
+        self.assertEqual(cache.get(("q2", 1)), "c")
+        self.assertNotIn("q1", cache.tags)
+
+    def test_load_that_raced_an_invalidation_is_not_stored(self):
+        # arrange
+        cache = LruTtlCache("test", ttl_seconds=10, clock=self.clock)
+        generation = cache.generation
+        cache.invalidate_tag("q1")
+
+        # act
+        cache.set("a", "stale", tag="q1", generation=generation)
+
+        # assert
+        self.assertIs(cache.get("a"), MISSING)
+
+    def test_max_age_caps_the_ttl(self):
+        # arrange
+        cache = LruTtlCache("test", ttl_seconds=10, hard_ttl_seconds=60, clock=self.clock)
+        cache.set("a", 1, max_age_seconds=2)
+        self.clock.now = 3
+
+        # act
+        value = cache.get("a")
+
+        # assert
+        self.assertIs(value, MISSING)
+
+    def test_seconds_until_midnight(self):
+        # arrange
+        now = datetime(2025, 6, 1, 23, 59, 30, tzinfo=timezone.utc)
+
+        # act
+        seconds = seconds_until_midnight(now)
+
+        # assert
+        self.assertEqual(seconds, 30)
+
+    def test_seconds_until_midnight_in_the_database_timezone(self):
+        # arrange
+        now = datetime(2025, 6, 1, 9, 59, 30, tzinfo=timezone.utc)
+
+        # act
+        seconds = seconds_until_midnight(now, ZoneInfo("Pacific/Kiritimati"))
+
+        # assert
+        self.assertEqual(seconds, 30)
+
+    def test_seconds_until_midnight_across_a_dst_change(self):
+        # arrange
+        now = datetime(2025, 3, 30, 0, 0, tzinfo=ZoneInfo("Europe/Berlin"))
+
+        # act
+        seconds = seconds_until_midnight(now, ZoneInfo("Europe/Berlin"))
+
+        # assert
+        self.assertEqual(seconds, 23 * 3600)
+
+    def test_memory_stays_flat_for_many_distinct_keys(self):
+        # arrange
+        cache = LruTtlCache("test", ttl_seconds=10, max_entries=100, clock=self.clock)
+
+        # act
+        for i in range(10_000):
+            cache.set(f"metric-{i}", {"value": i})
+
+        # assert
+        self.assertEqual(cache.stats()["entries"], 100)
+        self.assertEqual(cache.stats()["evictions"], 9_900)
+
+
+def write_from_worker(path: str):
+    cache = SqliteSharedCacheBackend("test", path, ttl_seconds=10)
+    cache.set(("q1", 1), {"written_by": os.getpid()}, tag="q1")
+    cache.close()
+
+
+class PickledOn:
+    """
+    remembers the thread it was pickled on
+    """
+
+    def __init__(self):
+        self.thread = None
+
+    def __reduce__(self):
+        self.thread = threading.current_thread()
+        return PickledOn, ()
+
+
+class TestSqliteSharedCacheBackend(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "cache.sqlite3")
+        self.clock = FakeClock()
+
+    def worker(self, namespace: str = "test", **kwargs) -> SqliteSharedCacheBackend:
+        cache = SqliteSharedCacheBackend(namespace, self.path, ttl_seconds=10, clock=self.clock, **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_value_set_by_one_worker_is_read_by_another(self):
+        # arrange
+        first, second = self.worker(), self.worker()
+        first.set(("q1", date(2023, 1, 1)), [{"value": 1}])
+        first.flush()
+
+        # act
+        result = second.get(("q1", date(2023, 1, 1)))
+
+        # assert
+        self.assertEqual(result, [{"value": 1}])
+
+    def test_value_set_in_another_process_is_read(self):
+        # arrange
+        process = multiprocessing.get_context("fork").Process(target=write_from_worker, args=(self.path,))
+        process.start()
+        process.join()
+        cache = SqliteSharedCacheBackend("test", self.path, ttl_seconds=10)
+        self.addCleanup(cache.close)
+
+        # act
+        result = cache.get(("q1", 1))
+
+        # assert
+        self.assertEqual(result, {"written_by": process.pid})
+
+    def test_snapshots_survive_the_round_trip(self):
+        # arrange
+        first, second = self.worker(), self.worker()
+        configuration = MetricConfigurationSnapshot(
+            id="a",
+            query_id="q1",
+            is_editable=True,
+            query=QuerySnapshot(id="q1", query="SELECT 1"),
+            layouts=(LayoutSnapshot(breakpoint="lg", x=0, y=1, w=2, h=3, static=None),),
+            version="v1"
+        )
+        first.set(("a",), configuration)
+        first.flush()
+
+        # act
+        result = second.get(("a",))
+
+        # assert
+        self.assertEqual(result, configuration)
+
+    def test_invalidate_tag_drops_entries_for_every_worker(self):
+        # arrange
+        first, second = self.worker(), self.worker()
+        first.set(("q1", 1), "a", tag="q1")
+        first.set(("q2", 1), "b", tag="q2")
+        first.flush()
+
+        # act
+        second.invalidate_tag("q1")
+        second.flush()
+
+        # assert
+        self.assertIs(first.get(("q1", 1)), MISSING)
+        self.assertEqual(first.get(("q2", 1)), "b")
+
+    def test_load_that_raced_an_invalidation_in_another_worker_is_not_stored(self):
+        # arrange
+        first, second = self.worker(), self.worker()
+        generation = first.generation
+        second.invalidate("a")
+        second.flush()
+
+        # act
+        first.set("a", 1, generation=generation)
+        first.flush()
+
+        # assert
+        self.assertIs(second.get("a"), MISSING)
+
+    def test_namespaces_do_not_share_entries(self):
+        # arrange
+        records, aggregates = self.worker("records"), self.worker("aggregates")
+        records.set("a", 1)
+        records.flush()
+
+        # act
+        aggregates.clear()
+
+        # assert
+        self.assertEqual(records.get("a"), 1)
+        self.assertIs(aggregates.get("a"), MISSING)
+
+    def test_stale_entry_is_served_until_the_hard_ttl(self):
+        # arrange
+        cache = self.worker(hard_ttl_seconds=30)
+        cache.set("a", 1)
+        cache.flush()
+
+        # act
+        self.clock.now = 20
+        stale = cache.lookup("a")
+        self.clock.now = 30
+        expired = cache.lookup("a")
+
+        # assert
+        self.assertTrue(cache.is_stale(stale))
+        self.assertEqual(stale.value, 1)
+        self.assertIsNone(expired)
+
+    def test_least_recently_used_is_evicted_over_max_entries(self):
+        # arrange
+        cache = self.worker(max_entries=2)
+        cache.set("a", 1)
+        self.clock.now = 1
+        cache.set("b", 2)
+        cache.flush()
+        self.clock.now = 2
+        cache.get("a")
+
+        # act
+        self.clock.now = 3
+        cache.set("c", 3)
+        cache.flush()
+
+        # assert
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIs(cache.get("b"), MISSING)
+        self.assertEqual(cache.stats()["entries"], 2)
+
+    def test_sweep_drops_expired_entries_without_reads(self):
+        # arrange
+        cache = self.worker()
+        cache.set("a", 1)
+        self.clock.now = 5
+        cache.set("b", 2)
+        self.clock.now = 12
+
+        # act
+        expired = cache.sweep()
+
+        # assert
+        self.assertEqual(expired, 1)
+        self.assertEqual(cache.stats()["entries"], 1)
+
+    def test_a_locked_database_delays_writes_without_blocking_the_caller(self):
+        # arrange
+        cache = self.worker(busy_timeout_seconds=0.01)
+        cache.set("a", 1)
+        cache.flush()
+        lock = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(lock.close)
+        lock.execute("BEGIN EXCLUSIVE")
+
+        # act
+        started = time.perf_counter()
+        cache.set("b", 2)
+        missed = cache.get("b")
+        kept = cache.get("a")
+        elapsed = time.perf_counter() - started
+        lock.execute("ROLLBACK")
+        cache.flush()
+
+        # assert
+        self.assertLess(elapsed, 0.5)
+        self.assertIs(missed, MISSING)
+        self.assertEqual(kept, 1)
+        self.assertEqual(cache.get("b"), 2)
+
+    def test_an_invalidation_blocked_by_a_lock_is_applied_later(self):
+        # arrange
+        first, second = self.worker(busy_timeout_seconds=0.01), self.worker()
+        first.set("a", 1, tag="q1")
+        first.set("b", 2, tag="q2")
+        first.flush()
+        lock = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(lock.close)
+        lock.execute("BEGIN IMMEDIATE")
+
+        # act
+        first.invalidate_tag("q1")
+        hidden = first.get("a")
+        kept = first.get("b")
+        lock.execute("ROLLBACK")
+        first.flush()
+
+        # assert
+        self.assertIs(hidden, MISSING)
+        self.assertEqual(kept, 2)
+        self.assertIs(second.get("a"), MISSING)
+        self.assertEqual(first.stats()["pending"], 0)
+
+    def test_values_are_pickled_off_the_calling_thread(self):
+        # arrange
+        cache = self.worker()
+        value = PickledOn()
+
+        # act
+        cache.set("a", value)
+        cache.flush()
+
+        # assert
+        self.assertIsNotNone(value.thread)
+        self.assertIsNot(value.thread, threading.current_thread())
+
+    def test_usage_is_kept_in_step_with_the_entries(self):
+        # arrange
+        first, second = self.worker(), self.worker()
+        first.set("a", "x", tag="q1")
+        first.set("b", "y" * 100, tag="q2")
+        first.set("a", "z" * 50, tag="q1")
+        first.flush()
+
+        # act
+        second.invalidate_tag("q2")
+        second.flush()
+
+        # assert
+        usage = sqlite3.connect(self.path).execute(
+            "SELECT COUNT(*), SUM(size) FROM cache_entries WHERE namespace = 'test'"
+        ).fetchone()
+        self.assertEqual((first.stats()["entries"], first.stats()["bytes"]), usage)
+        self.assertEqual(usage[0], 1)
+
+    def test_worker_behind_another_workers_invalidation_catches_up(self):
+        # arrange
+        first, second = self.worker(), self.worker()
+        second.invalidate("b")
+        second.flush()
+
+        # act
+        first.set("a", 1, generation=first.generation)
+        first.flush()
+        dropped = first.get("a")
+        first.set("a", 1, generation=first.generation)
+        first.flush()
+
+        # assert
+        self.assertIs(dropped, MISSING)
+        self.assertEqual(first.get("a"), 1)
+
+    def test_configure_caches_moves_namespaces_onto_the_shared_backend(self):
+        # arrange
+        settings = SimpleNamespace(
+            CACHE_BACKEND="shared",
+            CACHE_SHARED_PATH=self.path,
+            CACHE_SHARED_BUSY_TIMEOUT_SECONDS=0.05,
+            CACHE_SOFT_TTL_SECONDS=10,
+            CACHE_HARD_TTL_SECONDS=20,
+            CACHE_MAX_ENTRIES=10,
+            CACHE_MAX_BYTES=10_000,
+            DB_TIMEZONE="UTC"
+        )
+        registered = dict(CACHE_REGISTRY)
+        self.addCleanup(CACHE_REGISTRY.update, registered)
+
+        # act
+        configure_caches(settings)
+
+        # assert
+        for cache in CACHE_REGISTRY.values():
+            self.addCleanup(cache.close)
+        shared = CACHE_REGISTRY[RECORDS_CACHE]
+        self.assertIsInstance(shared, SqliteSharedCacheBackend)
+        self.assertEqual(shared.max_entries, 10)
+
+
+class TestAsyncTtlCache(IsolatedAsyncioTestCase):
+
+    async def test_each_decorated_reader_has_its_own_namespace(self):
+        # arrange
+        class FirstReader:
+            logger = SilentLogger()
+
+            @async_ttl_cache(namespace="test_first_reader")
+            async def __call__(self, _id: str):
+                return "first"
+
+        class SecondReader:
+            logger = SilentLogger()
+
+            @async_ttl_cache(namespace="test_second_reader")
+            async def __call__(self, _id: str):
+                return "second"
+
+        # act
+        first = await FirstReader()("same-id")
+        second = await SecondReader()("same-id")
+
+        # assert
+        self.assertEqual(first, "first")
+        self.assertEqual(second, "second")
+        self.assertIn("test_first_reader", CACHE_REGISTRY)
+        self.assertIn("test_second_reader", CACHE_REGISTRY)
+
+    async def test_positional_and_keyword_calls_share_an_entry(self):
+        # arrange
+        calls = []
+
+        class Reader:
+            logger = SilentLogger()
+
+            @async_ttl_cache(namespace="test_keyword_reader")
+            async def __call__(self, _id: str):
+                calls.append(_id)
+                return _id
+
+        reader = Reader()
+
+        # act
+        await reader("a")
+        await reader(_id="a")
+
+        # assert
+        self.assertEqual(calls, ["a"])
+
+
+class TestSingleFlight(IsolatedAsyncioTestCase):
+
+    async def test_concurrent_calls_share_one_execution(self):
+        # arrange
+        flight = SingleFlight()
+        calls = []
+
+        async def action():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        # act
+        results = await asyncio.gather(*(flight("key", action) for _ in range(50)))
+
+        # assert
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["result"] * 50)
+
+    async def test_waiters_share_the_exception(self):
+        # arrange
+        flight = SingleFlight()
+
+        async def action():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        # act
+        results = await asyncio.gather(*(flight("key", action) for _ in range(5)), return_exceptions=True)
+
+        # assert
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual(flight.calls, {})
+
+    async def test_waiter_takes_over_when_the_caller_doing_the_work_is_cancelled(self):
+        # arrange
+        flight = SingleFlight()
+        calls = []
+
+        async def action():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        leader = asyncio.create_task(flight("key", action))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flight("key", action))
+        await asyncio.sleep(0)
+
+        # act
+        leader.cancel()
+        result = await waiter
+
+        # assert
+        self.assertEqual(result, "result")
+        self.assertEqual(len(calls), 2)
+
+
+def aggregate_row(_id: str) -> dict:
+    return {
+        "id": _id,
+        "query_id": "q1",
+        "is_editable": True,
+        "stored_query_id": "q1",
+        "stored_query": "SELECT 1",
+        "layouts": '[["lg", 0, 1, 2, 3, null]]'
+    }
+
+
+class TestReaderThunderingHerd(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        start_mappers()
+        CACHE_REGISTRY[AGGREGATES_CACHE].clear()
+        CACHE_REGISTRY[RECORDS_CACHE].clear()
+
+    async def test_aggregate_reader_runs_one_query_per_id(self):
+        # arrange
+        executed = []
+        ids = ["a", "b", "c"]
+        result = MagicMock()
+        result.mappings.return_value.one_or_none.return_value = aggregate_row("a")
+
+        def reader():
+            return SqlAlchemyMetricAggregateReader(CountingSession(executed, result), logger=SilentLogger())
+
+        # act
+        await asyncio.gather(*(reader()(_id=ids[i % 3]) for i in range(300)))
+
+        # assert
+        self.assertEqual(len(executed), len(ids))
+
+    async def test_aggregate_reader_caches_a_frozen_snapshot(self):
+        # arrange
+        result = MagicMock()
+        result.mappings.return_value.one_or_none.return_value = aggregate_row("a")
+        reader = SqlAlchemyMetricAggregateReader(CountingSession([], result), logger=SilentLogger())
+
+        # act
+        configuration = await reader(_id="a")
+
+        # assert
+        self.assertIsInstance(configuration, MetricConfigurationSnapshot)
+        self.assertEqual(configuration.layouts, (LayoutSnapshot(breakpoint="lg", x=0, y=1, w=2, h=3, static=None),))
+        self.assertIs(CACHE_REGISTRY[AGGREGATES_CACHE].get(("a",)), configuration)
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            configuration.is_editable = False
+
+    async def test_records_reader_runs_one_query_per_window(self):
+        # arrange
+        executed = []
+        result = MagicMock()
+        result.mappings.return_value.all.return_value = [{"value": 1}]
+        windows = [date(2025, 6, 1), date(2025, 6, 2)]
+
+        def reader():
+            return SqlAlchemyMetricRecordsReader(CountingSession(executed, result), logger=SilentLogger())
+
+        # act
+        records = await asyncio.gather(*(
+            reader()(
+                query=QuerySnapshot(id="q1", query="SELECT 1"),
+                start_date=windows[i % 2],
+                end_date=date(2025, 6, 30),
+                day_range=30
+            ) for i in range(200)
+        ))
+
+        # assert
+        self.assertEqual(len(executed), len(windows))
+        self.assertTrue(all(record_set.records == [{"value": 1}] for record_set in records))
+
+
+class TestRecordsCache(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        CACHE_REGISTRY[RECORDS_CACHE].clear()
+        self.executed = []
+        result = MagicMock()
+        result.mappings.return_value.all.return_value = [{"value": 1}]
+        self.reader = SqlAlchemyMetricRecordsReader(CountingSession(self.executed, result), logger=SilentLogger())
+
+    async def read(self, query: QuerySnapshot):
+        return await self.reader(query=query, start_date=date(2025, 6, 1), end_date=date(2025, 6, 30), day_range=30)
+
+    async def test_repeat_reads_of_a_window_run_the_query_once(self):
+        # arrange
+        query = QuerySnapshot(id="q1", query="SELECT 1")
+
+        # act
+        await self.read(query)
+        await self.read(query)
+
+        # assert
+        self.assertEqual(len(self.executed), 1)
+
+    async def test_invalidating_a_query_id_reruns_its_query(self):
+        # arrange
+        query = QuerySnapshot(id="q1", query="SELECT 1")
+        other = QuerySnapshot(id="q2", query="SELECT 2")
+        await self.read(query)
+        await self.read(other)
+
+        # act
+        await LocalMetricCacheInvalidator().invalidate_records("q1")
+        await self.read(query)
+        await self.read(other)
+
+        # assert
+        self.assertEqual(len(self.executed), 3)
+
+    async def test_relative_windows_expire_at_the_day_boundary(self):
+        # arrange
+        query = QuerySnapshot(id="q1", query="SELECT 1 WHERE date >= CURRENT_DATE - make_interval(days => :day_range)")
+
+        # act
+        await self.read(query)
+
+        # assert
+        entry = CACHE_REGISTRY[RECORDS_CACHE].entries[("q1", date(2025, 6, 1), date(2025, 6, 30), 30)]
+        remaining = entry.expires_at - CACHE_REGISTRY[RECORDS_CACHE].clock()
+        self.assertLessEqual(remaining, seconds_until_midnight())
+
+    async def test_windows_over_any_clock_function_expire_at_the_day_boundary(self):
+        for clock in ("now()", "CURRENT_TIMESTAMP", "localtimestamp", "current_time", "'today'::date"):
+            with self.subTest(clock=clock):
+                # arrange
+                CACHE_REGISTRY[RECORDS_CACHE].clear()
+                query = QuerySnapshot(id="q1", query=f"SELECT 1 WHERE at >= {clock} - make_interval(days => :day_range)")
+
+                # act
+                await self.read(query)
+
+                # assert
+                entry = CACHE_REGISTRY[RECORDS_CACHE].entries[("q1", date(2025, 6, 1), date(2025, 6, 30), 30)]
+                self.assertLessEqual(entry.expires_at - CACHE_REGISTRY[RECORDS_CACHE].clock(), seconds_until_midnight())
+
+
+class CountingGetMetrics:
+    """
+    stands in for GetMetricsService, a record write lands while the metrics are being read when one is given
+    """
+
+    def __init__(self, during_read=None):
+        self.calls = 0
+        self.during_read = during_read
+        query = QuerySnapshot(id="q1", query="SELECT 1")
+        self.configuration = MetricConfigurationSnapshot(
+            id="a", query_id=query.id, is_editable=False, query=query, layouts=(), version="v1"
+        )
+
+    async def __call__(self, **_) -> Metrics:
+        self.calls += 1
+        if self.during_read is not None:
+            self.during_read()
+        return Metrics(configuration=self.configuration, record_set=RecordSet(records=[], version=str(self.calls)))
+
+
+class TestEncodedResponses(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        CACHE_REGISTRY[RESPONSES_CACHE].clear()
+        self.tracker = DecayingAccessTracker(SimpleNamespace(PREFETCH_HALF_LIFE_SECONDS=60, PREFETCH_MAX_TRACKED=10))
+        self.encoded = []
+
+    def service(self, get_metrics: CountingGetMetrics) -> GetEncodedMetricsService:
+        return GetEncodedMetricsService(get_metrics, LruEncodedResponseCache(SilentLogger()), self.tracker)
+
+    def encode(self, metrics: Metrics) -> bytes:
+        self.encoded.append(metrics)
+        return metrics.content_version.encode()
+
+    async def request(self, service: GetEncodedMetricsService, representation: str = "rows"):
+        return await service(
+            _id="a",
+            start_date=DEFAULT_START_DATE,
+            end_date=DEFAULT_END_DATE,
+            day_range=DEFAULT_DAY_RANGE,
+            representation=representation,
+            encode=self.encode
+        )
+
+    async def test_repeat_requests_are_sent_from_the_encoded_body(self):
+        # arrange
+        get_metrics = CountingGetMetrics()
+        service = self.service(get_metrics)
+
+        # act
+        first = await self.request(service)
+        second = await self.request(service)
+
+        # assert
+        self.assertIs(second, first)
+        self.assertEqual((get_metrics.calls, len(self.encoded)), (1, 1))
+        self.assertEqual(first.version, "v1-1-rows")
+        self.assertAlmostEqual(self.tracker.score(("a", DEFAULT_START_DATE, DEFAULT_END_DATE, DEFAULT_DAY_RANGE, None)), 1.0, 2)
+
+    async def test_representations_are_encoded_separately(self):
+        # arrange
+        service = self.service(CountingGetMetrics())
+
+        # act
+        rows = await self.request(service, "rows")
+        columns = await self.request(service, "columnar")
+
+        # assert
+        self.assertEqual(len(self.encoded), 2)
+        self.assertNotEqual(rows.version, columns.version)
+
+    async def test_record_writes_drop_the_encoded_body(self):
+        # arrange
+        get_metrics = CountingGetMetrics()
+        service = self.service(get_metrics)
+        first = await self.request(service)
+
+        # act
+        await LocalMetricCacheInvalidator().invalidate_records("q1")
+        second = await self.request(service)
+
+        # assert
+        self.assertEqual(get_metrics.calls, 2)
+        self.assertNotEqual(second.version, first.version)
+
+    async def test_body_encoded_while_records_were_written_is_not_kept(self):
+        # arrange
+        get_metrics = CountingGetMetrics(during_read=lambda: evict(query_id="q1"))
+        service = self.service(get_metrics)
+
+        # act
+        await self.request(service)
+        await self.request(service)
+
+        # assert
+        self.assertEqual(get_metrics.calls, 2)
+
+
+class SessionRecordingReader:
+    sessions = []
+
+    def __init__(self, session: AsyncSession, logger: Logger):
+        self.logger = logger
+        self.session = session
+
+    @async_ttl_cache(namespace="test_stale_reader", ttl_seconds=10)
+    async def __call__(self, _id: str):
+        await self.session.execute(text("SELECT 1"))
+        self.sessions.append(self.session)
+        return len(self.sessions)
+
+
+class TestStaleWhileRevalidate(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://")
+        self.clock = FakeClock()
+        self.cache = CACHE_REGISTRY["test_stale_reader"]
+        self.cache.clear()
+        self.cache.clock = self.clock
+        self.cache.configure(ttl_seconds=10, hard_ttl_seconds=30, max_entries=10, max_bytes=10_000)
+        SessionRecordingReader.sessions.clear()
+
+    async def asyncTearDown(self):
+        await REFRESHER.cancel()
+        await self.engine.dispose()
+
+    async def test_stale_entry_is_served_and_refreshed_on_its_own_session(self):
+        # arrange
+        async with AsyncSession(self.engine) as session:
+            reader = SessionRecordingReader(session, logger=SilentLogger())
+            await reader("a")
+            self.clock.now = 15
+
+            # act
+            stale = await reader("a")
+            await asyncio.gather(*REFRESHER.tasks)
+            refreshed = await reader("a")
+
+        # assert
+        self.assertEqual(stale, 1)
+        self.assertEqual(refreshed, 2)
+        self.assertIsNot(SessionRecordingReader.sessions[1], session)
+
+    async def test_response_encoded_from_a_stale_entry_is_not_kept(self):
+        # arrange
+        CACHE_REGISTRY[RESPONSES_CACHE].clear()
+        responses = LruEncodedResponseCache(SilentLogger())
+        query = QuerySnapshot(id="q1", query="SELECT 1")
+        async with AsyncSession(self.engine) as session:
+            reader = SessionRecordingReader(session, logger=SilentLogger())
+            await reader("a")
+            self.clock.now = 15
+
+            # act
+            generation = responses.generation()
+            await reader("a")
+            responses.put("stale", EncodedResponse(body=b"1", version="v1"), query, generation)
+            await asyncio.gather(*REFRESHER.tasks)
+            generation = responses.generation()
+            await reader("a")
+            responses.put("fresh", EncodedResponse(body=b"2", version="v2"), query, generation)
+
+        # assert
+        self.assertIsNone(responses.get("stale"))
+        self.assertEqual(responses.get("fresh").body, b"2")
+
+    async def test_expired_entry_is_loaded_inline(self):
+        # arrange
+        async with AsyncSession(self.engine) as session:
+            reader = SessionRecordingReader(session, logger=SilentLogger())
+            await reader("a")
+            self.clock.now = 30
+
+            # act
+            value = await reader("a")
+
+        # assert
+        self.assertEqual(value, 2)
+        self.assertEqual(REFRESHER.tasks, set())
+
+
+class GatedReader:
+    loads = 0
+
+    def __init__(self, logger: Logger, gate: asyncio.Event):
+        self.logger = logger
+        self.gate = gate
+
+    @async_ttl_cache(namespace="test_gated_reader", ttl_seconds=10)
+    async def __call__(self, _id: str):
+        GatedReader.loads += 1
+        version = GatedReader.loads
+        await self.gate.wait()
+        return version
+
+
+class TestReadYourWrites(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        CACHE_REGISTRY["test_gated_reader"].clear()
+        GatedReader.loads = 0
+
+    async def test_call_after_an_invalidation_does_not_join_a_load_started_before_it(self):
+        # arrange
+        gate = asyncio.Event()
+        reader = GatedReader(SilentLogger(), gate)
+        self.addCleanup(gate.set)
+        before_write = asyncio.create_task(reader("a"))
+        await wait_until(lambda: GatedReader.loads == 1)
+
+        # act
+        CACHE_REGISTRY["test_gated_reader"].invalidate("a")
+        after_write = asyncio.create_task(reader("a"))
+        await wait_until(lambda: GatedReader.loads == 2)
+        gate.set()
+        results = await asyncio.gather(before_write, after_write)
+
+        # assert
+        self.assertEqual(results, [1, 2])
+        self.assertEqual(await reader("a"), 2)
+
+
+class TestBackgroundRefresher(IsolatedAsyncioTestCase):
+
+    async def test_refreshes_over_the_limit_are_skipped(self):
+        # arrange
+        refresher = BackgroundRefresher(max_concurrent=2)
+        release = asyncio.Event()
+
+        async def refresh():
+            await release.wait()
+
+        # act
+        scheduled = [refresher.schedule(key, refresh, SilentLogger()) for key in ("a", "b", "c")]
+        duplicate = refresher.schedule("a", refresh, SilentLogger())
+        release.set()
+        await asyncio.gather(*refresher.tasks)
+
+        # assert
+        self.assertEqual(scheduled, [True, True, False])
+        self.assertFalse(duplicate)
+        self.assertEqual(refresher.pending, set())
+
+
+async def wait_until(condition, timeout: float = 5):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.01)
+
+
+class TestPostgresCacheInvalidation(FastApiTestCase):
+
+    def setUp(self):
+        self.settings = self.client.app.state.services[Settings].copy(
+            update={"CACHE_INVALIDATION_RECONNECT_SECONDS": 0.1}
+        )
+        self.records = CACHE_REGISTRY[RECORDS_CACHE]
+        self.aggregates = CACHE_REGISTRY[AGGREGATES_CACHE]
+        self.records.clear()
+        self.aggregates.clear()
+
+    async def listen(self) -> PostgresCacheInvalidationListener:
+        listener = PostgresCacheInvalidationListener(self.settings, SilentLogger())
+        await listener.start()
+        await asyncio.wait_for(listener.listening.wait(), timeout=5)
+        return listener
+
+    def test_published_invalidation_evicts_entries_once_committed(self):
+        async def scenario():
+            # arrange
+            self.records.set(("q1", 1), [{"value": 1}], tag="q1")
+            self.records.set(("q2", 1), [{"value": 2}], tag="q2")
+            self.aggregates.set(("c1",), None, tag="c1")
+            listener = await self.listen()
+            engine = create_async_engine(self.settings.DATABASE_URL, poolclass=NullPool)
+
+            # act
+            async with AsyncSession(engine) as session:
+                publish = SqlAlchemyCacheInvalidationPublisher(session)
+                await publish(config_id="c1", query_id="q1")
+                await asyncio.sleep(0.2)
+                cached_before_commit = self.records.get(("q1", 1))
+                await session.commit()
+            await wait_until(lambda: self.records.get(("q1", 1)) is MISSING)
+
+            # assert
+            self.assertEqual(cached_before_commit, [{"value": 1}])
+            self.assertIs(self.aggregates.get(("c1",)), MISSING)
+            self.assertEqual(self.records.get(("q2", 1)), [{"value": 2}])
+            await listener.stop()
+            await engine.dispose()
+
+        asyncio.run(scenario())
+
+    def test_caches_are_cleared_after_the_listener_reconnects(self):
+        async def scenario():
+            # arrange
+            listener = await self.listen()
+            self.records.set(("q1", 1), [{"value": 1}], tag="q1")
+            engine = create_async_engine(self.settings.DATABASE_URL, poolclass=NullPool)
+
+            # act
+            async with engine.connect() as connection:
+                await connection.execute(text(
+                    "SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+                    "WHERE query LIKE 'LISTEN%' AND pid <> pg_backend_pid()"
+                ))
+            await wait_until(lambda: not listener.listening.is_set())
+            await asyncio.wait_for(listener.listening.wait(), timeout=5)
+
+            # assert
+            self.assertIs(self.records.get(("q1", 1)), MISSING)
+            await listener.stop()
+            await engine.dispose()
+
+        asyncio.run(scenario())
+
+
+class TestCacheWarmer(FastApiTestCase):
+
+    def setUp(self):
+        self.settings = self.client.app.state.services[Settings]
+        CACHE_REGISTRY[AGGREGATES_CACHE].clear()
+        CACHE_REGISTRY[RECORDS_CACHE].clear()
+
+    def test_warm_up_loads_every_configuration_in_one_query_and_runs_the_default_window(self):
+        async def scenario():
+            # arrange
+            pool = SqlAlchemyConnectionPool(self.settings, SilentLogger())
+            statements = []
+            event.listen(
+                pool.engine.sync_engine,
+                "before_cursor_execute",
+                lambda connection, cursor, statement, *args: statements.append(statement)
+            )
+
+            # act
+            await CacheWarmer(self.settings, SilentLogger(), pool).start()
+            await pool.stop()
+
+            # assert
+            aggregate = CACHE_REGISTRY[AGGREGATES_CACHE].get(("def1fdce-dac9-4c5a-a4a1-d7cbd01f6ed6",))
+            self.assertEqual(aggregate.id, "def1fdce-dac9-4c5a-a4a1-d7cbd01f6ed6")
+            self.assertEqual(len(aggregate.layouts), 2)
+            record_set = CACHE_REGISTRY[RECORDS_CACHE].get(
+                (aggregate.query_id, DEFAULT_START_DATE, DEFAULT_END_DATE, DEFAULT_DAY_RANGE)
+            )
+            self.assertIsNot(record_set, MISSING)
+            configuration_reads = [statement for statement in statements if "FROM metric_configurations" in statement]
+            self.assertEqual(len(configuration_reads), 1)
+
+        asyncio.run(scenario())
+
+    def test_warm_up_stops_at_the_time_budget(self):
+        async def scenario():
+            # arrange
+            settings = self.settings.copy(update={"CACHE_WARM_UP_BUDGET_SECONDS": 0})
+            pool = SqlAlchemyConnectionPool(settings, SilentLogger())
+            logger = RecordingLogger()
+
+            # act
+            await CacheWarmer(settings, logger, pool).start()
+            await pool.stop()
+
+            # assert
+            self.assertIn("Cache warm up ran out of time", logger.messages)
+
+        asyncio.run(scenario())
+
+
+class TestDatabaseTimezone(FastApiTestCase):
+
+    def test_sessions_are_pinned_to_the_configured_timezone(self):
+        async def scenario():
+            # arrange
+            settings = self.client.app.state.services[Settings].copy(
+                update={"DB_TIMEZONE": "Pacific/Kiritimati", "DB_POOL_ENABLED": False}
+            )
+            pool = SqlAlchemyConnectionPool(settings, SilentLogger())
+
+            # act
+            async with pool.engine.connect() as connection:
+                zone, today = (await connection.execute(text("SELECT current_setting('TimeZone'), CURRENT_DATE"))).one()
+            await pool.stop()
+
+            # assert
+            self.assertEqual(zone, "Pacific/Kiritimati")
+            self.assertEqual(today, datetime.now(ZoneInfo("Pacific/Kiritimati")).date())
+
+        asyncio.run(scenario())
+
+
+class TestDecayingAccessTracker(TestCase):
+
+    def setUp(self):
+        self.tracker = DecayingAccessTracker(SimpleNamespace(PREFETCH_HALF_LIFE_SECONDS=10, PREFETCH_MAX_TRACKED=3))
+        self.clock = FakeClock()
+        self.tracker.clock = self.clock
+
+    def read(self, _id: str, times: int = 1):
+        for _ in range(times):
+            self.tracker.record(_id, DEFAULT_START_DATE, DEFAULT_END_DATE, DEFAULT_DAY_RANGE)
+
+    def test_counts_halve_every_half_life(self):
+        # arrange
+        self.read("a", times=4)
+
+        # act
+        self.clock.now = 20
+
+        # assert
+        self.assertAlmostEqual(self.tracker.score(("a", DEFAULT_START_DATE, DEFAULT_END_DATE, DEFAULT_DAY_RANGE, None)), 1.0)
+
+    def test_hottest_favours_recent_reads(self):
+        # arrange
+        self.read("old", times=5)
+        self.clock.now = 30
+        self.read("new", times=2)
+        self.read("rare")
+
+        # act
+        hottest = self.tracker.hottest(2)
+
+        # assert
+        self.assertEqual([window[0] for window in hottest], ["new", "rare"])
+
+    def test_cold_windows_age_out(self):
+        # arrange
+        self.read("a")
+        self.clock.now = 40
+        self.read("b")
+
+        # act
+        self.tracker.prune()
+
+        # assert
+        self.assertEqual([window[0] for window in self.tracker.counts], ["b"])
+
+    def test_tracked_windows_are_bounded(self):
+        # arrange
+        self.read("a", times=3)
+        self.read("b", times=2)
+        self.read("c", times=4)
+
+        # act
+        self.read("d")
+
+        # assert
+        self.assertEqual(sorted(window[0] for window in self.tracker.counts), ["a", "c"])
+
+    def test_window_read_at_capacity_prunes_down_to_the_low_water_mark(self):
+        # arrange
+        tracker = DecayingAccessTracker(SimpleNamespace(PREFETCH_HALF_LIFE_SECONDS=10, PREFETCH_MAX_TRACKED=100))
+        tracker.clock = self.clock
+        for day_range in range(100):
+            tracker.record("warm", DEFAULT_START_DATE, DEFAULT_END_DATE, day_range)
+
+        # act
+        tracked = []
+        for day_range in range(100, 111):
+            tracker.record("warm", DEFAULT_START_DATE, DEFAULT_END_DATE, day_range)
+            tracked.append(len(tracker.counts))
+
+        # assert
+        self.assertEqual(tracked, list(range(90, 101)))
+
+
+class TestHotMetricPrefetcher(FastApiTestCase):
+
+    def setUp(self):
+        self.settings = self.client.app.state.services[Settings]
+        CACHE_REGISTRY[AGGREGATES_CACHE].clear()
+        CACHE_REGISTRY[RECORDS_CACHE].clear()
+
+    def test_hot_windows_are_refreshed_before_they_go_stale(self):
+        async def scenario():
+            # arrange
+            pool = SqlAlchemyConnectionPool(self.settings, SilentLogger())
+            tracker = DecayingAccessTracker(self.settings)
+            prefetcher = HotMetricPrefetcher(self.settings, SilentLogger(), pool, tracker)
+            tracker.record("def1fdce-dac9-4c5a-a4a1-d7cbd01f6ed6", DEFAULT_START_DATE, DEFAULT_END_DATE, 7)
+
+            # act
+            refreshed = await prefetcher.prefetch()
+            refreshed_while_fresh = await prefetcher.prefetch()
+            await pool.stop()
+
+            # assert
+            aggregate = CACHE_REGISTRY[AGGREGATES_CACHE].get(("def1fdce-dac9-4c5a-a4a1-d7cbd01f6ed6",))
+            self.assertEqual(refreshed, 1)
+            self.assertEqual(refreshed_while_fresh, 0)
+            self.assertIsNot(
+                CACHE_REGISTRY[RECORDS_CACHE].get((aggregate.query_id, DEFAULT_START_DATE, DEFAULT_END_DATE, 7)),
+                MISSING
+            )
+
+        asyncio.run(scenario())
+
+    def test_windows_read_column_by_column_are_refreshed_in_the_batch_cache(self):
+        async def scenario():
+            # arrange
+            CACHE_REGISTRY[RECORD_BATCHES_CACHE].clear()
+            pool = SqlAlchemyConnectionPool(self.settings, SilentLogger())
+            tracker = DecayingAccessTracker(self.settings)
+            prefetcher = HotMetricPrefetcher(self.settings, SilentLogger(), pool, tracker)
+            tracker.record("def1fdce-dac9-4c5a-a4a1-d7cbd01f6ed6", DEFAULT_START_DATE, DEFAULT_END_DATE, 7, batched=True)
+
+            # act
+            refreshed = await prefetcher.prefetch()
+            await pool.stop()
+
+            # assert
+            aggregate = CACHE_REGISTRY[AGGREGATES_CACHE].get(("def1fdce-dac9-4c5a-a4a1-d7cbd01f6ed6",))
+            window = (aggregate.query_id, DEFAULT_START_DATE, DEFAULT_END_DATE, 7)
+            self.assertEqual(refreshed, 1)
+            self.assertIsNot(CACHE_REGISTRY[RECORD_BATCHES_CACHE].get(window), MISSING)
+            self.assertIs(CACHE_REGISTRY[RECORDS_CACHE].get(window), MISSING)
+
+        asyncio.run(scenario())
+
@@ -0,0 +1,159 @@
+import gzip
+import json
+from unittest import TestCase
+
+import brotli
+import zstandard
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from src.web.compression import negotiate, CompressionMiddleware, CompressionSettings, content_coding, \
+    compressed_body, encoded_headers
+
+SETTINGS = CompressionSettings(minimum_size=100)
+BODY = json.dumps([{"alert_type": "Warning", "total_alerts": n} for n in range(200)]).encode()
+DECOMPRESS = {
+    "gzip": gzip.decompress,
+    "br": brotli.decompress,
+    "zstd": lambda body: zstandard.ZstdDecompressor().decompressobj().decompress(body),
+}
+
+
+async def batches():
+    for n in range(3):
+        yield json.dumps({"batch": n, "records": ["Warning"] * 50}).encode() + b"\n"
+
+
+def app_with(settings: CompressionSettings) -> TestClient:
+    routes = [
+        Route("/large", lambda _: Response(BODY, media_type="application/json", headers={"ETag": '"v1"'})),
+        Route("/small", lambda _: Response(b'{"ok":true}', media_type="application/json")),
+        Route("/stream", lambda _: StreamingResponse(batches(), media_type="application/x-ndjson")),
+        Route("/encoded", lambda _: Response(
+            gzip.compress(BODY), media_type="application/json", headers={"Content-Encoding": "gzip"}
+        )),
+        Route("/binary", lambda _: Response(BODY, media_type="application/octet-stream")),
+    ]
+    app = Starlette(routes=routes)
+    app.add_middleware(CompressionMiddleware, settings_factory=lambda: settings)
+    return TestClient(app)
+
+
+class TestNegotiation(TestCase):
+
+    def test_highest_weighted_coding_is_chosen(self):
+        # act & assert
+        self.assertEqual(negotiate("gzip;q=1.0, br;q=0.5"), "gzip")
+
+    def test_equal_weights_prefer_zstd_then_brotli(self):
+        # act & assert
+        self.assertEqual(negotiate("gzip, br, zstd"), "zstd")
+        self.assertEqual(negotiate("gzip, deflate, br"), "br")
+
+    def test_refused_and_unknown_codings_fall_back_to_identity(self):
+        # act & assert
+        self.assertIsNone(negotiate("gzip;q=0, deflate"))
+        self.assertIsNone(negotiate(None))
+
+    def test_wildcard_covers_codings_not_named(self):
+        # act & assert
+        self.assertEqual(negotiate("*, zstd;q=0"), "br")
+
+
+class TestCompressionMiddleware(TestCase):
+
+    def setUp(self):
+        self.client = app_with(SETTINGS)
+
+    def raw(self, path: str, accept_encoding: str):
+        with self.client.stream("GET", path, headers={"Accept-Encoding": accept_encoding}) as response:
+            return response, b"".join(response.iter_raw())
+
+    def test_body_is_compressed_in_the_negotiated_coding(self):
+        for coding, decompress in DECOMPRESS.items():
+            with self.subTest(coding=coding):
+                # act
+                response, body = self.raw("/large", coding)
+
+                # assert
+                self.assertEqual(response.headers["Content-Encoding"], coding)
+                self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+                self.assertEqual(response.headers["ETag"], 'W/"v1"')
+                self.assertEqual(int(response.headers["Content-Length"]), len(body))
+                self.assertLess(len(body), len(BODY))
+                self.assertEqual(decompress(body), BODY)
+
+    def test_bodies_below_the_minimum_size_are_sent_as_they_are(self):
+        # act
+        response, body = self.raw("/small", "gzip")
+
+        # assert
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(body, b'{"ok":true}')
+
+    def test_streams_are_compressed_chunk_by_chunk(self):
+        # arrange
+        chunks = []
+
+        # act
+        with self.client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as response:
+            for chunk in response.iter_raw():
+                chunks.append(chunk)
+
+        # assert
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", response.headers)
+        self.assertEqual(gzip.decompress(b"".join(chunks)).count(b"\n"), 3)
+
+    def test_encoded_and_binary_bodies_are_left_alone(self):
+        # act
+        encoded, encoded_body = self.raw("/encoded", "br")
+        binary, binary_body = self.raw("/binary", "br")
+
+        # assert
+        self.assertEqual(encoded.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(encoded_body), BODY)
+        self.assertNotIn("Content-Encoding", binary.headers)
+        self.assertEqual(binary_body, BODY)
+
+    def test_disabled_compression_sends_identity(self):
+        # arrange
+        client = app_with(CompressionSettings(enabled=False))
+
+        # act
+        with client.stream("GET", "/large", headers={"Accept-Encoding": "gzip"}) as response:
+            body = b"".join(response.iter_raw())
+
+        # assert
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(body, BODY)
+
+
+class TestCompressedBody(TestCase):
+
+    def test_each_coding_is_compressed_once(self):
+        # arrange
+        variants = {}
+        coding = content_coding(len(BODY), "br", SETTINGS)
+
+        # act
+        first = compressed_body(BODY, variants, coding, SETTINGS)
+        second = compressed_body(BODY, variants, coding, SETTINGS)
+
+        # assert
+        self.assertEqual(coding, "br")
+        self.assertIs(second, first)
+        self.assertEqual(brotli.decompress(first), BODY)
+
+    def test_bodies_below_the_minimum_size_keep_the_strong_etag(self):
+        # act
+        coding = content_coding(99, "br", SETTINGS)
+
+        # assert
+        self.assertIsNone(coding)
+        self.assertEqual(
+            encoded_headers({"ETag": '"v1"'}, coding),
+            {"ETag": '"v1"', "Vary": "Accept-Encoding"}
+        )
@@ -0,0 +1,148 @@
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from unittest import TestCase
+
+import numpy as np
+
+from src.core import RecordSet, RecordBatch, Downsampling
+from src.infrastructure.downsampling import NumpyRecordsDownsampler, lttb, time_buckets
+
+START = date(2025, 6, 1)
+
+
+def daily(values: list, **columns) -> RecordBatch:
+    days = tuple(START + timedelta(days=n) for n in range(len(values)))
+    return RecordBatch(
+        columns=("day", "total", *columns),
+        values=(days, tuple(values), *(tuple(column) for column in columns.values())),
+        version="v1"
+    )
+
+
+class TestLttb(TestCase):
+
+    def test_first_last_and_spikes_are_kept(self):
+        # arrange
+        x = np.arange(1000, dtype=np.float64)
+        y = np.zeros(1000)
+        y[[250, 700]] = [50.0, -80.0]
+
+        # act
+        selected = lttb(x, y, 10)
+
+        # assert
+        self.assertEqual(len(selected), 10)
+        self.assertEqual((selected[0], selected[-1]), (0, 999))
+        self.assertIn(250, selected)
+        self.assertIn(700, selected)
+        self.assertTrue(np.all(np.diff(selected) > 0))
+
+    def test_series_within_the_points_is_kept_whole(self):
+        # act
+        selected = lttb(np.arange(5.0), np.arange(5.0), 10)
+
+        # assert
+        self.assertEqual(selected.tolist(), [0, 1, 2, 3, 4])
+
+
+class TestTimeBuckets(TestCase):
+
+    def test_empty_buckets_are_left_out(self):
+        # arrange
+        x = np.array([0.0, 1.0, 2.0, 50.0, 99.0, 100.0])
+
+        # act
+        starts = time_buckets(x, 4)
+
+        # assert
+        self.assertEqual(starts.tolist(), [0, 3, 4])
+
+
+class TestNumpyRecordsDownsampler(TestCase):
+
+    def setUp(self):
+        self.downsample = NumpyRecordsDownsampler()
+
+    def test_lttb_keeps_whole_rows_in_query_order(self):
+        # arrange
+        values = [n % 10 for n in range(100)]
+        values[42] = 1000
+        batch = daily(values)
+
+        # act
+        downsampled = self.downsample(batch, 10, Downsampling.lttb)
+
+        # assert
+        records = downsampled.records
+        self.assertEqual(len(records), 10)
+        self.assertIn({"day": START + timedelta(days=42), "total": 1000}, records)
+        self.assertEqual(records, sorted(records, key=lambda record: record["day"]))
+        self.assertEqual(downsampled.version, "v1-lttb10")
+
+    def test_each_series_is_downsampled_on_its_own(self):
+        # arrange
+        record_set = RecordSet(
+            records=[
+                {"alert_type": "Critical" if n % 2 else "Warning", "day": START + timedelta(days=n // 2), "total": n}
+                for n in range(200)
+            ],
+            version="v1"
+        )
+
+        # act
+        downsampled = self.downsample(record_set, 5, Downsampling.lttb)
+
+        # assert
+        alert_types = [record["alert_type"] for record in downsampled.records]
+        self.assertEqual(alert_types.count("Critical"), 5)
+        self.assertEqual(alert_types.count("Warning"), 5)
+
+    def test_avg_averages_each_time_bucket(self):
+        # arrange
+        batch = daily(list(range(8)), cost=[Decimal("0.5"), None] * 4)
+
+        # act
+        downsampled = self.downsample(batch, 4, Downsampling.avg)
+
+        # assert
+        self.assertEqual(downsampled.records, [
+            {"day": START, "total": 0.5, "cost": Decimal("0.5")},
+            {"day": START + timedelta(days=2), "total": 2.5, "cost": Decimal("0.5")},
+            {"day": START + timedelta(days=4), "total": 4.5, "cost": Decimal("0.5")},
+            {"day": START + timedelta(days=6), "total": 6.5, "cost": Decimal("0.5")},
+        ])
+
+    def test_min_and_max_keep_the_values_as_read(self):
+        # arrange
+        batch = daily([3, 1, None, 7, 5, 2], cost=[Decimal(n) for n in "465132"])
+
+        # act
+        lowest = self.downsample(batch, 3, Downsampling.min)
+        highest = self.downsample(batch, 3, Downsampling.max)
+
+        # assert
+        self.assertEqual(lowest.values[1:], ((1, 7, 2), (Decimal(4), Decimal(1), Decimal(2))))
+        self.assertEqual(highest.values[1:], ((3, 7, 5), (Decimal(6), Decimal(5), Decimal(3))))
+
+    def test_datetimes_are_placed_by_time(self):
+        # arrange
+        at = tuple(
+            datetime(2025, 6, 1, tzinfo=timezone.utc) + timedelta(hours=n if n < 6 else 90 + n) for n in range(12)
+        )
+        batch = RecordBatch(columns=("at", "total"), values=(at, tuple(range(12))), version="v1")
+
+        # act
+        downsampled = self.downsample(batch, 4, Downsampling.max)
+
+        # assert
+        self.assertEqual(downsampled.values[1], (5, 11))
+
+    def test_records_within_max_points_are_returned_as_they_are(self):
+        # arrange
+        record_set = RecordSet(records=[{"alert_type": "Critical", "total_alerts": 1}], version="v1")
+
+        # act
+        downsampled = self.downsample(record_set, 3, Downsampling.lttb)
+
+        # assert
+        self.assertIs(downsampled, record_set)
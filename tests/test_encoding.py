@@ -0,0 +1,246 @@
+import base64
+import json
+import uuid
+from datetime import date, datetime, timezone, time, timedelta
+from decimal import Decimal
+from unittest import TestCase
+
+from src.application.mappers import map_metrics_to_contract
+from src.core import Metrics, MetricConfigurationSnapshot, LayoutSnapshot, RecordBatch, RecordSet, RecordKey
+from src.web.encoding import encode_metrics, encode_records, encode_cursor, decode_cursor, encode_columnar_metrics, \
+    encode_row_metrics, decode_json_rows, UnpageableRecords
+from src.web.contracts import ColumnarMetricsResponse
+
+DEFAULT_UUID = "12345678-1234-5678-1234-567812345678"
+
+
+def metrics_for(batch: RecordBatch | RecordSet) -> Metrics:
+    configuration = MetricConfigurationSnapshot(
+        id=DEFAULT_UUID,
+        query_id=DEFAULT_UUID,
+        is_editable=False,
+        query=None,
+        layouts=(
+            LayoutSnapshot(breakpoint="lg", x=0, y=1, w=2, h=3, static=True),
+            LayoutSnapshot(breakpoint="md", x=4, y=5, w=6, h=7, static=None)
+        ),
+        version="v1"
+    )
+    return Metrics(configuration=configuration, record_set=batch)
+
+
+class TestRecordBatchEncoding(TestCase):
+
+    def test_encoded_metrics_match_the_response_model(self):
+        # arrange
+        batch = RecordBatch(
+            columns=("day", "cost_avoided", "avg_per_day", "total", "alert_type", "at", "flag", "mixed", "ref"),
+            values=(
+                (date(2025, 7, 15), date(2025, 7, 16), None),
+                (80.25, float("inf"), 1e20),
+                (Decimal("7.50"), None, Decimal("1E+3")),
+                (1, 2, None),
+                ('say "hi"', "é\n", None),
+                (datetime(2025, 7, 15, 1, 2, 3, 500), datetime(2025, 7, 15, tzinfo=timezone.utc), None),
+                (True, False, None),
+                (1, "one", 1.5),
+                (uuid.UUID(DEFAULT_UUID), None, None),
+            ),
+            version="v2"
+        )
+        metrics = metrics_for(batch)
+
+        # act
+        encoded = encode_metrics(metrics)
+
+        # assert
+        self.assertEqual(json.loads(encoded), json.loads(map_metrics_to_contract(metrics).model_dump_json()))
+
+    def test_batch_encodes_the_same_bytes_as_the_rows_it_was_read_from(self):
+        # arrange
+        record_set = RecordSet(
+            records=[
+                {"day": date(2025, 7, 15), "ratio": 1e-05, "total": 1, "avg": Decimal("7.50"), "kind": 'say "hi"'},
+                {"day": date(2025, 7, 16), "ratio": 1e16, "total": None, "avg": None, "kind": "é"},
+                {"day": date(2025, 7, 17), "ratio": float("nan"), "total": 3, "avg": Decimal("1E+3"), "kind": None},
+                {"day": date(2025, 7, 18), "ratio": -2.5e-300, "total": 4, "avg": Decimal("0"), "kind": ""},
+            ],
+            version="v2"
+        )
+
+        # act
+        rows = encode_row_metrics(metrics_for(record_set))
+        batch = encode_metrics(metrics_for(record_set.to_batch()))
+
+        # assert
+        self.assertEqual(batch, rows)
+
+    def test_column_names_are_escaped(self):
+        # arrange
+        batch = RecordBatch(columns=('100% "done"',), values=((1,),), version="v1")
+
+        # act
+        encoded = encode_records(batch)
+
+        # assert
+        self.assertEqual(json.loads(encoded), [{'100% "done"': 1}])
+
+    def test_empty_batch_encodes_no_records(self):
+        # arrange
+        batch = RecordBatch(columns=(), values=(), version="v1")
+
+        # act
+        encoded = encode_metrics(metrics_for(batch))
+
+        # assert
+        self.assertEqual(json.loads(encoded)["records"], [])
+
+
+class TestRowEncoding(TestCase):
+
+    def test_encoded_rows_are_what_the_response_model_would_send(self):
+        # arrange
+        record_set = RecordSet(
+            records=[
+                {
+                    "day": date(2025, 7, 15),
+                    "at": datetime(2025, 7, 15, tzinfo=timezone.utc),
+                    "cost_avoided": 80.25,
+                    "avg_per_day": Decimal("7.50"),
+                    "ratio": float("nan"),
+                    "alert_type": 'say "hi" é',
+                    "ref": uuid.UUID(DEFAULT_UUID),
+                    "total": None,
+                },
+                {"day": date(2025, 7, 16), "flag": True, "total": 3},
+            ],
+            version="v2",
+            next_after=RecordKey(row=(("day", date(2025, 7, 16)), ("flag", True), ("total", 3)))
+        )
+        metrics = metrics_for(record_set)
+
+        # act
+        encoded = encode_row_metrics(metrics)
+
+        # assert
+        self.assertEqual(encoded, map_metrics_to_contract(metrics).model_dump_json().encode())
+
+
+class TestColumnarEncoding(TestCase):
+
+    def test_columns_hold_the_batch_values_in_order(self):
+        # arrange
+        batch = RecordBatch(
+            columns=("day", "avg_per_day"),
+            values=((date(2025, 7, 15), date(2025, 7, 16)), (Decimal("7.50"), None)),
+            version="v2"
+        )
+
+        # act
+        encoded = encode_columnar_metrics(metrics_for(batch))
+
+        # assert
+        response = ColumnarMetricsResponse.model_validate_json(encoded)
+        self.assertEqual(response.records.columns, ["day", "avg_per_day"])
+        self.assertEqual(response.records.data, {"day": ["2025-07-15", "2025-07-16"], "avg_per_day": ["7.50", None]})
+
+    def test_records_read_as_rows_are_turned_into_columns(self):
+        # arrange
+        record_set = RecordSet(records=[{"total": 1, "kind": "a"}, {"total": 2, "kind": "b"}], version="v2")
+
+        # act
+        encoded = encode_columnar_metrics(metrics_for(record_set))
+
+        # assert
+        self.assertEqual(
+            json.loads(encoded)["records"],
+            {"columns": ["total", "kind"], "data": {"total": [1, 2], "kind": ["a", "b"]}}
+        )
+
+    def test_no_records_encode_no_columns(self):
+        # arrange
+        record_set = RecordSet(records=[], version="v2")
+
+        # act
+        encoded = encode_columnar_metrics(metrics_for(record_set))
+
+        # assert
+        self.assertEqual(json.loads(encoded)["records"], {"columns": [], "data": {}})
+
+
+class TestCursorEncoding(TestCase):
+
+    def test_cursor_round_trips_the_record_key(self):
+        # arrange
+        after = RecordKey(row=(
+            ("day", date(2025, 6, 3)),
+            ("at", datetime(2025, 6, 3, 1, 2, 3)),
+            ("avg_per_day", Decimal("7.50")),
+            ("total", 2),
+            ("share", 0.5),
+            ("alert_type", "Warning"),
+            ("flag", True),
+            ("at_time", time(1, 2, 3, 4)),
+            ("elapsed", timedelta(days=-1, seconds=5, microseconds=6)),
+            ("ref", uuid.UUID(DEFAULT_UUID)),
+            ("raw", b"\x00\xff"),
+            ("missing", None),
+        ), seen=3)
+
+        # act
+        decoded = decode_cursor(encode_cursor(after))
+
+        # assert
+        self.assertEqual(decoded, after)
+        self.assertEqual([type(value) for _, value in decoded.row], [type(value) for _, value in after.row])
+
+    def test_a_value_without_a_cursor_type_cant_be_paged(self):
+        # arrange
+        after = RecordKey(row=(("parts", [1, 2]),))
+
+        # act / assert
+        with self.assertRaises(UnpageableRecords):
+            encode_cursor(after)
+
+    def test_a_cursor_without_a_count_is_past_one_record(self):
+        # arrange
+        cursor = base64.urlsafe_b64encode(json.dumps([["total", "i", 2]]).encode()).decode()
+
+        # act
+        decoded = decode_cursor(cursor)
+
+        # assert
+        self.assertEqual(decoded, RecordKey(row=(("total", 2),), seen=1))
+
+    def test_tampered_cursor_is_rejected(self):
+        # arrange
+        cursor = encode_cursor(RecordKey(row=(("total", 2),)))[:-4] + "!!!!"
+
+        # act & assert
+        with self.assertRaises(ValueError):
+            decode_cursor(cursor)
+
+
+class TestJsonRowDecoding(TestCase):
+
+    def test_ndjson_lines_that_arent_json_are_kept_as_errors(self):
+        # arrange
+        body = b'{"alert_type":"Critical"}\n{"alert_type":\n\n[1]\n'
+
+        # act
+        rows = decode_json_rows(body, ndjson=True)
+
+        # assert
+        self.assertEqual(rows[0], {"alert_type": "Critical"})
+        self.assertIsInstance(rows[1], ValueError)
+        self.assertEqual(rows[2], [1])
+        self.assertEqual(len(rows), 3)
+
+    def test_json_body_must_be_an_array(self):
+        # act & assert
+        self.assertEqual(decode_json_rows(b'[{"parts_flagged":1}]', ndjson=False), [{"parts_flagged": 1}])
+        with self.assertRaises(ValueError):
+            decode_json_rows(b'{"parts_flagged":1}', ndjson=False)
+        with self.assertRaises(ValueError):
+            decode_json_rows(b'[{"parts_flagged":', ndjson=False)
+
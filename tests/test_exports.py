@@ -0,0 +1,107 @@
+import asyncio
+import csv
+import io
+from datetime import date, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.pool import NullPool
+
+from src.core import QuerySnapshot, DEFAULT_START_DATE, DEFAULT_END_DATE, DEFAULT_DAY_RANGE, ExportFormat
+from src.infrastructure import Settings
+from src.infrastructure.exports import AsyncpgMetricRecordsExporter
+from tests import FastApiTestCase
+
+
+class SilentLogger:
+
+    def info(self, msg, *args, **kwargs): ...
+    def warning(self, msg, *args, **kwargs): ...
+    def error(self, msg, *args, **kwargs): ...
+
+
+class TestAsyncpgMetricRecordsExporter(FastApiTestCase):
+
+    def setUp(self):
+        self.settings = self.client.app.state.services[Settings]
+        self.query = QuerySnapshot(
+            id="export-q1",
+            query="SELECT n, CAST(n AS numeric) / 4 AS share, CAST(:start_date AS date) + n AS day, "
+                  "'kind ' || n AS kind, CAST(NULL AS text) AS missing "
+                  "FROM generate_series(1, 2500) AS n WHERE :day_range > 0 ORDER BY n"
+        )
+
+    async def export(self, query: QuerySnapshot, format: ExportFormat) -> bytes:
+        engine = create_async_engine(self.settings.DATABASE_URL, poolclass=NullPool)
+        async with AsyncSession(engine) as session:
+            export = AsyncpgMetricRecordsExporter(session, SilentLogger())
+            chunks = [
+                chunk async for chunk in export(
+                    query=query,
+                    start_date=DEFAULT_START_DATE,
+                    end_date=DEFAULT_END_DATE,
+                    day_range=DEFAULT_DAY_RANGE,
+                    format=format,
+                    batch_size=1000
+                )
+            ]
+        await engine.dispose()
+        return b"".join(chunks)
+
+    def test_arrow_stream_holds_a_record_batch_per_fetch(self):
+        async def scenario():
+            # act
+            body = await self.export(self.query, ExportFormat.arrow)
+
+            # assert
+            reader = pa.ipc.open_stream(body)
+            batches = list(reader)
+            self.assertEqual([batch.num_rows for batch in batches], [1000, 1000, 500])
+            self.assertEqual(
+                [field.type for field in reader.schema],
+                [pa.int32(), pa.float64(), pa.date32(), pa.string(), pa.string()]
+            )
+            self.assertEqual(
+                batches[-1].slice(499).to_pylist(),
+                [{"n": 2500, "share": 625.0, "day": date(2025, 6, 1) + timedelta(days=2500),
+                  "kind": "kind 2500", "missing": None}]
+            )
+
+        asyncio.run(scenario())
+
+    def test_parquet_file_holds_a_row_group_per_fetch(self):
+        async def scenario():
+            # act
+            body = await self.export(self.query, ExportFormat.parquet)
+
+            # assert
+            parquet = pq.ParquetFile(pa.BufferReader(body))
+            self.assertEqual(parquet.num_row_groups, 3)
+            self.assertEqual(parquet.read(columns=["n"]).column("n").to_pylist(), list(range(1, 2501)))
+
+        asyncio.run(scenario())
+
+    def test_csv_is_copied_from_queries_ending_in_a_semicolon(self):
+        async def scenario():
+            # arrange
+            query = QuerySnapshot(
+                id="export-q2",
+                query="-- three rows\n"
+                      "SELECT n, CAST(n AS numeric) / 3 AS share "
+                      "FROM generate_series(1, 3) AS n WHERE :day_range > 0 ORDER BY n;\n"
+            )
+
+            # act
+            body = await self.export(query, ExportFormat.csv)
+
+            # assert
+            rows = list(csv.reader(io.StringIO(body.decode())))
+            self.assertEqual(rows[0], ["n", "share"])
+            self.assertEqual(rows[1:], [
+                ["1", "0.33333333333333333333"],
+                ["2", "0.66666666666666666667"],
+                ["3", "1.00000000000000000000"]
+            ])
+
+        asyncio.run(scenario())
@@ -1,15 +1,17 @@
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from unittest import TestCase
 from unittest.mock import patch, Mock, MagicMock
 from uuid import UUID
 
-from src.application.mappers import map_metric_aggregate_to_contract, map_layout_to_contract, \
-    map_contract_layout_to_domain, map_metric_record_contract_to_domain, map_metric_configuration_contract_to_domain
-from src.core import LayoutItem, MetricConfigurationAggregate
+from src.application.mappers import map_metrics_to_contract, map_layout_to_contract, \
+    map_contract_layout_to_domain, map_metric_record_contract_to_domain, map_metric_configuration_contract_to_domain, \
+    map_ingest_record_contract_to_domain
+from src.core import LayoutItem, Metrics, MetricConfigurationSnapshot, QuerySnapshot, LayoutSnapshot, RecordSet
 from autofixture import AutoFixture
 
-from src.web.contracts import LayoutItemContract, CreateMetricRequest, CreateMetricConfigurationRequest
+from src.web.contracts import LayoutItemContract, CreateMetricRequest, CreateMetricConfigurationRequest, \
+    IngestMetricRecordRequest
 
 DEFAULT_UUID = "12345678-1234-5678-1234-567812345678"
 DEFAULT_DATETIME = datetime(2025, 8, 8, 12, 0, 0)
@@ -22,16 +24,44 @@ class TestMetricsMappers(TestCase):
 
     def test_map_to_response(self):
         # arrange
-        metric_aggregate = self.fixture.create(MetricConfigurationAggregate)
+        configuration = MetricConfigurationSnapshot(
+            id=DEFAULT_UUID,
+            query_id=DEFAULT_UUID,
+            is_editable=True,
+            query=QuerySnapshot(id=DEFAULT_UUID, query="SELECT 1"),
+            layouts=(
+                LayoutSnapshot(breakpoint="lg", x=0, y=1, w=2, h=3, static=False),
+                LayoutSnapshot(breakpoint="md", x=4, y=5, w=6, h=7, static=None)
+            ),
+            version="v1"
+        )
+        metrics = Metrics(configuration=configuration, record_set=RecordSet(records=[{"total": 1}], version="v2"))
 
         # act
-        response = map_metric_aggregate_to_contract(metric_aggregate)
+        response = map_metrics_to_contract(metrics)
 
         # assert
-        self.assertEqual(response.id, metric_aggregate.id)
-        self.assertEqual(response.records, metric_aggregate.records)
-        self.assertEqual(response.is_editable, metric_aggregate.is_editable)
-        self.assertEqual([layout.breakpoint for layout in response.layouts], [layout.breakpoint for layout in metric_aggregate.layouts])
+        self.assertEqual(response.id, configuration.id)
+        self.assertEqual(response.records, metrics.record_set.records)
+        self.assertEqual(response.is_editable, configuration.is_editable)
+        self.assertEqual([layout.breakpoint for layout in response.layouts], [layout.breakpoint for layout in configuration.layouts])
+
+    def test_map_to_response_does_not_change_the_cached_configuration(self):
+        # arrange
+        configuration = MetricConfigurationSnapshot(
+            id=DEFAULT_UUID, query_id=DEFAULT_UUID, is_editable=True, query=None, layouts=(), version="v1"
+        )
+        first = Metrics(configuration=configuration, record_set=RecordSet(records=[{"total": 1}], version="a"))
+        second = Metrics(configuration=configuration, record_set=RecordSet(records=[{"total": 2}], version="b"))
+
+        # act
+        first_response = map_metrics_to_contract(first)
+        second_response = map_metrics_to_contract(second)
+
+        # assert
+        self.assertEqual(first_response.records, [{"total": 1}])
+        self.assertEqual(second_response.records, [{"total": 2}])
+        self.assertFalse(hasattr(configuration, "records"))
 
     @patch("uuid.uuid4", return_value=UUID(DEFAULT_UUID))
     def test_map_metric_configuration_contract_to_domain(self, _):
@@ -147,4 +177,22 @@ class TestMetricRecordsMappers(TestCase):
         self.assertEqual(result.obsolescence, create_request.obsolescence)
         self.assertEqual(result.parts_flagged, create_request.parts_flagged)
         self.assertEqual(result.alert_type, create_request.alert_type)
-        self.assertEqual(result.alert_category, create_request.alert_category)
\ No newline at end of file
+        self.assertEqual(result.alert_category, create_request.alert_category)
+
+    def test_map_ingest_record_to_domain(self):
+        # arrange
+        taken = datetime(2025, 8, 8, 12, 0, 0, tzinfo=timezone.utc)
+        ingest_request = IngestMetricRecordRequest(
+            metric_configuration_id=UUID(DEFAULT_UUID), date=taken, parts_flagged=3, alert_type="Critical"
+        )
+        undated = IngestMetricRecordRequest(metric_configuration_id=UUID(DEFAULT_UUID))
+
+        # act
+        record = map_ingest_record_contract_to_domain(ingest_request, received=DEFAULT_DATETIME)
+        undated_record = map_ingest_record_contract_to_domain(undated, received=DEFAULT_DATETIME)
+
+        # assert
+        self.assertEqual(record.date, taken.astimezone().replace(tzinfo=None))
+        self.assertEqual((record.parts_flagged, record.alert_type, record.id), (3, "Critical", None))
+        self.assertEqual(undated_record.date, DEFAULT_DATETIME)
+        self.assertNotEqual(record.metric_id, undated_record.metric_id)
@@ -0,0 +1,573 @@
+import asyncio
+import dataclasses
+from uuid import uuid4
+from datetime import date, datetime
+from unittest import TestCase
+from unittest.mock import patch
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import text, event
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.pool import NullPool
+
+from src.core import QuerySnapshot, DEFAULT_START_DATE, DEFAULT_END_DATE, DEFAULT_DAY_RANGE, RecordBatch, \
+    MetricRecord, RecordDelta, MetricRecordRow, RecordKey
+from src.infrastructure.caching import MISSING, CACHE_REGISTRY, seconds_until_midnight, RECORDS_CACHE, \
+    RECORD_BATCHES_CACHE, evict, RECORD_SNAPSHOTS_CACHE
+from src.infrastructure import Settings
+from src.infrastructure.orm import start_mappers
+from src.infrastructure.readers import SqlAlchemyMetricRecordsReader, positional_statement, \
+    AsyncpgMetricRecordBatchReader, SqlAlchemyMetricRecordsStreamer, page_statement, \
+    SqlAlchemyMetricRecordsDeltaReader
+from src.infrastructure.writers import SqlAlchemyMetricRecordWriter, AsyncpgMetricRecordsBulkWriter
+from src.web.encoding import encode_cursor, decode_cursor
+from tests import FastApiTestCase
+
+
+class SilentLogger:
+
+    def info(self, msg, *args, **kwargs): ...
+    def warning(self, msg, *args, **kwargs): ...
+    def error(self, msg, *args, **kwargs): ...
+
+
+class TestPositionalStatement(TestCase):
+
+    def test_a_query_is_compiled_once(self):
+        # arrange
+        first = positional_statement("SELECT :day_range")
+
+        # act
+        second = positional_statement("SELECT :day_range")
+
+        # assert
+        self.assertIs(first, second)
+
+    def test_positional_sql_numbers_each_bind_once(self):
+        # act
+        compiled = positional_statement("SELECT CAST(:start_date AS date), :end_date, :start_date")
+
+        # assert
+        self.assertEqual(compiled.sql, "SELECT CAST($1 AS date), $2, $1")
+        self.assertEqual(compiled.parameters, ("start_date", "end_date"))
+
+
+class TestAsyncpgMetricRecordBatchReader(FastApiTestCase):
+
+    def setUp(self):
+        self.settings = self.client.app.state.services[Settings]
+        CACHE_REGISTRY[RECORDS_CACHE].clear()
+        CACHE_REGISTRY[RECORD_BATCHES_CACHE].clear()
+
+    async def read(self, reader_type: type, query: QuerySnapshot):
+        engine = create_async_engine(self.settings.DATABASE_URL, poolclass=NullPool)
+        async with AsyncSession(engine) as session:
+            reader = reader_type(session, SilentLogger())
+            result = await reader(query=query, start_date=DEFAULT_START_DATE, end_date=date(2025, 7, 31), day_range=7)
+        await engine.dispose()
+        return result
+
+    def test_batches_hold_the_same_records_as_the_orm_reader(self):
+        async def scenario():
+            # arrange
+            query = QuerySnapshot(
+                id="batch-q1",
+                query="SELECT date, obsolescence, parts_flagged, alert_type FROM metrics "
+                      "WHERE DATE(date) BETWEEN :start_date AND :end_date ORDER BY date, metric_id"
+            )
+
+            # act
+            record_set = await self.read(SqlAlchemyMetricRecordsReader, query)
+            batch = await self.read(AsyncpgMetricRecordBatchReader, query)
+
+            # assert
+            self.assertIsInstance(batch, RecordBatch)
+            self.assertEqual(batch.columns, ("date", "obsolescence", "parts_flagged", "alert_type"))
+            self.assertGreater(len(batch), 0)
+            self.assertEqual(batch.records, record_set.records)
+
+        asyncio.run(scenario())
+
+    def test_evicting_a_query_id_drops_its_batches(self):
+        async def scenario():
+            # arrange
+            query = QuerySnapshot(id="batch-q2", query="SELECT CAST(:day_range AS int) AS day_range")
+            await self.read(AsyncpgMetricRecordBatchReader, query)
+
+            # act
+            evict(query_id="batch-q2")
+
+            # assert
+            self.assertIs(
+                CACHE_REGISTRY[RECORD_BATCHES_CACHE].get(("batch-q2", DEFAULT_START_DATE, date(2025, 7, 31), 7)),
+                MISSING
+            )
+
+        asyncio.run(scenario())
+
+
+class TestSqlAlchemyMetricRecordsStreamer(FastApiTestCase):
+
+    def test_records_arrive_in_bounded_batches(self):
+        async def scenario():
+            # arrange
+            settings = self.client.app.state.services[Settings]
+            engine = create_async_engine(settings.DATABASE_URL, poolclass=NullPool)
+            query = QuerySnapshot(
+                id="stream-q1",
+                query="SELECT n FROM generate_series(1, 2500) AS n WHERE :day_range > 0 ORDER BY n"
+            )
+
+            # act
+            async with AsyncSession(engine) as session:
+                stream = SqlAlchemyMetricRecordsStreamer(session, SilentLogger())
+                batches = [
+                    records async for records in stream(
+                        query=query,
+                        start_date=DEFAULT_START_DATE,
+                        end_date=DEFAULT_END_DATE,
+                        day_range=DEFAULT_DAY_RANGE,
+                        batch_size=1000
+                    )
+                ]
+            await engine.dispose()
+
+            # assert
+            self.assertEqual([len(records) for records in batches], [1000, 1000, 500])
+            self.assertEqual(batches[-1][-1], {"n": 2500})
+
+        asyncio.run(scenario())
+
+
+class TestRecordPages(FastApiTestCase):
+
+    def setUp(self):
+        self.settings = self.client.app.state.services[Settings]
+        CACHE_REGISTRY[RECORDS_CACHE].clear()
+        self.query = QuerySnapshot(
+            id="page-q1",
+            query="-- every day of the window\n"
+                  "SELECT CAST(:start_date AS date) + n AS day, n % 2 AS parity "
+                  "FROM generate_series(0, 24) AS n;"
+        )
+
+    async def read_pages(self, session: AsyncSession, limit: int, query: QuerySnapshot = None) -> list:
+        reader = SqlAlchemyMetricRecordsReader(session, SilentLogger())
+        pages, after = [], None
+        while True:
+            page = await reader(
+                query=query or self.query,
+                start_date=DEFAULT_START_DATE,
+                end_date=DEFAULT_END_DATE,
+                day_range=DEFAULT_DAY_RANGE,
+                limit=limit,
+                after=after
+            )
+            pages.append(page)
+            if page.next_after is None:
+                return pages
+            after = page.next_after
+
+    def test_pages_hold_every_record_once_in_row_order(self):
+        async def scenario():
+            # arrange
+            engine = create_async_engine(self.settings.DATABASE_URL, poolclass=NullPool)
+
+            # act
+            async with AsyncSession(engine) as session:
+                pages = await self.read_pages(session, limit=10)
+            await engine.dispose()
+
+            # assert
+            days = [record["day"] for page in pages for record in page.records]
+            self.assertEqual([len(page.records) for page in pages], [10, 10, 5])
+            self.assertEqual(days, sorted(days))
+            self.assertEqual(len(set(days)), 25)
+            self.assertEqual(pages[0].next_after, RecordKey(row=(("day", date(2025, 6, 10)), ("parity", 1)), seen=1))
+
+        asyncio.run(scenario())
+
+    def test_pages_hold_rows_with_nulls_and_repeated_rows_across_a_page_boundary(self):
+        async def scenario():
+            # arrange
+            engine = create_async_engine(self.settings.DATABASE_URL, poolclass=NullPool)
+            query = QuerySnapshot(
+                id="page-q2",
+                query="SELECT CASE WHEN n % 3 = 0 THEN NULL ELSE n % 3 END AS bucket, "
+                      "CASE WHEN n % 4 = 0 THEN NULL ELSE n % 2 END AS parity "
+                      "FROM generate_series(0, 24) AS n "
+                      "WHERE CAST(:start_date AS date) <= CAST(:end_date AS date) AND :day_range > 0"
+            )
+
+            # act
+            async with AsyncSession(engine) as session:
+                pages = await self.read_pages(session, limit=4, query=query)
+                whole = await SqlAlchemyMetricRecordsReader(session, SilentLogger())(
+                    query, DEFAULT_START_DATE, DEFAULT_END_DATE, DEFAULT_DAY_RANGE
+                )
+            await engine.dispose()
+
+            # assert
+            records = [record for page in pages for record in page.records]
+            self.assertEqual(len(records), 25)
+            self.assertCountEqual(records, whole.records)
+            self.assertEqual(records[-1], {"bucket": None, "parity": None})
+
+        asyncio.run(scenario())
+
+    def test_pages_of_time_uuid_and_bytea_columns_follow_their_cursor(self):
+        async def scenario():
+            # arrange
+            engine = create_async_engine(self.settings.DATABASE_URL, poolclass=NullPool)
+            query = QuerySnapshot(
+                id="page-q4",
+                query="SELECT make_time(n, 0, 0) AS at, "
+                      "CAST(lpad(to_hex(n), 32, '0') AS uuid) AS ref, "
+                      "int4send(n) AS raw, make_interval(hours => n) AS elapsed "
+                      "FROM generate_series(0, 9) AS n "
+                      "WHERE CAST(:start_date AS date) <= CAST(:end_date AS date) AND :day_range > 0"
+            )
+
+            # act
+            async with AsyncSession(engine) as session:
+                reader = SqlAlchemyMetricRecordsReader(session, SilentLogger())
+                pages, after = [], None
+                while True:
+                    page = await reader(
+                        query=query,
+                        start_date=DEFAULT_START_DATE,
+                        end_date=DEFAULT_END_DATE,
+                        day_range=DEFAULT_DAY_RANGE,
+                        limit=4,
+                        after=after
+                    )
+                    pages.append(page)
+                    if page.next_after is None:
+                        break
+                    after = decode_cursor(encode_cursor(page.next_after))
+            await engine.dispose()
+
+            # assert
+            self.assertEqual([len(page.records) for page in pages], [4, 4, 2])
+            self.assertEqual([record["at"].hour for page in pages for record in page.records], list(range(10)))
+
+        asyncio.run(scenario())
+
+    def test_identical_rows_span_several_pages(self):
+        async def scenario():
+            # arrange
+            engine = create_async_engine(self.settings.DATABASE_URL, poolclass=NullPool)
+            query = QuerySnapshot(
+                id="page-q3",
+                query="SELECT n / 7 AS bucket FROM generate_series(0, 9) AS n "
+                      "WHERE CAST(:start_date AS date) <= CAST(:end_date AS date) AND :day_range > 0"
+            )
+
+            # act
+            async with AsyncSession(engine) as session:
+                pages = await self.read_pages(session, limit=3, query=query)
+            await engine.dispose()
+
+            # assert
+            self.assertEqual([[record["bucket"] for record in page.records] for page in pages], [
+                [0, 0, 0], [0, 0, 0], [0, 1, 1], [1]
+            ])
+            self.assertEqual([page.next_after.seen for page in pages[:-1]], [3, 6, 2])
+
+        asyncio.run(scenario())
+
+    def test_each_page_is_cached_on_its_own(self):
+        async def scenario():
+            # arrange
+            engine = create_async_engine(self.settings.DATABASE_URL, poolclass=NullPool)
+            async with AsyncSession(engine) as session:
+                await self.read_pages(session, limit=10)
+
+            # act
+            executed = []
+            event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: executed.append(args[2]))
+            async with AsyncSession(engine) as session:
+                await self.read_pages(session, limit=10)
+            await engine.dispose()
+
+            # assert
+            self.assertEqual(executed, [])
+
+        asyncio.run(scenario())
+
+
+class TestPageStatement(TestCase):
+
+    def test_later_pages_compare_columns_instead_of_offsetting(self):
+        # act
+        statement = page_statement("SELECT 1 AS \"a\"\"b\", 2 AS c;", ("a\"b", "c"))
+
+        # assert
+        self.assertIn(
+            'WHERE (page."a""b" > :page_after_0 OR page."a""b" IS NULL OR (page."a""b" = :page_after_0 AND '
+            '(page."c" > :page_after_1 OR page."c" IS NULL OR (page."c" = :page_after_1 AND true))))',
+            statement.text
+        )
+        self.assertIn("ORDER BY page.\"a\"\"b\", page.\"c\" LIMIT :page_limit OFFSET :page_skip", statement.text)
+        self.assertNotIn(";", statement.text)
+
+    def test_a_null_in_the_bound_row_only_matches_nulls(self):
+        # act
+        statement = page_statement("SELECT 1 AS a, 2 AS b", ("a", "b"), (True, False))
+
+        # assert
+        self.assertIn('WHERE page."a" IS NULL AND (page."b" > :page_after_1', statement.text)
+        self.assertNotIn(":page_after_0", statement.text)
+
+
+class TestSqlAlchemyMetricRecordsDeltaReader(FastApiTestCase):
+
+    def setUp(self):
+        self.settings = self.client.app.state.services[Settings]
+        self.snapshots = CACHE_REGISTRY[RECORD_SNAPSHOTS_CACHE]
+        self.snapshots.clear()
+        start_mappers()
+        query_id = f"delta-{uuid4()}"
+        self.query = QuerySnapshot(
+            id=query_id,
+            query=f"SELECT alert_type, COUNT(*) AS total FROM metrics "
+                  f"WHERE id = '{query_id}' AND :day_range > 0 AND date BETWEEN :start_date AND :end_date "
+                  f"GROUP BY alert_type ORDER BY alert_type"
+        )
+
+    async def write(self, engine, *alert_types: str):
+        async with AsyncSession(engine) as session:
+            write = SqlAlchemyMetricRecordWriter(session)
+            for alert_type in alert_types:
+                await write(MetricRecord(
+                    metric_id=str(uuid4()),
+                    id=self.query.id,
+                    date=datetime(2025, 6, 10),
+                    alert_type=alert_type
+                ))
+            await session.commit()
+
+    async def read(self, engine, query: QuerySnapshot, since: int) -> RecordDelta:
+        async with AsyncSession(engine) as session:
+            read = SqlAlchemyMetricRecordsDeltaReader(session, SilentLogger())
+            return await read(
+                query=query,
+                start_date=DEFAULT_START_DATE,
+                end_date=DEFAULT_END_DATE,
+                day_range=DEFAULT_DAY_RANGE,
+                since=since
+            )
+
+    def test_nothing_new_since_the_watermark_skips_the_stored_query(self):
+        async def scenario():
+            # arrange
+            engine = create_async_engine(self.settings.DATABASE_URL, poolclass=NullPool)
+            failing = dataclasses.replace(self.query, query="SELECT 1 / 0 AS never")
+
+            # act
+            delta = await self.read(engine, failing, since=0)
+            await engine.dispose()
+
+            # assert
+            self.assertEqual(delta, RecordDelta(records=[], removed=[], watermark=0))
+
+        asyncio.run(scenario())
+
+    def test_changed_records_are_sent_as_removed_and_added(self):
+        async def scenario():
+            # arrange
+            engine = create_async_engine(self.settings.DATABASE_URL, poolclass=NullPool)
+            await self.write(engine, "Critical", "Warning")
+            first = await self.read(engine, self.query, since=0)
+
+            # act
+            await self.write(engine, "Warning")
+            second = await self.read(engine, self.query, since=first.watermark)
+            unchanged = await self.read(engine, self.query, since=second.watermark)
+            await engine.dispose()
+
+            # assert
+            self.assertEqual(first.records, [{"alert_type": "Critical", "total": 1}, {"alert_type": "Warning", "total": 1}])
+            self.assertEqual(first.removed, [])
+            self.assertGreater(second.watermark, first.watermark)
+            self.assertEqual(second.records, [{"alert_type": "Warning", "total": 2}])
+            self.assertEqual(second.removed, [{"alert_type": "Warning", "total": 1}])
+            self.assertEqual(unchanged, RecordDelta(records=[], removed=[], watermark=second.watermark))
+
+        asyncio.run(scenario())
+
+    def test_watermark_no_longer_cached_sends_every_record(self):
+        async def scenario():
+            # arrange
+            engine = create_async_engine(self.settings.DATABASE_URL, poolclass=NullPool)
+            await self.write(engine, "Critical")
+            first = await self.read(engine, self.query, since=0)
+            await self.write(engine, "Warning")
+            self.snapshots.clear()
+
+            # act
+            delta = await self.read(engine, self.query, since=first.watermark)
+            await engine.dispose()
+
+            # assert
+            self.assertEqual(delta.records, [{"alert_type": "Critical", "total": 1}, {"alert_type": "Warning", "total": 1}])
+            self.assertIsNone(delta.removed)
+
+        asyncio.run(scenario())
+
+    def test_records_copied_in_bulk_move_the_watermark(self):
+        async def scenario():
+            # arrange
+            engine = create_async_engine(self.settings.DATABASE_URL, poolclass=NullPool)
+            await self.write(engine, "Critical")
+            first = await self.read(engine, self.query, since=0)
+            other_query_id = f"delta-{uuid4()}"
+
+            # act
+            async with AsyncSession(engine) as session:
+                await AsyncpgMetricRecordsBulkWriter(session)([
+                    MetricRecordRow(str(uuid4()), query_id, datetime(2025, 6, 10), None, None, None, "Warning", None)
+                    for query_id in (self.query.id, other_query_id, self.query.id)
+                ])
+                await session.commit()
+            delta = await self.read(engine, self.query, since=first.watermark)
+            await engine.dispose()
+
+            # assert
+            self.assertGreater(delta.watermark, first.watermark)
+            self.assertEqual(delta.records, [{"alert_type": "Warning", "total": 2}])
+            self.assertEqual(delta.removed, [])
+
+        asyncio.run(scenario())
+
+    def test_window_relative_to_the_current_date_is_read_again_once_its_day_is_over(self):
+        async def scenario():
+            # arrange
+            engine = create_async_engine(self.settings.DATABASE_URL, poolclass=NullPool)
+            await self.write(engine, "Critical")
+            dated = dataclasses.replace(
+                self.query, query=self.query.query.replace("GROUP BY", "AND CURRENT_DATE > :end_date GROUP BY")
+            )
+            first = await self.read(engine, dated, since=0)
+            unchanged = await self.read(engine, dated, since=first.watermark)
+
+            # act
+            self.snapshots.clear() # snapshots of a dated window expire at midnight
+            moved = await self.read(engine, dated, since=first.watermark)
+            await engine.dispose()
+
+            # assert
+            self.assertEqual(unchanged, RecordDelta(records=[], removed=[], watermark=first.watermark))
+            self.assertEqual(moved, RecordDelta(
+                records=[{"alert_type": "Critical", "total": 1}], removed=None, watermark=first.watermark
+            ))
+
+        asyncio.run(scenario())
+
+    def test_window_relative_to_the_current_date_expires_at_midnight_in_the_session_timezone(self):
+        async def scenario():
+            # arrange
+            zone = ZoneInfo("Pacific/Kiritimati")
+            engine = create_async_engine(
+                self.settings.DATABASE_URL,
+                poolclass=NullPool,
+                connect_args={"server_settings": {"timezone": zone.key}}
+            )
+            await self.write(engine, "Critical")
+            dated = dataclasses.replace(
+                self.query, query=self.query.query.replace("GROUP BY", "AND now()::date > :end_date GROUP BY")
+            )
+            snapshots = self.snapshots
+            self.addCleanup(
+                snapshots.configure, snapshots.ttl_seconds, snapshots.hard_ttl_seconds, snapshots.max_entries, snapshots.max_bytes
+            )
+            snapshots.configure(
+                ttl_seconds=86400, hard_ttl_seconds=86400, max_entries=snapshots.max_entries, max_bytes=snapshots.max_bytes
+            )
+
+            # act
+            with patch("src.infrastructure.caching.DATABASE_TIMEZONE", zone):
+                delta = await self.read(engine, dated, since=0)
+            async with engine.connect() as connection:
+                today = (await connection.execute(text("SELECT CURRENT_DATE"))).scalar_one()
+            await engine.dispose()
+
+            # assert
+            entry = self.snapshots.entries[(dated, DEFAULT_START_DATE, DEFAULT_END_DATE, DEFAULT_DAY_RANGE, delta.watermark)]
+            remaining = entry.expires_at - self.snapshots.clock()
+            self.assertEqual(today, datetime.now(zone).date())
+            self.assertAlmostEqual(remaining, seconds_until_midnight(zone=zone), delta=5)
+
+        asyncio.run(scenario())
+
+    def test_window_that_cant_be_hashed_sends_every_record(self):
+        async def scenario():
+            # arrange
+            engine = create_async_engine(self.settings.DATABASE_URL, poolclass=NullPool)
+            await self.write(engine, "Critical")
+            arrays = dataclasses.replace(self.query, query="SELECT ARRAY[1, 2] AS parts WHERE :day_range > 0")
+
+            # act
+            delta = await self.read(engine, arrays, since=0)
+            await engine.dispose()
+
+            # assert
+            self.assertEqual(delta.records, [{"parts": [1, 2]}])
+            self.assertIsNone(delta.removed)
+            self.assertEqual(len(self.snapshots.entries), 0)
+
+        asyncio.run(scenario())
+
+
+class TestRecordVersions(FastApiTestCase):
+
+    def setUp(self):
+        self.settings = self.client.app.state.services[Settings]
+        CACHE_REGISTRY[RECORDS_CACHE].clear()
+        start_mappers()
+        query_id = f"version-{uuid4()}"
+        self.query = QuerySnapshot(
+            id=query_id,
+            query=f"SELECT alert_type FROM metrics "
+                  f"WHERE id = '{query_id}' AND :day_range > 0 AND date BETWEEN :start_date AND :end_date"
+        )
+
+    async def write(self, engine, alert_type: str):
+        async with AsyncSession(engine) as session:
+            await SqlAlchemyMetricRecordWriter(session)(MetricRecord(
+                metric_id=str(uuid4()),
+                id=self.query.id,
+                date=datetime(2025, 6, 10),
+                alert_type=alert_type
+            ))
+            await session.commit()
+
+    async def version(self, engine) -> str:
+        CACHE_REGISTRY[RECORDS_CACHE].clear()
+        async with AsyncSession(engine) as session:
+            record_set = await SqlAlchemyMetricRecordsReader(session, SilentLogger())(
+                query=self.query,
+                start_date=DEFAULT_START_DATE,
+                end_date=DEFAULT_END_DATE,
+                day_range=DEFAULT_DAY_RANGE
+            )
+            return record_set.version
+
+    def test_version_changes_with_a_write_and_only_with_a_write(self):
+        async def scenario():
+            # arrange
+            engine = create_async_engine(self.settings.DATABASE_URL, poolclass=NullPool)
+            await self.write(engine, "Critical")
+
+            # act
+            first = await self.version(engine)
+            reread = await self.version(engine)
+            await self.write(engine, "Critical")
+            written = await self.version(engine)
+            await engine.dispose()
+
+            # assert
+            self.assertEqual(reread, first)
+            self.assertNotEqual(written, first)
+
+        asyncio.run(scenario())
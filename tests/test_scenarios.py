@@ -1,9 +1,11 @@
 import datetime
 import uuid
+from unittest.mock import patch
 
 from tests import FastApiTestCase, ScenarioContext, ScenarioRunner
 from tests.steps import HealthCheckScenario, GetMetricsScenario, CreateMetricConfigurationScenario, \
-    CreateMetricRecordScenario
+    CreateMetricRecordScenario, StreamMetricRecordsScenario, ExportMetricRecordsScenario, SubscribeToMetricsScenario, \
+    IngestMetricRecordsScenario
 
 
 class TestHealthCheckScenarios(FastApiTestCase):
@@ -96,6 +98,244 @@ class TestGetMetricsScenarios(FastApiTestCase):
             .then_the_response_body_should_match_expected_day_range_filtered_metric() \
             .then_an_info_log_indicates_endpoint_called()
 
+    def test_get_metrics_when_etag_matches(self):
+        scenario = GetMetricsScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_get_metrics_endpoint_is_called_with_metric_configuration_id_and_params(
+                "c797b618-df12-45f7-bbb2-cc6695a48e46",
+                start_date=datetime.date(2025, 6, 1),
+                end_date=datetime.date(2025, 6, 5)) \
+            .then_the_status_code_should_be(200) \
+            .when_the_get_metrics_endpoint_is_called_again_with_the_etag() \
+            .then_the_response_should_not_be_modified()
+
+
+    def test_get_metrics_page_by_page(self):
+        scenario = GetMetricsScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_get_metrics_endpoint_is_called_with_metric_configuration_id_and_params(
+                "c797b618-df12-45f7-bbb2-cc6695a48e46",
+                start_date=datetime.date(2025, 6, 1),
+                end_date=datetime.date(2025, 6, 29),
+                limit=1) \
+            .then_the_status_code_should_be(200) \
+            .when_the_next_page_is_requested() \
+            .then_the_status_code_should_be(200) \
+            .then_the_pages_should_hold_every_record_once([
+                {"alert_type": "Critical", "total_alerts": 1},
+                {"alert_type": "Warning", "total_alerts": 2}
+            ])
+
+    def test_get_metrics_as_columns(self):
+        scenario = GetMetricsScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_get_metrics_endpoint_is_called_with_metric_configuration_id_and_params(
+                "c797b618-df12-45f7-bbb2-cc6695a48e46",
+                start_date=datetime.date(2025, 6, 1),
+                end_date=datetime.date(2025, 6, 28),
+                format="columnar") \
+            .then_the_status_code_should_be(200) \
+            .then_the_records_should_be_columns([
+                {"alert_type": "Critical", "total_alerts": 1},
+                {"alert_type": "Warning", "total_alerts": 2}
+            ])
+
+    def test_get_metrics_when_cursor_is_invalid(self):
+        scenario = GetMetricsScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_get_metrics_endpoint_is_called_with_metric_configuration_id_and_params(
+                "c797b618-df12-45f7-bbb2-cc6695a48e46",
+                limit=1,
+                cursor="not-a-cursor") \
+            .then_the_status_code_should_be(400)
+
+    def test_get_metrics_when_a_downsampled_page_is_asked_for(self):
+        scenario = GetMetricsScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_get_metrics_endpoint_is_called_with_metric_configuration_id_and_params(
+                "c797b618-df12-45f7-bbb2-cc6695a48e46",
+                limit=1,
+                max_points=100) \
+            .then_the_status_code_should_be(400)
+
+    def test_get_metrics_since_a_watermark(self):
+        scenario = GetMetricsScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_get_metrics_endpoint_is_called_with_metric_configuration_id_and_params(
+                "c797b618-df12-45f7-bbb2-cc6695a48e46",
+                start_date=datetime.date(2025, 6, 1),
+                end_date=datetime.date(2025, 6, 24),
+                since=0) \
+            .then_the_status_code_should_be(200) \
+            .then_the_delta_should_hold([
+                {"alert_type": "Critical", "total_alerts": 1},
+                {"alert_type": "Warning", "total_alerts": 2}
+            ], []) \
+            .when_the_metrics_are_polled_since_the_watermark() \
+            .then_the_status_code_should_be(200) \
+            .then_the_delta_should_hold([], [])
+
+    def test_get_metrics_when_a_delta_page_is_asked_for(self):
+        scenario = GetMetricsScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_get_metrics_endpoint_is_called_with_metric_configuration_id_and_params(
+                "c797b618-df12-45f7-bbb2-cc6695a48e46",
+                limit=1,
+                since=0) \
+            .then_the_status_code_should_be(400)
+
+
+class TestStreamMetricRecordsScenarios(FastApiTestCase):
+
+    def setUp(self) -> None:
+        self.context = ScenarioContext(
+            client=self.client,
+            test_case=self,
+            logger=self.test_logger,
+            runner=ScenarioRunner()
+        )
+
+    def tearDown(self) -> None:
+        self.context \
+            .runner \
+            .assert_all()
+
+    def test_stream_records_when_metric_not_found(self):
+        scenario = StreamMetricRecordsScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_stream_records_endpoint_is_called(str(uuid.uuid4())) \
+            .then_the_status_code_should_be(404) \
+            .then_an_info_log_indicates_endpoint_called()
+
+    def test_stream_records_as_a_json_array(self):
+        scenario = StreamMetricRecordsScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_stream_records_endpoint_is_called("c797b618-df12-45f7-bbb2-cc6695a48e46") \
+            .then_the_status_code_should_be(200) \
+            .then_the_content_type_should_be("application/json") \
+            .then_the_body_should_be_the_records([
+                {"alert_type": "Critical", "total_alerts": 1},
+                {"alert_type": "Warning", "total_alerts": 2}
+            ]) \
+            .then_an_info_log_indicates_endpoint_called()
+
+    def test_stream_records_as_ndjson(self):
+        scenario = StreamMetricRecordsScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_stream_records_endpoint_is_called(
+                "c797b618-df12-45f7-bbb2-cc6695a48e46",
+                accept="application/x-ndjson",
+                start_date=datetime.date(2025, 6, 1),
+                end_date=datetime.date(2025, 6, 3)) \
+            .then_the_status_code_should_be(200) \
+            .then_the_content_type_should_be("application/x-ndjson") \
+            .then_each_line_should_be_a_record([
+                {"alert_type": "Critical", "total_alerts": 1},
+                {"alert_type": "Warning", "total_alerts": 1}
+            ]) \
+            .then_an_info_log_indicates_endpoint_called()
+
+
+class TestExportMetricRecordsScenarios(FastApiTestCase):
+
+    def setUp(self) -> None:
+        self.context = ScenarioContext(
+            client=self.client,
+            test_case=self,
+            logger=self.test_logger,
+            runner=ScenarioRunner()
+        )
+
+    def tearDown(self) -> None:
+        self.context \
+            .runner \
+            .assert_all()
+
+    def test_export_records_when_metric_not_found(self):
+        scenario = ExportMetricRecordsScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_export_records_endpoint_is_called(str(uuid.uuid4()), "csv") \
+            .then_the_status_code_should_be(404) \
+            .then_an_info_log_indicates_endpoint_called()
+
+    def test_export_records_as_csv(self):
+        scenario = ExportMetricRecordsScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_export_records_endpoint_is_called(
+                "c797b618-df12-45f7-bbb2-cc6695a48e46",
+                "csv",
+                end_date=datetime.date(2025, 6, 27)) \
+            .then_the_status_code_should_be(200) \
+            .then_the_content_type_should_be("text/csv; charset=utf-8") \
+            .then_the_csv_rows_should_be_the_records([
+                {"alert_type": "Critical", "total_alerts": "1"},
+                {"alert_type": "Warning", "total_alerts": "2"}
+            ]) \
+            .then_an_info_log_indicates_endpoint_called()
+
+    def test_export_records_as_an_arrow_stream(self):
+        scenario = ExportMetricRecordsScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_export_records_endpoint_is_called(
+                "c797b618-df12-45f7-bbb2-cc6695a48e46",
+                "arrow",
+                end_date=datetime.date(2025, 6, 26)) \
+            .then_the_status_code_should_be(200) \
+            .then_the_content_type_should_be("application/vnd.apache.arrow.stream") \
+            .then_the_arrow_stream_should_hold_the_records([
+                {"alert_type": "Critical", "total_alerts": 1},
+                {"alert_type": "Warning", "total_alerts": 2}
+            ]) \
+            .then_an_info_log_indicates_endpoint_called()
+
+
+class TestSubscribeToMetricsScenarios(FastApiTestCase):
+
+    def setUp(self) -> None:
+        self.context = ScenarioContext(
+            client=self.client,
+            test_case=self,
+            logger=self.test_logger,
+            runner=ScenarioRunner()
+        )
+
+    def tearDown(self) -> None:
+        self.context \
+            .runner \
+            .assert_all()
+
+    def test_subscribe_when_metric_not_found(self):
+        scenario = SubscribeToMetricsScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_updates_websocket_is_opened(str(uuid.uuid4())) \
+            .then_the_websocket_should_be_closed_with(4404) \
+            .then_an_info_log_indicates_endpoint_called()
+
+    def test_subscribe_and_receive_a_created_record(self):
+        scenario = SubscribeToMetricsScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_updates_websocket_is_opened("c797b618-df12-45f7-bbb2-cc6695a48e46") \
+            .then_the_first_message_should_hold_the_whole_window() \
+            .when_a_metric_record_is_created("Critical") \
+            .then_the_next_message_should_count_the_record() \
+            .and_the_websocket_is_closed() \
+            .then_an_info_log_indicates_endpoint_called()
+
 
 class TestCreateMetricConfigurationScenarios(FastApiTestCase):
 
@@ -122,6 +362,24 @@ class TestCreateMetricConfigurationScenarios(FastApiTestCase):
             .then_the_metrics_should_have_been_created() \
             .then_an_info_log_indicates_endpoint_called()
 
+    def test_create_metric_record_after_metrics_are_read(self):
+        scenario = CreateMetricConfigurationScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_create_metric_configuration_endpoint_is_called_with_metric_configuration() \
+            .and_the_metrics_are_read() \
+            .and_data_is_created_for_the_metric() \
+            .then_the_metrics_should_have_been_created()
+
+    def test_etag_changes_after_metric_record_is_created(self):
+        scenario = CreateMetricConfigurationScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_create_metric_configuration_endpoint_is_called_with_metric_configuration() \
+            .and_the_metrics_are_read() \
+            .and_data_is_created_for_the_metric() \
+            .then_the_previous_etag_should_no_longer_match()
+
 
 class TestCreateMetricRecordScenarios(FastApiTestCase):
 
@@ -152,4 +410,81 @@ class TestCreateMetricRecordScenarios(FastApiTestCase):
             .given_i_have_an_app_running() \
             .when_the_create_metric_data_endpoint_is_called("073ac9db-c16e-4d04-9f25-6fc01d4ac380") \
             .then_the_status_code_should_be(201) \
-            .then_an_info_log_indicates_endpoint_called()
\ No newline at end of file
+            .then_an_info_log_indicates_endpoint_called()
+
+
+class TestIngestMetricRecordsScenarios(FastApiTestCase):
+
+    def setUp(self) -> None:
+        self.context = ScenarioContext(
+            client=self.client,
+            test_case=self,
+            logger=self.test_logger,
+            runner=ScenarioRunner()
+        )
+
+    def tearDown(self) -> None:
+        self.context \
+            .runner \
+            .assert_all()
+
+    def test_ingest_records_for_several_configurations(self):
+        scenario = IngestMetricRecordsScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_ingest_endpoint_is_called_with([
+                {"metric_configuration_id": "c797b618-df12-45f7-bbb2-cc6695a48e46", "date": "2024-03-05T08:00:00",
+                 "alert_type": "Critical"},
+                {"metric_configuration_id": "53aaf9d4-04d3-43d3-9f40-6ce4a9282a5c", "date": "2024-03-05T00:00:00",
+                 "obsolescence_val": 4.5},
+                {"metric_configuration_id": "c797b618-df12-45f7-bbb2-cc6695a48e46", "parts_flagged": "many"},
+                {"metric_configuration_id": str(uuid.uuid4()), "alert_type": "Critical"},
+                {"metric_configuration_id": "c797b618-df12-45f7-bbb2-cc6695a48e46", "date": "2024-03-05T10:00:00",
+                 "alert_type": "Critical"},
+            ]) \
+            .then_the_status_code_should_be(200) \
+            .then_the_response_should_report(created=3, errors=[(2, "parts_flagged"), (3, "Metric not found")]) \
+            .then_the_metrics_on_the_day_should_be(
+                "c797b618-df12-45f7-bbb2-cc6695a48e46",
+                datetime.date(2024, 3, 5),
+                [{"alert_type": "Critical", "total_alerts": 2}]) \
+            .then_the_metrics_on_the_day_should_be(
+                "53aaf9d4-04d3-43d3-9f40-6ce4a9282a5c",
+                datetime.date(2024, 3, 5),
+                [{"day": "2024-03-05", "amount": 4.5}]) \
+            .then_an_info_log_indicates_endpoint_called()
+
+    def test_ingest_records_as_ndjson(self):
+        scenario = IngestMetricRecordsScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_ingest_endpoint_is_called_with([
+                {"metric_configuration_id": "c797b618-df12-45f7-bbb2-cc6695a48e46", "date": "2024-03-06T08:00:00",
+                 "alert_type": "Warning"},
+                '{"metric_configuration_id": ',
+            ], ndjson=True) \
+            .then_the_status_code_should_be(200) \
+            .then_the_response_should_report(created=1, errors=[(1, "")]) \
+            .then_the_metrics_on_the_day_should_be(
+                "c797b618-df12-45f7-bbb2-cc6695a48e46",
+                datetime.date(2024, 3, 6),
+                [{"alert_type": "Warning", "total_alerts": 1}]) \
+            .then_an_info_log_indicates_endpoint_called()
+
+    def test_ingest_records_when_the_body_is_not_an_array(self):
+        scenario = IngestMetricRecordsScenario(self.context)
+        scenario \
+            .given_i_have_an_app_running() \
+            .when_the_ingest_endpoint_is_called_with('{"alert_type": "Critical"}') \
+            .then_the_status_code_should_be(400)
+
+    def test_ingest_records_when_the_body_is_too_large(self):
+        rows = [{"metric_configuration_id": "c797b618-df12-45f7-bbb2-cc6695a48e46", "alert_type": "Critical"}] * 3
+        with patch("src.web.routes.MAX_INGEST_BYTES", 100):
+            scenario = IngestMetricRecordsScenario(self.context)
+            scenario \
+                .given_i_have_an_app_running() \
+                .when_the_ingest_endpoint_is_called_with(rows) \
+                .then_the_status_code_should_be(413) \
+                .when_the_ingest_endpoint_is_called_with(rows, chunked=True) \
+                .then_the_status_code_should_be(413)
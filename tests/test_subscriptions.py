@@ -0,0 +1,230 @@
+import asyncio
+import json
+from datetime import date
+from types import SimpleNamespace
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+from src.core import MetricConfigurationSnapshot, QuerySnapshot, RecordDelta, MetricsDelta, DEFAULT_START_DATE, \
+    DEFAULT_END_DATE, DEFAULT_DAY_RANGE
+from src.infrastructure.subscriptions import InProcessMetricUpdates, applied
+from src.web.encoding import encode_events
+
+QUERY = QuerySnapshot(id="q1", query="SELECT 1")
+CONFIGURATION = MetricConfigurationSnapshot(
+    id="c1", query_id="q1", is_editable=True, query=QUERY, layouts=(), version="v1"
+)
+WINDOW = (DEFAULT_START_DATE, DEFAULT_END_DATE, DEFAULT_DAY_RANGE)
+
+
+class SilentLogger:
+
+    def info(self, msg, *args, **kwargs): ...
+    def warning(self, msg, *args, **kwargs): ...
+    def error(self, msg, *args, **kwargs): ...
+
+
+def encode(metrics: MetricsDelta) -> bytes:
+    delta = metrics.delta
+    return json.dumps({"records": delta.records, "removed": delta.removed, "watermark": delta.watermark}).encode()
+
+
+class ScriptedUpdates(InProcessMetricUpdates):
+    """
+    a hub reading from a window kept in memory, each write is a new watermark
+    """
+    __slots__ = "windows", "reads", "blocked", "failures"
+
+    def __init__(self, queue_size: int = 16):
+        settings = SimpleNamespace(SUBSCRIPTION_QUEUE_SIZE=queue_size, SUBSCRIPTION_RETRY_SECONDS=0.01)
+        super().__init__(settings, SilentLogger(), pool=None)
+        self.windows: list[list[dict]] = [[]]
+        self.reads: list[int] = []
+        self.blocked: asyncio.Event = asyncio.Event()
+        self.blocked.set()
+        self.failures: list[Exception] = []
+
+    def write(self, records: list[dict]):
+        self.windows.append(records)
+        self.changed(QUERY.id)
+
+    async def read(self, configuration, start_date: date, end_date: date, day_range: int, since: int) -> RecordDelta:
+        self.reads.append(since)
+        if self.failures:
+            raise self.failures.pop()
+        await self.blocked.wait()
+        watermark = len(self.windows) - 1
+        if watermark <= since:
+            return RecordDelta(records=[], removed=[], watermark=since)
+        previous, current = self.windows[since], self.windows[watermark]
+        return RecordDelta(
+            records=[record for record in current if record not in previous],
+            removed=[record for record in previous if record not in current],
+            watermark=watermark
+        )
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+class TestInProcessMetricUpdates(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.updates = ScriptedUpdates()
+        self.updates.write([{"alert_type": "Warning", "total": 1}])
+
+    async def asyncTearDown(self):
+        await self.updates.stop()
+
+    async def next_message(self, subscription) -> dict:
+        return json.loads(await asyncio.wait_for(anext(subscription), timeout=1))
+
+    async def test_each_change_is_read_once_for_every_subscriber(self):
+        # arrange
+        first = self.updates.subscribe(CONFIGURATION, *WINDOW, encode=encode)
+        second = self.updates.subscribe(CONFIGURATION, *WINDOW, encode=encode)
+        windows = [await self.next_message(first), await self.next_message(second)]
+        reads = len(self.updates.reads)
+
+        # act
+        self.updates.write([{"alert_type": "Warning", "total": 2}])
+        changes = [await self.next_message(first), await self.next_message(second)]
+
+        # assert
+        self.assertEqual(windows, [{"records": [{"alert_type": "Warning", "total": 1}], "removed": None, "watermark": 1}] * 2)
+        self.assertEqual(changes, [{
+            "records": [{"alert_type": "Warning", "total": 2}],
+            "removed": [{"alert_type": "Warning", "total": 1}],
+            "watermark": 2
+        }] * 2)
+        self.assertEqual(self.updates.reads[reads:], [1])
+
+    async def test_changes_during_a_read_are_read_together(self):
+        # arrange
+        subscription = self.updates.subscribe(CONFIGURATION, *WINDOW, encode=encode)
+        await self.next_message(subscription)
+        self.updates.blocked.clear()
+        self.updates.write([{"alert_type": "Warning", "total": 2}])
+        await settle()
+
+        # act
+        self.updates.write([{"alert_type": "Warning", "total": 3}])
+        self.updates.write([{"alert_type": "Warning", "total": 4}])
+        self.updates.blocked.set()
+        change = await self.next_message(subscription)
+        await settle()
+
+        # assert
+        self.assertEqual(change, {
+            "records": [{"alert_type": "Warning", "total": 4}],
+            "removed": [{"alert_type": "Warning", "total": 1}],
+            "watermark": 4
+        })
+        self.assertEqual(self.updates.reads, [0, 1, 4])
+        self.assertTrue(subscription.queue.empty())
+
+    async def test_a_lagging_subscriber_is_sent_the_window_in_full(self):
+        # arrange
+        self.updates = ScriptedUpdates(queue_size=2)
+        self.updates.write([{"alert_type": "Warning", "total": 1}])
+        subscription = self.updates.subscribe(CONFIGURATION, *WINDOW, encode=encode)
+        await settle()
+
+        # act
+        for total in range(2, 6):
+            self.updates.write([{"alert_type": "Warning", "total": total}])
+            await settle()
+
+        # assert
+        self.assertEqual(subscription.queue.qsize(), 1)
+        self.assertEqual(
+            await self.next_message(subscription),
+            {"records": [{"alert_type": "Warning", "total": 5}], "removed": None, "watermark": 5}
+        )
+
+    async def test_closing_the_last_subscription_stops_its_window(self):
+        # arrange
+        first = self.updates.subscribe(CONFIGURATION, *WINDOW, encode=encode)
+        second = self.updates.subscribe(CONFIGURATION, *WINDOW, encode=encode)
+        topic = first.topic
+
+        # act
+        first.close()
+        still_open = dict(self.updates.topics)
+        second.close()
+        await settle()
+
+        # assert
+        self.assertEqual(list(still_open.values()), [topic])
+        self.assertEqual(self.updates.topics, {})
+        self.assertEqual(self.updates.by_query, {})
+        self.assertTrue(topic.task.cancelled())
+
+    async def test_a_window_relative_to_the_current_date_is_read_at_midnight(self):
+        # arrange
+        query = QuerySnapshot(id="q1", query="SELECT CURRENT_DATE")
+        configuration = MetricConfigurationSnapshot(
+            id="c1", query_id="q1", is_editable=True, query=query, layouts=(), version="v1"
+        )
+
+        # act
+        with patch("src.infrastructure.readers.seconds_until_midnight", return_value=0.01):
+            subscription = self.updates.subscribe(configuration, *WINDOW, encode=encode)
+            await self.next_message(subscription)
+            await asyncio.sleep(0.05)
+
+        # assert
+        self.assertGreater(len(self.updates.reads), 2)
+        self.assertEqual(set(self.updates.reads[1:]), {1})
+
+    async def test_failed_reads_are_retried(self):
+        # arrange
+        self.updates.failures.append(RuntimeError("connection lost"))
+
+        # act
+        subscription = self.updates.subscribe(CONFIGURATION, *WINDOW, encode=encode)
+        window = await self.next_message(subscription)
+
+        # assert
+        self.assertEqual(window["records"], [{"alert_type": "Warning", "total": 1}])
+        self.assertEqual(self.updates.reads, [0, 0])
+
+
+class TestApplied(TestCase):
+
+    def test_removed_records_are_replaced_by_added_ones(self):
+        # act
+        records = applied(
+            [{"a": 1}, {"a": 1}, {"a": 2}],
+            RecordDelta(records=[{"a": 3}], removed=[{"a": 1}], watermark=2)
+        )
+
+        # assert
+        self.assertCountEqual(records, [{"a": 1}, {"a": 2}, {"a": 3}])
+
+    def test_unknown_removals_replace_every_record(self):
+        # act
+        records = applied([{"a": 1}], RecordDelta(records=[{"a": [2]}], removed=None, watermark=2))
+
+        # assert
+        self.assertEqual(records, [{"a": [2]}])
+
+
+class TestEncodeEvents(IsolatedAsyncioTestCase):
+
+    async def test_messages_are_events_with_heartbeats_between(self):
+        # arrange
+        async def messages():
+            yield b'{"watermark":1}'
+            await asyncio.sleep(0.05)
+            yield b'{"watermark":2}'
+
+        # act
+        events = [event async for event in encode_events(messages(), heartbeat_seconds=0.02)]
+
+        # assert
+        self.assertEqual(events[0], b'data: {"watermark":1}\n\n')
+        self.assertIn(b": heartbeat\n\n", events[1:-1])
+        self.assertEqual(events[-1], b'data: {"watermark":2}\n\n')